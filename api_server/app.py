@@ -1,13 +1,20 @@
 from flask import Flask, request, redirect, jsonify
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import logging
 import os
 import yaml
 import json
 import shutil
+import sys
+import tempfile
 import time
-import urllib
 import requests
 
+from catalog import Catalog, decode_cursor
+from jobs import JobManager
+from materialize import materialize_file, materialize_tree, publish_tree
+
 
 class PerfInsightManager():
     # Shared functions
@@ -33,18 +40,119 @@ class PerfInsightManager():
         LOG.debug('No candidate can be found.')
         return ''
 
+    # Cache Functions
+    def _get_cache_key(self, files):
+        """Get the cache key from the content of files.
+
+        Input:
+            files - A list of files which determine the cached data
+        Return:
+            - The hex digest of the files.
+        """
+        sha = hashlib.sha256()
+
+        for file in files:
+            file_sha = hashlib.sha256()
+            with open(file, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    file_sha.update(chunk)
+            sha.update(file_sha.digest())
+
+        return sha.hexdigest()
+
+    def _fetch_cached_results(self, key, target):
+        """Fetch the testrun results from the cache.
+
+        Input:
+            key    - The cache key
+            target - Where to put the testrun results
+        Return:
+            - True if the cache hits, or
+            - False if the cache misses.
+        """
+        cache_file = os.path.join(RESULTS_CACHE_PATH, '{}.csv'.format(key))
+
+        try:
+            materialize_file(cache_file, target, MATERIALIZE_STRATEGIES,
+                             writable=True)
+            # Mark it as recently used
+            os.utime(cache_file)
+        except FileNotFoundError:
+            LOG.debug('Cache missed: {}'.format(key))
+            return False
+        except Exception as err:
+            LOG.warning('Failed to fetch "{}" from cache. error: {}'.format(
+                cache_file, err))
+            return False
+
+        LOG.debug('Cache hit: {}'.format(key))
+        return True
+
+    def _store_cached_results(self, key, source):
+        """Store the testrun results into the cache.
+
+        The least recently used results will be evicted if the size of the
+        cache exceeds the limit.
+
+        Input:
+            key    - The cache key
+            source - The file of testrun results
+        """
+        if RESULTS_CACHE_SIZE <= 0:
+            return
+
+        cache_file = os.path.join(RESULTS_CACHE_PATH, '{}.csv'.format(key))
+        temp_file = None
+
+        try:
+            os.makedirs(RESULTS_CACHE_PATH, exist_ok=True)
+
+            # Copy to a temporary file then rename it atomically, the
+            # temporary file is unique to the thread storing the same key
+            (fd, temp_file) = tempfile.mkstemp(
+                prefix='{}.'.format(key), suffix='.tmp',
+                dir=RESULTS_CACHE_PATH)
+            os.close(fd)
+            shutil.copyfile(source, temp_file)
+            shutil.copymode(source, temp_file)
+            os.replace(temp_file, cache_file)
+            temp_file = None
+            LOG.debug('Cache stored: {}'.format(key))
+
+            # Evict the least recently used results
+            entries = []
+            for entry in os.scandir(RESULTS_CACHE_PATH):
+                if entry.is_file() and entry.name.endswith('.csv'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total = sum(x[1] for x in entries)
+            for mtime, size, path in sorted(entries):
+                if total <= RESULTS_CACHE_SIZE * 1024 * 1024:
+                    break
+                os.unlink(path)
+                total -= size
+                LOG.debug('Cache evicted: {}'.format(path))
+
+        except Exception as err:
+            LOG.warning('Failed to store "{}" into cache. error: {}'.format(
+                source, err))
+            if temp_file and os.path.exists(temp_file):
+                os.unlink(temp_file)
+
     # TestRun Functions
-    def query_testruns(self):
-        """Query all the TestRunIDs from PERF_INSIGHT_ROOT.
+    def query_testruns(self, **search):
+        """Query the TestRunIDs from PERF_INSIGHT_ROOT.
 
         Input:
-            None
+            search - The search args of Catalog.search (filters, date_from,
+                     date_to, sort, reverse, limit, cursor and fields), the
+                     date range is of "testrun-date"
         Return:
             - (True, json-block), or
             - (False, message) if something goes wrong.
         """
 
-        testruns = []
         valid_prefix = ('fio_', 'uperf_')
         search_path = os.path.join(PERF_INSIGHT_ROOT, 'testruns')
 
@@ -53,14 +161,10 @@ class PerfInsightManager():
             LOG.error(msg)
             return False, msg
 
-        for entry in os.listdir(search_path):
-            if not os.path.isdir(os.path.join(search_path, entry)):
-                continue
-            if entry.startswith(valid_prefix):
-                LOG.debug('Found TestRunID "{}".'.format(entry))
-                testruns.append({'id': entry})
+        testruns, cursor = catalog.search(
+            'testruns', valid_prefix, date_field='testrun-date', **search)
 
-        return True, {'testruns': testruns}
+        return True, {'testruns': testruns, 'next': cursor}
 
     def inspect_testrun(self, id):
         """Inspect a specified TestRunID from PERF_INSIGHT_ROOT.
@@ -73,8 +177,8 @@ class PerfInsightManager():
         """
 
         # Criteria check
-        search_path = os.path.join(PERF_INSIGHT_ROOT, 'testruns', id)
-        if not os.path.isdir(search_path):
+        entry = catalog.inspect('testruns', id)
+        if entry is None:
             msg = 'TestRunID "{}" does not exist.'.format(id)
             LOG.error(msg)
             return False, msg
@@ -83,18 +187,10 @@ class PerfInsightManager():
         url = 'http://{}/perf-insight/testruns/{}/'.format(FILE_SERVER, id)
         testrun = {'id': id, 'url': url}
 
-        # Get metadata
-        try:
-            metadata_file = os.path.join(search_path, 'metadata.json')
-            with open(metadata_file, 'r') as f:
-                metadata = json.load(f)
-        except Exception as err:
-            msg = 'Failed to get metadata from {}. error: {}'.format(
-                metadata_file, err)
-            LOG.warning(msg)
-            metadata = None
-
-        testrun.update({'metadata': metadata})
+        # Get metadata and the file info from the catalog
+        testrun.update({'metadata': entry['metadata'],
+                        'size': entry['size'],
+                        'mtime': entry['mtime']})
 
         # Get datastore
         # try:
@@ -175,7 +271,8 @@ class PerfInsightManager():
         # Deal with the files
         try:
             if SAFE_MODE:
-                shutil.copytree(workspace, target)
+                publish_tree(workspace, target, MATERIALIZE_STRATEGIES,
+                             keep_source=True)
                 shutil.move(workspace, os.path.join(
                     PERF_INSIGHT_RBIN,
                     '.deleted_after_loading_{}__{}'.format(
@@ -183,14 +280,85 @@ class PerfInsightManager():
                                       time.localtime()),
                         os.path.basename(workspace))))
             else:
-                shutil.move(workspace, target)
+                publish_tree(workspace, target, MATERIALIZE_STRATEGIES)
         except Exception as err:
             msg = 'Failed to deal with the files. error: {}'.format(err)
             LOG.error(msg)
             return False, msg
 
+        catalog.refresh('testruns', id)
+
         return True, testrun
 
+    def _get_http_session(self):
+        """Get a HTTP session, its connection pool is shared by the
+        download workers."""
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=IMPORT_WORKERS, pool_maxsize=IMPORT_WORKERS)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _download_file(self, session, url, path):
+        """Download a file, retry on failures.
+
+        Input:
+            session - The HTTP session
+            url     - The URL of the file
+            path    - Where to put the file
+        Return:
+            - (True, json-block) with the timing, or
+            - (False, message) if all the attempts fail.
+        """
+        start_time = time.time()
+        for attempt in range(1, IMPORT_RETRIES + 2):
+            try:
+                with session.get(url, stream=True, timeout=60) as response:
+                    response.raise_for_status()
+                    # Write to a temporary file in case of the failures
+                    with open(path + '.part', 'wb') as f:
+                        for chunk in response.iter_content(chunk_size=65536):
+                            f.write(chunk)
+                os.replace(path + '.part', path)
+                break
+            except (requests.exceptions.RequestException, OSError) as err:
+                LOG.warning('Failed to download {} (attempt {}): {}'.format(
+                    url, attempt, err))
+                if attempt > IMPORT_RETRIES:
+                    msg = 'Failed to download {}: {}'.format(url, err)
+                    LOG.error(msg)
+                    return False, msg
+                time.sleep(attempt)
+
+        seconds = round(time.time() - start_time, 3)
+        size = os.path.getsize(path)
+        LOG.debug('Downloaded "{}" as "{}" ({} bytes in {}s).'.format(
+            url, path, size, seconds))
+
+        return True, {'url': url, 'size': size, 'time': seconds,
+                      'attempts': attempt}
+
+    def _download_files(self, downloads):
+        """Download the files concurrently.
+
+        Input:
+            downloads - A list of (url, path) to be downloaded
+        Return:
+            - (True, [json-block]) with the timing of each file, or
+            - (False, message) if any file fails.
+        """
+        with self._get_http_session() as session, \
+                ThreadPoolExecutor(max_workers=IMPORT_WORKERS) as executor:
+            results = list(executor.map(
+                lambda x: self._download_file(session, *x), downloads))
+
+        for res, con in results:
+            if not res:
+                return False, con
+
+        return True, [con for res, con in results]
+
     def import_testrun(self, id, create_datastore, update_dashboard,
                        metadata, external_urls):
         """Import TestRun from external pbench server.
@@ -213,12 +381,6 @@ class PerfInsightManager():
             LOG.error(msg)
             return False, msg
 
-        workspace = os.path.join(PERF_INSIGHT_STAG, id)
-        if os.path.isdir(workspace):
-            LOG.warning(
-                'Folder "{}" already exists in the staging area and will be overwritten.'.format(id))
-            shutil.rmtree(workspace, ignore_errors=True)
-
         testrun_type = metadata.get('testrun-type')
         if testrun_type is None:
             msg = '"testrun-type" must be provisioned in metadata.'
@@ -239,26 +401,44 @@ class PerfInsightManager():
                 LOG.error(msg)
                 return False, msg
 
-        # Create a workspace in the staging area
+        # Create a workspace in the scratch area, the TestRun is published
+        # at the end and the scratch area is removed anyway
+        os.makedirs(PERF_INSIGHT_SCRATCH, exist_ok=True)
+        scratch = tempfile.mkdtemp(prefix='import_', dir=PERF_INSIGHT_SCRATCH)
+        try:
+            return self._import_testrun(os.path.join(scratch, id), id,
+                                        create_datastore, update_dashboard,
+                                        metadata, external_urls)
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    def _import_testrun(self, workspace, id, create_datastore,
+                        update_dashboard, metadata, external_urls):
+        """Import TestRun in the workspace and publish it."""
+        target = os.path.join(PERF_INSIGHT_ROOT, 'testruns', id)
         os.makedirs(workspace)
 
-        # Retrive data from the URLs
+        # Download the result.json files from the URLs concurrently
+        downloads = []
         for url in external_urls:
             url = url.strip('/')
             subfolder = os.path.join(workspace, os.path.basename(url))
+            os.makedirs(subfolder)
+            downloads.append((url + '/result.json',
+                              os.path.join(subfolder, 'result.json')))
+
+        start_time = time.time()
+        res, con = self._download_files(downloads)
+        if not res:
+            return False, con
+        downloads = con
+        LOG.info('Downloaded {} files in {}s.'.format(
+            len(downloads), round(time.time() - start_time, 3)))
 
-            # Download the result.json file
-            from_file = url + '/result.json'
-            to_file = os.path.join(subfolder, 'result.json')
-
-            LOG.debug('Downloading "{}" as "{}".'.format(from_file, to_file))
-            try:
-                os.makedirs(subfolder)
-                urllib.request.urlretrieve(from_file, to_file)
-            except Exception as e:
-                msg = 'Failed to download {}: {}'.format(from_file, e)
-                LOG.error(msg)
-                return False, msg
+        # Retrive data from the URLs
+        for url in external_urls:
+            url = url.strip('/')
+            subfolder = os.path.join(workspace, os.path.basename(url))
 
             # Write down external_url.txt
             with open(os.path.join(subfolder, 'external_url.txt'), 'w') as f:
@@ -308,7 +488,8 @@ class PerfInsightManager():
         # Deal with the files
         try:
             if SAFE_MODE:
-                shutil.copytree(workspace, target)
+                publish_tree(workspace, target, MATERIALIZE_STRATEGIES,
+                             keep_source=True)
                 shutil.move(workspace, os.path.join(
                     PERF_INSIGHT_RBIN,
                     '.deleted_after_importing_{}__{}'.format(
@@ -316,13 +497,15 @@ class PerfInsightManager():
                                       time.localtime()),
                         os.path.basename(workspace))))
             else:
-                shutil.move(workspace, target)
+                publish_tree(workspace, target, MATERIALIZE_STRATEGIES)
         except Exception as err:
             msg = 'Failed to deal with the files. error: {}'.format(err)
             LOG.error(msg)
             return False, msg
 
-        return True, {'id': id, 'metadata': metadata}
+        catalog.refresh('testruns', id)
+
+        return True, {'id': id, 'metadata': metadata, 'downloads': downloads}
 
     def bulk_import_testrun(self, pbench_user, pbench_controller, pbench_prefix,
                             create_datastore, update_dashboard,
@@ -388,13 +571,25 @@ class PerfInsightManager():
             LOG.error(msg)
             return False, msg
 
-        # Get metadata.json
+        # Get metadata.json, the candidates are fetched concurrently and
+        # the first available one is used
+        def _get_metadata(session, url):
+            try:
+                html = session.get(url + 'metadata.json', timeout=60)
+            except requests.exceptions.RequestException as err:
+                LOG.debug('Failed to get "{}metadata.json": {}'.format(
+                    url, err))
+                return None
+            return html.text if html.status_code == 200 else None
+
         metadata = {}
-        for external_url in external_urls:
-            html = requests.get(external_url + 'metadata.json')
-            if html.status_code == 200:
-                metadata = json.loads(html.text)
-                break
+        with self._get_http_session() as session, \
+                ThreadPoolExecutor(max_workers=IMPORT_WORKERS) as executor:
+            for text in executor.map(lambda x: _get_metadata(session, x),
+                                     external_urls):
+                if text is not None:
+                    metadata = json.loads(text)
+                    break
 
         if metadata:
             LOG.debug('Retrived Metadata: "{}".'.format(metadata))
@@ -441,7 +636,8 @@ class PerfInsightManager():
         LOG.info('Create datastore for the TestRun.')
 
         cmd = '{}/utils/gather_testrun_datastore.py --logdir {} \
-            --output {}/datastore.json'.format(PERF_INSIGHT_REPO, workspace, workspace)
+            --streaming --sidecar --output {}/datastore.json'.format(
+            PERF_INSIGHT_REPO, workspace, workspace)
         res = os.system(cmd)
 
         if res == 0:
@@ -494,12 +690,15 @@ class PerfInsightManager():
         metadata = os.path.join(workspace, 'metadata.json')
         dbloader = os.path.join(workspace, '.testrun_results_dbloader.csv')
 
-        cmd = '{}/utils/generate_testrun_results.py --config {} --datastore {} \
-            --metadata {} --output-format csv --output {}'.format(
-            PERF_INSIGHT_REPO, config, datastore, metadata, dbloader)
-        res = os.system(cmd)
-        if res > 0:
-            msg = 'Failed to create DB loader CSV.'
+        try:
+            args = generate_testrun_results.ARG_PARSER.parse_args([
+                '--config', config, '--datastore', datastore, '--metadata',
+                metadata, '--output-format', 'csv', '--output', dbloader])
+            gen = generate_testrun_results.TestrunResultsGenerator(args)
+            gen.dump_to_file()
+        except (Exception, SystemExit) as err:
+            # The generator exits on the invalid configurations
+            msg = 'Failed to create DB loader CSV. error: {}'.format(err)
             LOG.error(msg)
             return False, msg
 
@@ -513,28 +712,21 @@ class PerfInsightManager():
             return False, msg
 
         if testrun_type == 'fio':
-            flag = '--storage'
+            mode = 'storage'
         elif testrun_type == 'uperf':
-            flag = '--network'
+            mode = 'network'
         else:
             msg = 'Unsupported TestRun Type "{}" for "flask_load_db.py".'.format(
                 testrun_type)
             LOG.error(msg)
             return False, msg
 
-        cmd = '{}/utils/flask_load_db.py {} --db_file {} --delete {}'.format(
-            PERF_INSIGHT_REPO, flag, db_file, testrun_id)
-        res = os.system(cmd)
-        if res > 0:
-            msg = 'Failed to clean up specified TestRunID from database.'
-            LOG.error(msg)
-            return False, msg
-
-        cmd = '{}/utils/flask_load_db.py {} --db_file {} --csv_file {}'.format(
-            PERF_INSIGHT_REPO, flag, db_file, dbloader)
-        res = os.system(cmd)
-        if res > 0:
-            msg = 'Failed to load specified TestRunID into database.'
+        # Replace the TestRun and its TestResults in a single transaction
+        res = flask_load_db.testrun_replace(db_file, mode, gen.dataframe,
+                                            is_wal=DASHBOARD_DB_WAL)
+        if res is False:
+            msg = 'Failed to load specified TestRunID "{}" into database.'.format(
+                testrun_id)
             LOG.error(msg)
             return False, msg
 
@@ -563,9 +755,10 @@ class PerfInsightManager():
             LOG.error(msg)
             return False, msg
 
-        # Deal with the files
+        # Deal with the files, they may be modified in the staging area
         try:
-            shutil.copytree(source, target)
+            materialize_tree(source, target, MATERIALIZE_STRATEGIES,
+                             writable=True)
         except Exception as err:
             msg = 'Failed to deal with the files. error: {}'.format(err)
             LOG.error(msg)
@@ -627,20 +820,93 @@ class PerfInsightManager():
             LOG.error(msg)
             return False, msg
 
+        catalog.refresh('testruns', id)
+
         return True, {'id': id}
 
     # Benchmark Functions
-    def query_benchmarks(self):
-        """Query all Benchmark reports from PERF_INSIGHT_ROOT.
+    def _deliver_scripts(self, workspace):
+        """Deliver the scripts of the report pipeline into the workspace.
+
+        Input:
+            workspace - the path of the workspace.
+        """
+        os.makedirs(os.path.join(workspace, 'utils'), exist_ok=True)
+
+        script_list = ['generate_testrun_results.py',
+                       'generate_benchmark_results.py',
+                       'generate_benchmark_metadata.py',
+                       'generate_benchmark_parameters.py',
+                       'generate_benchmark_statistics.py',
+                       'generate_benchmark_summary.py',
+                       'report_pipeline.py']
+        for filename in script_list:
+            shutil.copyfile(
+                os.path.join(PERF_INSIGHT_REPO, 'utils', filename),
+                os.path.join(workspace, 'utils', filename))
+
+        shutil.copyfile(
+            os.path.join(PERF_INSIGHT_REPO, 'jupyter_server',
+                         'utils', 'html_report.sh'),
+            os.path.join(workspace, 'utils', 'html_report.sh'))
+
+        shutil.copyfile(
+            os.path.join(PERF_INSIGHT_REPO, 'jupyter_server',
+                         'utils', 'report_portal.ipynb'),
+            os.path.join(workspace, 'report_portal.ipynb'))
+
+    def _generate_report(self, benchmark, regenerate=False, force=False):
+        """Generate the report in the staging area with Jupyter server.
 
         Input:
-            None
+            benchmark  - the benchmark ID
+            regenerate - regenerate an existing report
+            force      - execute all the stages of the report pipeline
+        Return:
+            - (True, None), or
+            - (False, message) if something goes wrong.
+        """
+        request_url = 'http://{}/reports/{}'.format(
+            JUPYTER_API_SERVER, benchmark)
+
+        try:
+            LOG.debug('Send request: {}'.format(request_url))
+            response = requests.post(
+                url=request_url,
+                json={'regenerate': regenerate, 'force': force})
+
+            response.raise_for_status()
+
+            # Successful request
+            LOG.info('Benchmark report generated.')
+
+        except requests.exceptions.RequestException as ex:
+            LOG.error('Failed to generate benchmark report with Jupyter server.')
+
+            # Use json reply if available
+            try:
+                details = response.json()['error']
+            except:
+                details = str(ex)
+
+            # Failed request
+            LOG.error(details)
+            return False, details
+
+        return True, None
+
+    def query_benchmarks(self, **search):
+        """Query the Benchmark reports from PERF_INSIGHT_ROOT.
+
+        Input:
+            search - The search args of Catalog.search (filters, date_from,
+                     date_to, sort, reverse, limit, cursor and fields), the
+                     date range is of "create_time"
         Return:
             - (True, json-block), or
             - (False, message) if something goes wrong.
         """
 
-        benchmarks = []
         search_path = os.path.join(PERF_INSIGHT_ROOT, 'reports')
 
         if not os.path.isdir(search_path):
@@ -648,14 +914,10 @@ class PerfInsightManager():
             LOG.error(msg)
             return False, msg
 
-        for entry in os.listdir(search_path):
-            if not os.path.isdir(os.path.join(search_path, entry)):
-                continue
-            if entry.startswith('benchmark_'):
-                LOG.debug('Found benchmark "{}".'.format(entry))
-                benchmarks.append({'id': entry})
+        benchmarks, cursor = catalog.search(
+            'reports', ('benchmark_',), date_field='create_time', **search)
 
-        return True, {'benchmarks': benchmarks}
+        return True, {'benchmarks': benchmarks, 'next': cursor}
 
     def inspect_benchmark(self, id, get_statistics=False):
         """Inspect a specified benchmark from PERF_INSIGHT_ROOT.
@@ -668,29 +930,22 @@ class PerfInsightManager():
         """
 
         # Criteria check
-        search_path = os.path.join(PERF_INSIGHT_ROOT, 'reports', id)
-        if not os.path.isdir(search_path):
+        entry = catalog.inspect('reports', id)
+        if entry is None:
             msg = 'Benchmark "{}" does not exist.'.format(id)
             LOG.error(msg)
             return False, msg
+        search_path = os.path.join(PERF_INSIGHT_ROOT, 'reports', id)
 
         # Get Benchmark ID and Report URL
         url = 'http://{}/perf-insight/reports/{}/report.html'.format(
             FILE_SERVER, id)
         benchmark = {'id': id, 'url': url}
 
-        # Get metadata
-        try:
-            metadata_file = os.path.join(search_path, 'metadata.json')
-            with open(metadata_file, 'r') as f:
-                metadata = json.load(f)
-        except Exception as err:
-            msg = 'Failed to get metadata from {}. error: {}'.format(
-                metadata_file, err)
-            LOG.warning(msg)
-            metadata = None
-
-        benchmark.update({'metadata': metadata})
+        # Get metadata and the file info from the catalog
+        benchmark.update({'metadata': entry['metadata'],
+                          'size': entry['size'],
+                          'mtime': entry['mtime']})
 
         # Get statistics if asked
         if get_statistics:
@@ -798,15 +1053,31 @@ class PerfInsightManager():
         # Prepare benchmark workspace
         os.makedirs(workspace)
 
-        # Deliver data files
-        shutil.copyfile(test_datastore_file,
-                        os.path.join(workspace, 'test.datastore.json'))
-        shutil.copyfile(base_datastore_file,
-                        os.path.join(workspace, 'base.datastore.json'))
-        shutil.copyfile(test_metadata_file,
-                        os.path.join(workspace, 'test.metadata.json'))
-        shutil.copyfile(base_metadata_file,
-                        os.path.join(workspace, 'base.metadata.json'))
+        # Deliver data files, they are read only so that they are linked
+        # or cloned instead of being copied if possible
+        materialize_file(test_datastore_file,
+                         os.path.join(workspace, 'test.datastore.json'),
+                         MATERIALIZE_STRATEGIES)
+        materialize_file(base_datastore_file,
+                         os.path.join(workspace, 'base.datastore.json'),
+                         MATERIALIZE_STRATEGIES)
+        materialize_file(test_metadata_file,
+                         os.path.join(workspace, 'test.metadata.json'),
+                         MATERIALIZE_STRATEGIES)
+        materialize_file(base_metadata_file,
+                         os.path.join(workspace, 'base.metadata.json'),
+                         MATERIALIZE_STRATEGIES)
+
+        # Deliver the columnar sidecars if available, they are delivered
+        # after the datastore files so that they won't be considered out of
+        # date (a linked sidecar keeps the mtime of its own)
+        for id, prefix in ((test_id, 'test'), (base_id, 'base')):
+            sidecar_file = os.path.join(
+                PERF_INSIGHT_ROOT, 'testruns', id, 'datastore.parquet')
+            if os.path.isfile(sidecar_file):
+                materialize_file(sidecar_file, os.path.join(
+                    workspace, '{}.datastore.parquet'.format(prefix)),
+                    MATERIALIZE_STRATEGIES)
 
         # Deploy config files
         candidates = [test_yaml] if test_yaml else [
@@ -874,55 +1145,38 @@ class PerfInsightManager():
             return False, 'Cannot find template "{}".'.format(candidates)
 
         # Deliver scripts
-        os.makedirs(os.path.join(workspace, 'utils'))
-
-        script_list = ['generate_testrun_results.py',
-                       'generate_benchmark_results.py',
-                       'generate_benchmark_metadata.py',
-                       'generate_benchmark_parameters.py',
-                       'generate_benchmark_statistics.py',
-                       'generate_benchmark_summary.py']
-        for filename in script_list:
-            shutil.copyfile(
-                os.path.join(PERF_INSIGHT_REPO, 'utils', filename),
-                os.path.join(workspace, 'utils', filename))
-
-        shutil.copyfile(
-            os.path.join(PERF_INSIGHT_REPO, 'jupyter_server',
-                         'utils', 'html_report.sh'),
-            os.path.join(workspace, 'utils', 'html_report.sh'))
-
-        shutil.copyfile(
-            os.path.join(PERF_INSIGHT_REPO, 'jupyter_server',
-                         'utils', 'report_portal.ipynb'),
-            os.path.join(workspace, 'report_portal.ipynb'))
+        self._deliver_scripts(workspace)
+
+        # Reuse the testrun results from the cache if available, the report
+        # portal won't generate them again since they are up to date
+        cache_keys = {}
+        for prefix in ('test', 'base'):
+            files = [os.path.join(workspace, '{}.datastore.json'.format(prefix)),
+                     os.path.join(workspace, '{}.metadata.json'.format(prefix)),
+                     os.path.join(
+                         workspace, '{}.generate_testrun_results.yaml'.format(prefix)),
+                     os.path.join(workspace, 'utils', 'generate_testrun_results.py')]
+            key = self._get_cache_key(files)
+            result = os.path.join(
+                workspace, '{}.testrun_result.csv'.format(prefix))
+
+            if self._fetch_cached_results(key, result):
+                LOG.info('Reuse the cached testrun results for {}.'.format(
+                    prefix.upper()))
+            else:
+                cache_keys[prefix] = key
 
         # Connect to Jupyter server and generate the report
-        request_url = 'http://{}/reports/{}'.format(
-            JUPYTER_API_SERVER, benchmark)
-
-        try:
-            LOG.debug('Send request: {}'.format(request_url))
-            response = requests.post(url=request_url)
-
-            response.raise_for_status()
-            result = response.json()
-
-            # Successful request
-            LOG.info('Benchmark report generated.')
-
-        except requests.exceptions.RequestException as ex:
-            LOG.error('Failed to generate benchmark report with Jupyter server.')
-
-            # Use json reply if available
-            try:
-                details = response.json()['error']
-            except:
-                details = str(ex)
+        res, msg = self._generate_report(benchmark)
+        if res is False:
+            return False, msg
 
-            # Failed request
-            LOG.error(details)
-            return False, details
+        # Save the testrun results into the cache
+        for prefix, key in cache_keys.items():
+            result = os.path.join(
+                workspace, '{}.testrun_result.csv'.format(prefix))
+            if os.path.isfile(result):
+                self._store_cached_results(key, result)
 
         # Update metadata and dump to metadata.json
         create_time = time.strftime(
@@ -953,7 +1207,9 @@ class PerfInsightManager():
                 LOG.error(msg)
                 return False, msg
 
-            dbloader = os.path.join('/tmp/benchmark_info.json')
+            # The benchmark reports may be created concurrently by the jobs
+            dbloader = os.path.join(
+                '/tmp', '{}.benchmark_info.json'.format(benchmark))
             benchmark_info = {
                 'id': benchmark,
                 'create_time': create_time,
@@ -966,16 +1222,10 @@ class PerfInsightManager():
             with open(dbloader, 'w') as f:
                 json.dump(benchmark_info, f, indent=3)
 
-            cmd = '{}/utils/flask_load_db.py --benchmark --db_file {} --delete {}'.format(
-                PERF_INSIGHT_REPO, db_file, benchmark)
-            res = os.system(cmd)
-            if res > 0:
-                msg = 'Failed to clean up specified benchmark report from database.'
-                LOG.error(msg)
-                return False, msg
-
-            cmd = '{}/utils/flask_load_db.py --benchmark --db_file {} --json_file {}'.format(
-                PERF_INSIGHT_REPO,  db_file, dbloader)
+            # Replace the benchmark report in a single transaction
+            flag = '--benchmark --wal' if DASHBOARD_DB_WAL else '--benchmark'
+            cmd = '{}/utils/flask_load_db.py {} --db_file {} --replace --json_file {}'.format(
+                PERF_INSIGHT_REPO, flag, db_file, dbloader)
             res = os.system(cmd)
             if res > 0:
                 msg = 'Failed to load specified benchmark report into database.'
@@ -985,21 +1235,133 @@ class PerfInsightManager():
         # Deal with the files
         try:
             if SAFE_MODE:
-                shutil.copytree(workspace, target)
+                publish_tree(workspace, target, MATERIALIZE_STRATEGIES,
+                             keep_source=True)
                 shutil.move(workspace, os.path.join(
                     PERF_INSIGHT_RBIN,
                     '.deleted_after_creating_{}__{}'.format(
                         time.strftime('%y%m%d%H%M%S', time.localtime()),
                         os.path.basename(workspace))))
             else:
-                shutil.move(workspace, target)
+                publish_tree(workspace, target, MATERIALIZE_STRATEGIES)
         except Exception as err:
             msg = 'Failed to deal with the files. error: {}'.format(err)
             LOG.error(msg)
             return False, msg
 
+        catalog.refresh('reports', benchmark)
+
         return True, {'id': benchmark, 'url': report_url, 'metadata': metadata}
 
+    def regenerate_benchmark(self, id, test_yaml=None, base_yaml=None,
+                             benchmark_yaml=None, metadata_yaml=None,
+                             force=False):
+        """Regenerate an existing benchmark report.
+
+        The report pipeline executes only the stages whose inputs changed
+        (such as the benchmark results after the benchmark config file is
+        replaced), then the report is replaced atomically.
+
+        Input:
+            id             - Benchmark ID
+            test_yaml      - Replace the config file to parse TEST samples
+            base_yaml      - Replace the config file to parse BASE samples
+            benchmark_yaml - Replace the config file for benchmark comparison
+            metadata_yaml  - Replace the config file for metadata comparison
+            force          - Execute all the stages of the report pipeline
+        Return:
+            - (True, json-block), or
+            - (False, message) if something goes wrong.
+        """
+
+        # Criteria check
+        target = os.path.join(PERF_INSIGHT_ROOT, 'reports', id)
+        if not os.path.isdir(target):
+            msg = 'Benchmark "{}" does not exist.'.format(id)
+            LOG.error(msg)
+            return False, msg
+
+        templates = []
+        for filename, name in (
+                (test_yaml, 'test.generate_testrun_results.yaml'),
+                (base_yaml, 'base.generate_testrun_results.yaml'),
+                (benchmark_yaml, 'generate_benchmark_results.yaml'),
+                (metadata_yaml, 'generate_benchmark_metadata.yaml')):
+            if filename is None:
+                continue
+            if not os.path.isfile(os.path.join(PERF_INSIGHT_TEMP, filename)):
+                msg = 'Cannot find template "{}".'.format(filename)
+                LOG.error(msg)
+                return False, msg
+            templates.append((filename, name))
+
+        workspace = os.path.join(PERF_INSIGHT_STAG, id)
+        if os.path.isdir(workspace):
+            LOG.warning(
+                'Folder "{}" already exists in the staging area and will be overwritten.'.format(id))
+            shutil.rmtree(workspace, ignore_errors=True)
+
+        # Prepare the workspace from the report, the data files are read
+        # only and the outputs of the pipeline may be rewritten
+        try:
+            materialize_tree(target, workspace, MATERIALIZE_STRATEGIES,
+                             writable=True, readonly=(
+                                 'test.datastore.json', 'base.datastore.json',
+                                 'test.metadata.json', 'base.metadata.json',
+                                 'test.datastore.parquet',
+                                 'base.datastore.parquet'))
+            with open(os.path.join(workspace, 'metadata.json'), 'r') as f:
+                metadata = json.load(f)
+        except Exception as err:
+            msg = 'Failed to deal with the files. error: {}'.format(err)
+            LOG.error(msg)
+            return False, msg
+
+        # Deploy the replaced config files and the current scripts, the
+        # unchanged ones won't trigger the stages
+        for filename, name in templates:
+            shutil.copyfile(os.path.join(PERF_INSIGHT_TEMP, filename),
+                            os.path.join(workspace, name))
+        self._deliver_scripts(workspace)
+
+        # Connect to Jupyter server and regenerate the report
+        res, msg = self._generate_report(id, regenerate=True, force=force)
+        if res is False:
+            return False, msg
+
+        # Update metadata and dump to metadata.json
+        metadata['update_time'] = time.strftime(
+            '%Y-%m-%d %H:%M:%S', time.localtime())
+
+        with open(os.path.join(workspace, 'metadata.json'), 'w') as f:
+            json.dump(metadata, f, indent=3)
+
+        # Get the Report URL
+        report_url = 'http://{}/perf-insight/reports/{}/report.html'.format(
+            FILE_SERVER, id)
+
+        # Deal with the files
+        try:
+            if SAFE_MODE:
+                publish_tree(workspace, target, MATERIALIZE_STRATEGIES,
+                             keep_source=True, replace=True)
+                shutil.move(workspace, os.path.join(
+                    PERF_INSIGHT_RBIN,
+                    '.deleted_after_regenerating_{}__{}'.format(
+                        time.strftime('%y%m%d%H%M%S', time.localtime()),
+                        os.path.basename(workspace))))
+            else:
+                publish_tree(workspace, target, MATERIALIZE_STRATEGIES,
+                             replace=True)
+        except Exception as err:
+            msg = 'Failed to deal with the files. error: {}'.format(err)
+            LOG.error(msg)
+            return False, msg
+
+        catalog.refresh('reports', id)
+
+        return True, {'id': id, 'url': report_url, 'metadata': metadata}
+
     def delete_benchmark(self, id, update_dashboard=True):
         """Delete a specified benchmark from PERF_INSIGHT_ROOT.
 
@@ -1046,20 +1408,72 @@ class PerfInsightManager():
             LOG.error(msg)
             return False, msg
 
+        catalog.refresh('reports', id)
+
         return True, {'id': id}
 
 
 # Flask
 app = Flask(__name__)
 
+# The query args of the list entrypoints, the other args are the filters
+SEARCH_ARGS = ('sort', 'limit', 'cursor', 'fields', 'date_from', 'date_to')
+
+
+def get_search_args(args):
+    """Get the search args from the query args of the list entrypoints.
+
+    Input:
+        args - The query args, such as "?testrun-platform=ESXi&os-branch=
+               RHEL-8.4&os-branch=RHEL-8.5&sort=-testrun-date&limit=50&
+               fields=testrun-platform,os-branch"
+    Return:
+        - A dict of the search args.
+    Raise:
+        - ValueError if the args are invalid.
+    """
+    search = {'filters': {k: args.getlist(k)
+                          for k in args if k not in SEARCH_ARGS}}
+
+    sort = args.get('sort')
+    if sort:
+        # Sort in descending order with "-"
+        search['reverse'] = sort.startswith('-')
+        search['sort'] = None if sort.lstrip('-') == 'id' else sort.lstrip('-')
+
+    limit = args.get('limit')
+    if limit is not None:
+        if not limit.isdigit() or int(limit) < 1:
+            raise ValueError('"limit" must be a positive integer.')
+        search['limit'] = int(limit)
+
+    cursor = args.get('cursor')
+    if cursor:
+        decode_cursor(cursor)
+        search['cursor'] = cursor
+
+    if args.get('fields'):
+        search['fields'] = [x.strip() for x in args['fields'].split(',')
+                            if x.strip()]
+
+    search['date_from'] = args.get('date_from')
+    search['date_to'] = args.get('date_to')
+
+    return search
+
 
 # TestRun entrypoints
 
 
 @app.get('/testruns')
 def query_testruns():
-    LOG.info('Received request to query all TestRuns.')
-    res, con = manager.query_testruns()
+    LOG.info('Received request to query TestRuns.')
+    try:
+        search = get_search_args(request.args)
+    except ValueError as err:
+        return jsonify({'error': str(err)}), 400
+
+    res, con = manager.query_testruns(**search)
     if res:
         return jsonify(con), 200
     else:
@@ -1198,8 +1612,13 @@ def delete_testrun(id):
 
 @app.get('/benchmarks')
 def query_benchmarks():
-    LOG.info('Received request to query all benchmarks.')
-    res, con = manager.query_benchmarks()
+    LOG.info('Received request to query benchmarks.')
+    try:
+        search = get_search_args(request.args)
+    except ValueError as err:
+        return jsonify({'error': str(err)}), 400
+
+    res, con = manager.query_benchmarks(**search)
     if res:
         return jsonify(con), 200
     else:
@@ -1252,15 +1671,27 @@ def create_benchmark():
     update_dashboard = req.get('update_dashboard', True)
     allow_overwrite = req.get('allow_overwrite', True)
 
-    res, con = manager.create_benchmark(
-        test_id, base_id, test_yaml, base_yaml,
-        benchmark_yaml, metadata_yaml, introduction_md, comments,
-        update_dashboard, allow_overwrite)
+    # Create the benchmark report in a job, the client polls the job
+    params = {
+        'test_id': test_id,
+        'base_id': base_id,
+        'test_yaml': test_yaml,
+        'base_yaml': base_yaml,
+        'benchmark_yaml': benchmark_yaml,
+        'metadata_yaml': metadata_yaml,
+        'introduction_md': introduction_md,
+        'comments': comments,
+        'update_dashboard': update_dashboard,
+        'allow_overwrite': allow_overwrite
+    }
+    key = 'benchmark_{}_over_{}'.format(test_id, base_id)
+    res, con = job_manager.submit('create_benchmark', params, key)
 
     if res:
-        return jsonify(con), 201
+        return jsonify(con), 202
     else:
-        return jsonify({'error': con}), 500
+        # Another job is working on the same benchmark report
+        return jsonify({'error': con}), 409
 
 
 @app.delete('/benchmarks')
@@ -1279,6 +1710,12 @@ def delete_benchmark():
 
     update_dashboard = req.get('update_dashboard', True)
 
+    # The report would be published again by the job working on it
+    job = job_manager.get_unfinished(report_id)
+    if job:
+        return jsonify({'error': 'Job "{}" ({}) on "{}" is already {}.'.format(
+            job['id'], job['type'], report_id, job['status'])}), 409
+
     res, con = manager.delete_benchmark(report_id, update_dashboard)
     if res:
         return jsonify(con), 200    # use 200 since 204 returns no json
@@ -1286,6 +1723,55 @@ def delete_benchmark():
         return jsonify({'error': con}), 500
 
 
+@app.post('/benchmarks/<id>/regenerate')
+def regenerate_benchmark(id):
+    LOG.info('Received request to regenerate benchmark "{}".'.format(id))
+
+    req = request.get_json() if request.is_json else {}
+
+    # Parse args
+    params = {
+        'id': id,
+        'test_yaml': req.get('test_yaml'),
+        'base_yaml': req.get('base_yaml'),
+        'benchmark_yaml': req.get('benchmark_yaml'),
+        'metadata_yaml': req.get('metadata_yaml'),
+        'force': req.get('force', False)
+    }
+
+    # Regenerate the benchmark report in a job, the client polls the job
+    res, con = job_manager.submit('regenerate_benchmark', params, id)
+
+    if res:
+        return jsonify(con), 202
+    else:
+        # Another job is working on the same benchmark report
+        return jsonify({'error': con}), 409
+
+
+# Job entrypoints
+
+
+@app.get('/jobs')
+def query_jobs():
+    LOG.info('Received request to query the jobs.')
+    res, con = job_manager.query(request.args.get('status'))
+    if res:
+        return jsonify(con), 200
+    else:
+        return jsonify({'error': con}), 500
+
+
+@app.get('/jobs/<id>')
+def inspect_job(id):
+    LOG.info('Received request to inspect job "{}".'.format(id))
+    res, con = job_manager.inspect(id)
+    if res:
+        return jsonify(con), 200
+    else:
+        return jsonify({'error': con}), 404
+
+
 # Jupyter server's entrypoints (labs, studies)
 
 @app.route('/labs', methods=['GET', 'POST', 'DELETE', 'PUT'])
@@ -1324,9 +1810,33 @@ PERF_INSIGHT_STAG = config.get(
     'perf_insight_stag', os.path.join(PERF_INSIGHT_ROOT, '.staging'))
 PERF_INSIGHT_RBIN = config.get(
     'perf_insight_rbin', os.path.join(PERF_INSIGHT_ROOT, '.deleted'))
+PERF_INSIGHT_SCRATCH = config.get(
+    'perf_insight_scratch', os.path.join(tempfile.gettempdir(), 'perf-insight'))
 DASHBOARD_DB_FILE = config.get('dashboard_db_file', '/data/app.db')
+DASHBOARD_DB_WAL = config.get('dashboard_db_wal', False)
 JUPYTER_API_SERVER = config.get('jupyter_api_server', 'localhost:8880')
 FILE_SERVER = config.get('file_server', 'localhost:8081')
 SAFE_MODE = config.get('safe_mode', False)
-
+RESULTS_CACHE_PATH = config.get('results_cache_path', os.path.join(
+    PERF_INSIGHT_ROOT, '.cache', 'testrun_results'))
+RESULTS_CACHE_SIZE = config.get('results_cache_size', 1024)  # MiB
+IMPORT_WORKERS = config.get('import_workers', 8)
+IMPORT_RETRIES = config.get('import_retries', 3)
+JOBS_DB_FILE = config.get('jobs_db_file', '/data/jobs.db')
+CATALOG_DB_FILE = config.get('catalog_db_file', '/data/catalog.db')
+MATERIALIZE_STRATEGIES = config.get(
+    'materialize_strategies', ['reflink', 'hardlink', 'copy'])
+JOB_WORKERS = config.get('job_workers', 2)
+
+# The dashboard is updated by the scripts in process
+sys.path.insert(0, os.path.join(PERF_INSIGHT_REPO, 'utils'))
+import flask_load_db
+import generate_testrun_results
+
+catalog = Catalog(CATALOG_DB_FILE, PERF_INSIGHT_ROOT)
 manager = PerfInsightManager()
+job_manager = JobManager(
+    JOBS_DB_FILE,
+    {'create_benchmark': manager.create_benchmark,
+     'regenerate_benchmark': manager.regenerate_benchmark},
+    JOB_WORKERS)
@@ -0,0 +1,357 @@
+"""Catalog of the TestRuns and benchmark reports.
+
+The entries under PERF_INSIGHT_ROOT (the folders in "testruns" and
+"reports") are recorded in a SQLite file with their metadata, sizes and
+mtimes, so that the list and inspect requests don't scan the folders and
+read the metadata files on NFS. The catalog is updated by the operations
+which add or remove the entries, and it is verified lazily against the
+mtimes of the folders and of the metadata files.
+
+The scalar metadata fields are indexed (the nested ones are named with
+dots, such as "test_metadata.testrun-platform"), so that the entries are
+searched, sorted and paged without reading the metadata.
+"""
+
+import base64
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+# The mtime of a folder is not trusted if it is this recent (in seconds),
+# since a change in the same tick doesn't update it
+MTIME_MARGIN = 2
+
+# The existing entries are verified against their mtimes at this interval
+# (in seconds) even if the mtime of the folder doesn't change
+VERIFY_INTERVAL = 60
+
+# The version of the schema, the catalog is rebuilt if it is older
+SCHEMA_VERSION = 1
+
+
+def encode_cursor(key, id):
+    """Encode the key and the ID of the last entry into a cursor."""
+    return base64.urlsafe_b64encode(json.dumps([key, id]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Decode the cursor into [key, ID], raise ValueError if it is
+    invalid."""
+    try:
+        after = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        after = None
+    if not (isinstance(after, list) and len(after) == 2 and
+            all(isinstance(x, str) for x in after)):
+        raise ValueError('Invalid cursor "{}".'.format(cursor))
+    return after
+
+
+class Catalog():
+
+    def __init__(self, db_file, root):
+        """Open the catalog.
+
+        Input:
+            db_file - the SQLite file of the catalog
+            root    - PERF_INSIGHT_ROOT
+        """
+        self.db_file = db_file
+        self.root = root
+        self.lock = threading.Lock()
+        self.verified = {}
+
+        with self._connect() as conn:
+            if conn.execute('PRAGMA user_version').fetchone()[0] < \
+                    SCHEMA_VERSION:
+                LOG.info('Catalog is outdated and will be rebuilt.')
+                for table in ('entries', 'folders', 'fields'):
+                    conn.execute('DROP TABLE IF EXISTS {}'.format(table))
+                conn.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'kind TEXT, id TEXT, metadata TEXT, size INTEGER, '
+                'mtime REAL, metadata_mtime REAL, PRIMARY KEY (kind, id))')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS folders ('
+                'kind TEXT PRIMARY KEY, mtime REAL)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS fields ('
+                'kind TEXT, id TEXT, name TEXT, value TEXT, '
+                'PRIMARY KEY (kind, id, name))')
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS ix_fields_name_value '
+                'ON fields (kind, name, value, id)')
+
+    def _connect(self):
+        return sqlite3.connect(self.db_file, timeout=30)
+
+    def _get_mtime(self, path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def _get_size(self, path):
+        size = 0
+        for dirpath, dirnames, filenames in os.walk(path):
+            for filename in filenames:
+                try:
+                    size += os.lstat(os.path.join(dirpath, filename)).st_size
+                except OSError:
+                    pass
+        return size
+
+    def _scan(self, kind, id):
+        """Get the row of an entry from the file system, or None if the
+        folder does not exist."""
+        path = os.path.join(self.root, kind, id)
+        if not os.path.isdir(path):
+            return None
+
+        mtime = self._get_mtime(path)
+        metadata_file = os.path.join(path, 'metadata.json')
+        metadata_mtime = self._get_mtime(metadata_file)
+        try:
+            with open(metadata_file, 'r') as f:
+                metadata = json.dumps(json.load(f))
+        except Exception as err:
+            LOG.warning('Failed to get metadata from {}. error: {}'.format(
+                metadata_file, err))
+            metadata = None
+        size = self._get_size(path)
+
+        return (kind, id, metadata, size, mtime, metadata_mtime)
+
+    def _get_fields(self, metadata, prefix=''):
+        """Get the scalar fields of the metadata as (name, value)."""
+        fields = []
+        for name, value in metadata.items():
+            if isinstance(value, dict):
+                fields += self._get_fields(value, prefix + name + '.')
+            elif isinstance(value, (str, int, float, bool)):
+                fields.append((prefix + name, str(value)))
+        return fields
+
+    def _delete(self, conn, kind, ids):
+        for table in ('entries', 'fields'):
+            conn.executemany(
+                'DELETE FROM {} WHERE kind = ? AND id = ?'.format(table),
+                [(kind, x) for x in ids])
+
+    def _write(self, conn, rows):
+        for row in rows:
+            self._delete(conn, row[0], [row[1]])
+        conn.executemany(
+            'INSERT INTO entries (kind, id, metadata, size, '
+            'mtime, metadata_mtime) VALUES (?, ?, ?, ?, ?, ?)', rows)
+        for kind, id, metadata, *_ in rows:
+            if metadata is None:
+                continue
+            metadata = json.loads(metadata)
+            if isinstance(metadata, dict):
+                conn.executemany(
+                    'INSERT INTO fields (kind, id, name, value) '
+                    'VALUES (?, ?, ?, ?)',
+                    [(kind, id) + x for x in self._get_fields(metadata)])
+
+    def refresh(self, kind, id):
+        """Update an entry from the file system, remove it if the folder
+        does not exist.
+
+        Input:
+            kind - "testruns" or "reports"
+            id   - the TestRunID or the benchmark ID
+        """
+        row = self._scan(kind, id)
+        with self.lock, self._connect() as conn:
+            if row is None:
+                self._delete(conn, kind, [id])
+            else:
+                self._write(conn, [row])
+        LOG.debug('Catalog {} "{}/{}".'.format(
+            'removed' if row is None else 'updated', kind, id))
+
+    def sync(self, kind):
+        """Synchronize the entries with the folder if its mtime changed,
+        or if the entries were verified VERIFY_INTERVAL ago.
+
+        The entries added or removed are found by the folder. The existing
+        entries are scanned again if their mtimes (or the mtimes of their
+        "metadata.json") changed, such as the metadata edited in place,
+        which doesn't change the mtime of the folder.
+
+        Input:
+            kind - "testruns" or "reports"
+        """
+        path = os.path.join(self.root, kind)
+        mtime = self._get_mtime(path)
+        now = time.time()
+
+        with self._connect() as conn:
+            row = conn.execute('SELECT mtime FROM folders WHERE kind = ?',
+                               (kind,)).fetchone()
+            if row is not None and mtime is not None and row[0] == mtime \
+                    and now - self.verified.get(kind, 0) < VERIFY_INTERVAL:
+                return
+            known = {x[0]: tuple(x[1:]) for x in conn.execute(
+                'SELECT id, mtime, metadata_mtime FROM entries '
+                'WHERE kind = ?', (kind,))}
+
+        LOG.info('Catalog synchronizing "{}".'.format(kind))
+        entries = set()
+        if mtime is not None:
+            entries = set(x.name for x in os.scandir(path) if x.is_dir())
+
+        ids = set(known)
+        changed = set()
+        for id in entries & ids:
+            entry = os.path.join(path, id)
+            if (self._get_mtime(entry), self._get_mtime(
+                    os.path.join(entry, 'metadata.json'))) != known[id]:
+                changed.add(id)
+
+        rows = [self._scan(kind, x) for x in sorted((entries - ids) | changed)]
+        with self.lock, self._connect() as conn:
+            self._write(conn, [x for x in rows if x is not None])
+            self._delete(conn, kind, ids - entries)
+
+            # Scan again next time if the mtime is too recent to be trusted
+            if mtime is not None and time.time() - mtime < MTIME_MARGIN:
+                mtime = None
+            conn.execute(
+                'INSERT OR REPLACE INTO folders (kind, mtime) VALUES (?, ?)',
+                (kind, mtime))
+        self.verified[kind] = now
+
+    def search(self, kind, prefixes=(), filters=None, date_field=None,
+               date_from=None, date_to=None, sort=None, reverse=False,
+               limit=None, cursor=None, fields=None):
+        """Search the entries by the indexed metadata fields.
+
+        Input:
+            kind       - "testruns" or "reports"
+            prefixes   - the valid prefixes of the IDs
+            filters    - a dict of the field names and the lists of the
+                         values, an entry matches any of the values
+            date_field - the field of the date range
+            date_from  - the first date (of the date field)
+            date_to    - the last date (of the date field), inclusive
+            sort       - the field to sort by, the entries are sorted by
+                         the IDs if it is None
+            reverse    - sort in descending order
+            limit      - the max number of the entries, or None for all
+            cursor     - the cursor of the next page
+            fields     - the metadata fields of the entries, or None for
+                         the IDs only
+        Return:
+            (entries, cursor), the cursor is None on the last page.
+        """
+        self.sync(kind)
+
+        # The entries are sorted by (key, id)
+        key = "COALESCE(s.value, '')" if sort else 'e.id'
+        sql = 'SELECT e.id, {} FROM entries e'.format(key)
+        args = []
+        if sort:
+            sql += (' LEFT JOIN fields s ON s.kind = e.kind AND '
+                    's.id = e.id AND s.name = ?')
+            args.append(sort)
+        sql += ' WHERE e.kind = ?'
+        args.append(kind)
+
+        if prefixes:
+            sql += ' AND ({})'.format(' OR '.join(
+                "e.id LIKE ? ESCAPE '\\'" for x in prefixes))
+            args += [x.replace('_', '\\_') + '%' for x in prefixes]
+
+        conditions = [(name, 'value IN ({})'.format(
+            ', '.join('?' * len(values))), list(values))
+            for name, values in (filters or {}).items()]
+        if date_from:
+            conditions.append((date_field, 'value >= ?', [date_from]))
+        if date_to:
+            # Compare the date part of the datetime values
+            conditions.append((date_field, 'substr(value, 1, ?) <= ?',
+                               [len(date_to), date_to]))
+        for name, condition, values in conditions:
+            sql += (' AND e.id IN (SELECT id FROM fields WHERE kind = ? AND '
+                    'name = ? AND {})'.format(condition))
+            args += [kind, name] + values
+
+        # The cursor is the key of the last entry of the former page
+        op = '<' if reverse else '>'
+        if cursor:
+            sql += ' AND ({}, e.id) {} (?, ?)'.format(key, op)
+            args += decode_cursor(cursor)
+
+        sql += ' ORDER BY {0} {1}, e.id {1}'.format(
+            key, 'DESC' if reverse else 'ASC')
+        if limit:
+            sql += ' LIMIT ?'
+            args.append(limit + 1)
+
+        with self._connect() as conn:
+            rows = conn.execute(sql, args).fetchall()
+
+            next_cursor = None
+            if limit and len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+
+            entries = [{'id': x[0]} for x in rows]
+            if fields and entries:
+                values = {}
+                ids = [x['id'] for x in entries]
+                # Look up the fields of the page in chunks of the IDs
+                for start in range(0, len(ids), 500):
+                    chunk = ids[start:start + 500]
+                    values.update(((x[0], x[1]), x[2]) for x in conn.execute(
+                        'SELECT id, name, value FROM fields WHERE kind = ? '
+                        'AND name IN ({}) AND id IN ({})'.format(
+                            ', '.join('?' * len(fields)),
+                            ', '.join('?' * len(chunk))),
+                        [kind] + list(fields) + chunk))
+                for entry in entries:
+                    for name in fields:
+                        entry[name] = values.get((entry['id'], name))
+
+        return entries, next_cursor
+
+    def inspect(self, kind, id):
+        """Inspect an entry, it is refreshed if the mtimes changed.
+
+        Input:
+            kind - "testruns" or "reports"
+            id   - the TestRunID or the benchmark ID
+        Return:
+            A dict of the entry (id, metadata, size and mtime), or None if
+            the entry does not exist.
+        """
+        path = os.path.join(self.root, kind, id)
+        mtime = self._get_mtime(path)
+        metadata_mtime = self._get_mtime(os.path.join(path, 'metadata.json'))
+
+        for attempt in (1, 2):
+            with self._connect() as conn:
+                row = conn.execute(
+                    'SELECT metadata, size, mtime, metadata_mtime FROM '
+                    'entries WHERE kind = ? AND id = ?', (kind, id)).fetchone()
+            if row is not None and row[2:] == (mtime, metadata_mtime):
+                break
+            if attempt == 1:
+                self.refresh(kind, id)
+
+        if row is None or mtime is None:
+            return None
+
+        return {'id': id,
+                'metadata': None if row[0] is None else json.loads(row[0]),
+                'size': row[1],
+                'mtime': row[2]}
@@ -0,0 +1,217 @@
+"""Job subsystem of the API server.
+
+The long running requests (such as creating a benchmark report) are
+submitted as jobs and executed by a pool of workers, the client polls the
+status of the job instead of waiting for the response. The jobs are
+journaled in a SQLite file, the unfinished jobs are resumed when the API
+server restarts.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+LOG = logging.getLogger(__name__)
+
+# Job status
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+COLUMNS = ('id', 'type', 'key', 'params', 'status', 'result', 'error',
+           'create_time', 'start_time', 'end_time')
+
+
+class JobManager():
+
+    def __init__(self, db_file, handlers, max_workers=2):
+        """Open the job journal and resume the unfinished jobs.
+
+        Input:
+            db_file     - the SQLite file of the job journal
+            handlers    - a dict of the job handlers keyed by the job types,
+                          a handler takes the params as keyword arguments
+                          and returns (True, json-block) or (False, message)
+            max_workers - the number of the workers
+        """
+        self.db_file = db_file
+        self.handlers = handlers
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id TEXT PRIMARY KEY, type TEXT, key TEXT, params TEXT, '
+                'status TEXT, result TEXT, error TEXT, create_time REAL, '
+                'start_time REAL, end_time REAL)')
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS ix_jobs_status ON jobs (status)')
+
+            # The running jobs were interrupted by the restart
+            conn.execute(
+                'UPDATE jobs SET status = ?, start_time = NULL '
+                'WHERE status = ?', (QUEUED, RUNNING))
+            queued = [x[0] for x in conn.execute(
+                'SELECT id FROM jobs WHERE status = ? '
+                'ORDER BY create_time', (QUEUED,))]
+
+        for id in queued:
+            LOG.info('Resume job "{}".'.format(id))
+            self.executor.submit(self._run, id)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_file, timeout=30)
+
+    def _update(self, id, **kwargs):
+        names = ', '.join('{} = ?'.format(x) for x in kwargs)
+        with self.lock, self._connect() as conn:
+            conn.execute('UPDATE jobs SET {} WHERE id = ?'.format(names),
+                         list(kwargs.values()) + [id])
+
+    def _get_unfinished(self, conn, key):
+        return conn.execute(
+            'SELECT * FROM jobs WHERE key = ? AND status IN (?, ?)',
+            (key, QUEUED, RUNNING)).fetchone()
+
+    def submit(self, type, params, key=None):
+        """Submit a job.
+
+        Input:
+            type   - the type of the job (the key of the handlers)
+            params - a dict of the params passed to the handler
+            key    - the key of the job, a job with the same key (of any
+                     type, such as the jobs on the same benchmark report) is
+                     not submitted while another one is queued or running
+        Return:
+            - (True, job-block) of the submitted or the unfinished job of
+              the same type and params, or
+            - (False, message) if an unfinished job of another type or
+              params has the same key.
+        """
+        with self.lock, self._connect() as conn:
+            if key is not None:
+                row = self._get_unfinished(conn, key)
+                if row and row[1] == type and \
+                        json.loads(row[3]) == json.loads(json.dumps(params)):
+                    LOG.info('Job "{}" is already {}.'.format(row[0], row[4]))
+                    return True, self._get_job_block(row)
+                if row:
+                    msg = 'Job "{}" ({}) on "{}" is already {}.'.format(
+                        row[0], row[1], key, row[4])
+                    if row[1] == type:
+                        msg += ' The params are different.'
+                    LOG.error(msg)
+                    return False, msg
+
+            id = uuid.uuid4().hex
+            conn.execute(
+                'INSERT INTO jobs (id, type, key, params, status, create_time) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (id, type, key, json.dumps(params), QUEUED, time.time()))
+
+        LOG.info('Job "{}" submitted.'.format(id))
+        self.executor.submit(self._run, id)
+
+        return self.inspect(id)
+
+    def _run(self, id):
+        with self._connect() as conn:
+            row = conn.execute('SELECT type, params FROM jobs WHERE id = ?',
+                               (id,)).fetchone()
+        type, params = row[0], json.loads(row[1])
+
+        LOG.info('Job "{}" started.'.format(id))
+        self._update(id, status=RUNNING, start_time=time.time())
+
+        try:
+            res, con = self.handlers[type](**params)
+        except Exception as err:
+            LOG.exception('Job "{}" raised an exception.'.format(id))
+            res, con = False, 'Unexpected error: {}'.format(err)
+
+        if res:
+            self._update(id, status=SUCCEEDED, result=json.dumps(con),
+                         end_time=time.time())
+        else:
+            self._update(id, status=FAILED, error=str(con),
+                         end_time=time.time())
+
+        LOG.info('Job "{}" {}.'.format(id, SUCCEEDED if res else FAILED))
+
+    def _get_job_block(self, row):
+        job = dict(zip(COLUMNS, row))
+        job.pop('key')
+        job['params'] = json.loads(job['params'])
+        if job['result'] is not None:
+            job['result'] = json.loads(job['result'])
+
+        # Timing in seconds
+        start_time, end_time = job['start_time'], job['end_time']
+        job['wait_time'] = (start_time or end_time or time.time()) - \
+            job['create_time']
+        job['run_time'] = None if start_time is None else \
+            (end_time or time.time()) - start_time
+
+        return job
+
+    def inspect(self, id):
+        """Inspect a job.
+
+        Input:
+            id - the ID of the job
+        Return:
+            - (True, job-block), or
+            - (False, message) if the job does not exist.
+        """
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?',
+                               (id,)).fetchone()
+
+        if row is None:
+            msg = 'Job "{}" does not exist.'.format(id)
+            LOG.error(msg)
+            return False, msg
+
+        return True, self._get_job_block(row)
+
+    def query(self, status=None, limit=100):
+        """Query the recent jobs.
+
+        Input:
+            status - the status of the jobs, or None for all the jobs
+            limit  - the max number of the jobs
+        Return:
+            - (True, json-block)
+        """
+        sql = 'SELECT * FROM jobs'
+        args = []
+        if status:
+            sql += ' WHERE status = ?'
+            args.append(status)
+        sql += ' ORDER BY create_time DESC LIMIT ?'
+        args.append(limit)
+
+        with self._connect() as conn:
+            rows = conn.execute(sql, args).fetchall()
+
+        return True, {'jobs': [self._get_job_block(x) for x in rows]}
+
+    def get_unfinished(self, key):
+        """Get the job which is queued or running with the key.
+
+        Input:
+            key - the key of the job
+        Return:
+            - job-block, or
+            - None if there is no such job.
+        """
+        with self._connect() as conn:
+            row = self._get_unfinished(conn, key)
+
+        return None if row is None else self._get_job_block(row)
@@ -0,0 +1,197 @@
+"""Materialization of the files into the workspaces.
+
+The files which are not modified after being delivered (such as the
+datastores of the TestRuns in a benchmark workspace) don't need the bytes
+to be copied. They are materialized by the first available strategy:
+
+- "reflink"  - clone the file (FICLONE), the blocks are shared until
+               either file is modified (Btrfs, XFS).
+- "hardlink" - link the file, both names refer to the same file.
+- "symlink"  - link to the absolute path of the file.
+- "copy"     - copy the file, the data is copied by the kernel
+               (copy_file_range, a server-side copy on NFS 4.2), and the
+               size of the copy is verified.
+
+A strategy which is not supported (such as a hardlink across the file
+systems) falls back to the next one, and "copy" is always the last resort.
+The symlinks break if the source is removed, so that they are only used if
+requested. The hardlinks and symlinks share the file with the source, so
+that they are skipped for the files which may be modified (writable=True).
+
+A finished workspace is published by publish_tree, the target appears at
+once (by a rename) even if the workspace is on another file system.
+"""
+
+import errno
+import fcntl
+import logging
+import os
+import shutil
+import uuid
+
+LOG = logging.getLogger(__name__)
+
+STRATEGIES = ('reflink', 'hardlink', 'symlink', 'copy')
+
+# The strategies used by default
+DEFAULT_STRATEGIES = ('reflink', 'hardlink', 'copy')
+
+# The strategies which get an independent file
+WRITABLE_STRATEGIES = ('reflink', 'copy')
+
+# The ioctl request of FICLONE (_IOW(0x94, 9, int)) on Linux
+FICLONE = 0x40049409
+
+
+def _reflink(source, target):
+    with open(source, 'rb') as fsrc, open(target, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.unlink(target)
+            raise
+
+
+def _copy(source, target):
+    with open(source, 'rb') as fsrc, open(target, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        try:
+            copied = 0
+            while copied < size:
+                n = os.copy_file_range(fsrc.fileno(), fdst.fileno(),
+                                       size - copied)
+                if n == 0:
+                    break
+                copied += n
+        except (AttributeError, OSError):
+            # Not supported by the kernel or across the file systems
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+            shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+
+    if os.stat(target).st_size != size:
+        os.unlink(target)
+        raise OSError(errno.EIO, 'Size mismatched after copying', target)
+
+
+_FUNCTIONS = {
+    'reflink': _reflink,
+    'hardlink': os.link,
+    'symlink': lambda source, target: os.symlink(
+        os.path.abspath(source), target),
+    'copy': _copy,
+}
+
+
+def materialize_file(source, target, strategies=DEFAULT_STRATEGIES,
+                     writable=False):
+    """Materialize a file by the first available strategy.
+
+    Input:
+        source     - the source file
+        target     - the target file, it is replaced if it exists
+        strategies - the strategies to be tried in order
+        writable   - the target may be modified, so that it must not share
+                     the file with the source
+    Return:
+        The strategy used.
+    """
+    strategies = [x for x in strategies if x in _FUNCTIONS and
+                  (not writable or x in WRITABLE_STRATEGIES)]
+    if 'copy' not in strategies:
+        strategies.append('copy')
+
+    if os.path.lexists(target):
+        os.unlink(target)
+
+    for strategy in strategies:
+        try:
+            _FUNCTIONS[strategy](source, target)
+        except OSError as err:
+            if strategy == 'copy':
+                raise
+            LOG.debug('Failed to {} "{}", fall back. error: {}'.format(
+                strategy, source, err))
+            continue
+        LOG.debug('Materialized "{}" by {}.'.format(target, strategy))
+        return strategy
+
+
+def materialize_tree(source, target, strategies=DEFAULT_STRATEGIES,
+                     writable=False, readonly=()):
+    """Materialize a directory tree like shutil.copytree.
+
+    Input:
+        source     - the source directory
+        target     - the target directory, it must not exist
+        strategies - the strategies to be tried in order
+        writable   - the files of the target may be modified
+        readonly   - the names of the files which are not modified even if
+                     the others may be
+    Return:
+        A dict of the numbers of the files keyed by the strategies used.
+    """
+    counts = {}
+
+    def _materialize(src, dst):
+        strategy = materialize_file(
+            src, dst, strategies,
+            writable and os.path.basename(src) not in readonly)
+        counts[strategy] = counts.get(strategy, 0) + 1
+        # Keep the mode and the times of the copied files as copytree does
+        if strategy in ('reflink', 'copy'):
+            shutil.copystat(src, dst)
+
+    shutil.copytree(source, target, copy_function=_materialize)
+    LOG.info('Materialized "{}" to "{}": {}'.format(source, target, counts))
+
+    return counts
+
+
+def publish_tree(source, target, strategies=DEFAULT_STRATEGIES,
+                 keep_source=False, replace=False):
+    """Publish a directory tree to the target atomically.
+
+    The tree is moved (renamed if it is on the same file system, otherwise
+    materialized) into a temporary folder beside the target then renamed,
+    so that the target is never seen partially.
+
+    Input:
+        source      - the source directory
+        target      - the target directory, it must not exist unless the
+                      replace flag is set
+        strategies  - the strategies to be tried in order
+        keep_source - keep the source directory
+        replace     - replace the target if it exists, it is swapped by two
+                      renames after the tree is ready
+    """
+    parent = os.path.dirname(os.path.abspath(target))
+    temp = os.path.join(parent, '.{}.publishing-{}'.format(
+        os.path.basename(target), uuid.uuid4().hex[:8]))
+    replaced = temp.replace('.publishing-', '.replaced-')
+    moved = False
+    try:
+        if not keep_source and \
+                os.stat(source).st_dev == os.stat(parent).st_dev:
+            os.rename(source, temp)
+            moved = True
+        else:
+            materialize_tree(source, temp, strategies, writable=True)
+        if replace and os.path.exists(target):
+            os.rename(target, replaced)
+        os.rename(temp, target)
+    except Exception:
+        if os.path.exists(replaced) and not os.path.exists(target):
+            os.rename(replaced, target)
+        if moved:
+            os.rename(temp, source)
+        else:
+            shutil.rmtree(temp, ignore_errors=True)
+        raise
+    shutil.rmtree(replaced, ignore_errors=True)
+    LOG.info('Published "{}" to "{}".'.format(source, target))
+
+    if not keep_source:
+        shutil.rmtree(source, ignore_errors=True)
@@ -10,7 +10,7 @@ from flask_appbuilder.filemanager import ImageManager
 from flask_appbuilder.models.mixins import ImageColumn, BaseMixin
 from flask_appbuilder.security.sqla.models import User
 from sqlalchemy import (Column, ForeignKey, Integer, String, Text, Date, Float,
-                        MetaData, DateTime)
+                        MetaData, DateTime, Index)
 from sqlalchemy.orm import relationship
 from flask import request
 import os
@@ -30,13 +30,87 @@ config.update(user_config.get('dashboard', {}))
 FILE_SERVER = config.get('file_server', 'localhost:8081')
 
 
-class NetworkRun(Model):
+PLATFORM_FAMILIES = ('ec2', 'azure', 'esxi', 'hyperv')
+
+
+def get_platform_family(platform):
+    '''
+    Normalize the platform into the family used by the platform views, such
+    as 'esxi' for 'ESXi'. Keep it the same as utils/flask_load_db.py.
+    '''
+    if platform is None:
+        return None
+    platform = platform.lower()
+    for family in PLATFORM_FAMILIES:
+        if family in platform:
+            return family
+    return platform
+
+
+class SummaryMixin(object):
+    '''
+    Show the summary of the test run, the summary is loaded with the test
+    run in a single query.
+    '''
+    def case_count(self):
+        if self.summary is None:
+            return self.casenum
+        return self.summary.case_count
+
+    def sample_count(self):
+        if self.summary is None:
+            return None
+        return self.summary.sample_count
+
+    def date_range(self):
+        if self.summary is None or self.summary.date_start is None:
+            return None
+        if self.summary.date_start == self.summary.date_end:
+            return str(self.summary.date_start)
+        return '{} - {}'.format(self.summary.date_start,
+                                self.summary.date_end)
+
+
+class NetworkSummary(Model):
+    '''
+    table for storing the network test result summary of the test runs, it is
+    written by utils/flask_load_db.py when the test run is loaded
+    '''
+    __tablename__ = 'network_summary'
+    __table_args__ = (
+        Index('ix_network_summary_testrun', 'testrun'),
+    )
+    id = Column(Integer, primary_key=True)
+    testrun = Column(String(100))
+    case_count = Column(Integer)
+    sample_count = Column(Integer)
+    date_start = Column(Date, nullable=True)
+    date_end = Column(Date, nullable=True)
+    throughput_mean = Column(Float, nullable=True)
+    throughput_min = Column(Float, nullable=True)
+    throughput_max = Column(Float, nullable=True)
+    trans_mean = Column(Float, nullable=True)
+    trans_min = Column(Float, nullable=True)
+    trans_max = Column(Float, nullable=True)
+    latency_mean = Column(Float, nullable=True)
+    latency_min = Column(Float, nullable=True)
+    latency_max = Column(Float, nullable=True)
+
+
+class NetworkRun(SummaryMixin, Model):
     '''
     table for storing network test result
     '''
+    __table_args__ = (
+        Index('ix_network_run_testrun', 'testrun'),
+        Index('ix_network_run_platform', 'platform'),
+        Index('ix_network_run_platform_family', 'platform_family'),
+    )
     id = Column(Integer, primary_key=True)
     testrun = Column(String(100))
     platform = Column(String(50))
+    # normalized platform for the platform views, see get_platform_family
+    platform_family = Column(String(50), nullable=True)
     flavor = Column(String(50))
     branch = Column(String(50))
     compose = Column(String(50), nullable=True)
@@ -45,6 +119,12 @@ class NetworkRun(Model):
     result = Column(String(50))
     # metadata location in the file system
     rawdata = Column(String, nullable=True)
+    summary = relationship(
+        'NetworkSummary',
+        primaryjoin='foreign(NetworkSummary.testrun) == NetworkRun.testrun',
+        uselist=False,
+        viewonly=True,
+        lazy='joined')
 
     def rawdata_url(self):
         if self.rawdata.startswith('http'):
@@ -64,8 +144,8 @@ class NetworkRun(Model):
         print("testrun is {}".format(self.testrun))
         if self.testrun is not None and self.testrun != '' and "None" not in self.testrun:
             self.result = url_for('NetworkResultPubView.list',
-                                  _flt_0_testrun=str(self.testrun),
-                                  _flt_0_platform=str(self.platform))
+                                  _flt_3_testrun=str(self.testrun),
+                                  _flt_3_platform=str(self.platform))
             print("testrun is {}".format(self.testrun))
         return Markup('<a href="' + self.result + '">result</a>')
 
@@ -74,10 +154,19 @@ class NetworkResult(Model):
     '''
     table for storing network test result
     '''
+    __table_args__ = (
+        Index('ix_network_result_testrun', 'testrun'),
+        Index('ix_network_result_testrun_platform', 'testrun', 'platform'),
+        Index('ix_network_result_case_id_date', 'case_id', 'date'),
+        Index('ix_network_result_platform_date', 'platform', 'date'),
+        Index('ix_network_result_platform_family', 'platform_family'),
+    )
     id = Column(Integer, primary_key=True)
     testrun = Column(String(200))
     run_type = Column(String(50))
     platform = Column(String(50))
+    # normalized platform for the platform views, see get_platform_family
+    platform_family = Column(String(50), nullable=True)
     flavor = Column(String(50), nullable=True)
     cpu_model = Column(String(100), nullable=True)
     cpu = Column(String(100), nullable=True)
@@ -116,13 +205,46 @@ class NetworkResult(Model):
             )
 
 
-class StorageRun(Model):
+class StorageSummary(Model):
+    '''
+    table for storing the storage test result summary of the test runs, it is
+    written by utils/flask_load_db.py when the test run is loaded
+    '''
+    __tablename__ = 'storage_summary'
+    __table_args__ = (
+        Index('ix_storage_summary_testrun', 'testrun'),
+    )
+    id = Column(Integer, primary_key=True)
+    testrun = Column(String(100))
+    case_count = Column(Integer)
+    sample_count = Column(Integer)
+    date_start = Column(Date, nullable=True)
+    date_end = Column(Date, nullable=True)
+    iops_mean = Column(Float, nullable=True)
+    iops_min = Column(Float, nullable=True)
+    iops_max = Column(Float, nullable=True)
+    latency_mean = Column(Float, nullable=True)
+    latency_min = Column(Float, nullable=True)
+    latency_max = Column(Float, nullable=True)
+    clat_mean = Column(Float, nullable=True)
+    clat_min = Column(Float, nullable=True)
+    clat_max = Column(Float, nullable=True)
+
+
+class StorageRun(SummaryMixin, Model):
     '''
     table for storing storage test result
     '''
+    __table_args__ = (
+        Index('ix_storage_run_testrun', 'testrun'),
+        Index('ix_storage_run_platform', 'platform'),
+        Index('ix_storage_run_platform_family', 'platform_family'),
+    )
     id = Column(Integer, primary_key=True)
     testrun = Column(String(100))
     platform = Column(String(50))
+    # normalized platform for the platform views, see get_platform_family
+    platform_family = Column(String(50), nullable=True)
     flavor = Column(String(50))
     branch = Column(String(50))
     compose = Column(String(50), nullable=True)
@@ -131,6 +253,12 @@ class StorageRun(Model):
     result = Column(String(50))
     # metadata location in the file system
     rawdata = Column(String, nullable=True)
+    summary = relationship(
+        'StorageSummary',
+        primaryjoin='foreign(StorageSummary.testrun) == StorageRun.testrun',
+        uselist=False,
+        viewonly=True,
+        lazy='joined')
 
     def rawdata_url(self):
         if self.rawdata.startswith('http'):
@@ -150,8 +278,8 @@ class StorageRun(Model):
         print("testrun is {}".format(self.testrun))
         if self.testrun is not None and self.testrun != '' and "None" not in self.testrun:
             self.result = url_for('StorageResultPubView.list',
-                                  _flt_0_testrun=str(self.testrun),
-                                  _flt_0_platform=str(self.platform))
+                                  _flt_3_testrun=str(self.testrun),
+                                  _flt_3_platform=str(self.platform))
             print("testrun is {}".format(self.testrun))
         return Markup('<a href="' + self.result + '">result</a>')
 
@@ -160,6 +288,13 @@ class StorageResult(Model):
     '''
     table for storing storage test result
     '''
+    __table_args__ = (
+        Index('ix_storage_result_testrun', 'testrun'),
+        Index('ix_storage_result_testrun_platform', 'testrun', 'platform'),
+        Index('ix_storage_result_case_id_date', 'case_id', 'date'),
+        Index('ix_storage_result_platform_date', 'platform', 'date'),
+        Index('ix_storage_result_platform_family', 'platform_family'),
+    )
     id = Column(Integer, primary_key=True)
     testrun = Column(String(100))
     kernel = Column(String(50))
@@ -181,6 +316,8 @@ class StorageResult(Model):
     cpu_model = Column(String(100), nullable=True)
     memory = Column(String(100), nullable=True)
     platform = Column(String(50))
+    # normalized platform for the platform views, see get_platform_family
+    platform_family = Column(String(50), nullable=True)
     flavor = Column(String(50), nullable=True)
     date = Column(Date)
     comments = Column(String, nullable=True)
@@ -203,6 +340,9 @@ class ComparedResult(Model):
     '''
     table for storing compared result
     '''
+    __table_args__ = (
+        Index('ix_compared_result_report_id', 'report_id'),
+    )
     id = Column(Integer, primary_key=True)
     report_id = Column(String(200))
     baseid = Column(String(200))
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+File:  results.py @flask-appbuilder
+Read the result tables with SQL statements instead of the ORM objects, so
+that the large result lists can be paged and streamed.
+"""
+
+import csv
+import datetime
+import io
+import json
+
+from sqlalchemy import select, tuple_
+
+# The columns which the pages are ordered by (the keyset of the pages)
+KEYSET_COLUMNS = ('testrun', 'id')
+
+# The number of rows fetched from the cursor at a time in the export
+CHUNK_SIZE = 1000
+
+
+def get_columns(table, fields=None):
+    '''
+    Get the columns of the projection, the fields are separated by commas.
+    The keyset columns are always included. Raise ValueError for an unknown
+    field.
+    '''
+    if not fields:
+        return list(table.columns)
+
+    names = [x.strip() for x in fields.split(',') if x.strip()]
+    unknown = [x for x in names if x not in table.columns]
+    if unknown:
+        raise ValueError('Unknown field(s): {}'.format(', '.join(unknown)))
+
+    for name in reversed(KEYSET_COLUMNS):
+        if name not in names:
+            names.insert(0, name)
+
+    return [table.columns[x] for x in names]
+
+
+def get_keyset_query(table, columns, filters=None, after=None, limit=None,
+                     date_from=None, date_to=None):
+    '''
+    Query the rows ordered by (testrun, id) which are after the keyset
+    (testrun, id) of the former page, so that a deep page seeks the index
+    instead of skipping the rows of the former pages. A filter matches any
+    of the values if it is a list, the date range includes both ends.
+    '''
+    query = select(columns)
+    for name, value in (filters or {}).items():
+        if isinstance(value, (list, tuple)):
+            query = query.where(table.columns[name].in_(value))
+        else:
+            query = query.where(table.columns[name] == value)
+    if date_from is not None:
+        query = query.where(table.c.date >= date_from)
+    if date_to is not None:
+        query = query.where(table.c.date <= date_to)
+    if after is not None:
+        query = query.where(
+            tuple_(table.c.testrun, table.c.id) > tuple_(*after))
+    query = query.order_by(table.c.testrun, table.c.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def get_json_value(value):
+    '''
+    Convert the value of the column into a JSON value.
+    '''
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def get_row_dict(row, keys):
+    '''
+    Convert the row into a dict keyed by the column names.
+    '''
+    return {key: get_json_value(value) for key, value in zip(keys, row)}
+
+
+def get_ndjson_lines(rows, keys):
+    '''
+    Yield the rows as NDJSON lines (a JSON object per line).
+    '''
+    for row in rows:
+        yield json.dumps(get_row_dict(row, keys)) + '\n'
+
+
+def get_chunks(result, size=CHUNK_SIZE):
+    '''
+    Yield the rows of the result in chunks, so that only a chunk of the rows
+    is held in the memory at a time.
+    '''
+    while True:
+        rows = result.fetchmany(size)
+        if not rows:
+            break
+        yield rows
+
+
+def get_ndjson_chunks(result, keys, size=CHUNK_SIZE):
+    '''
+    Yield the rows of the result as NDJSON, a chunk of the lines at a time.
+    '''
+    for rows in get_chunks(result, size):
+        yield ''.join(get_ndjson_lines(rows, keys))
+
+
+def get_csv_chunks(result, keys, size=CHUNK_SIZE):
+    '''
+    Yield the rows of the result as CSV with the header, a chunk of the
+    lines at a time. The dates are written in ISO format by the writer.
+    '''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(keys)
+    for rows in get_chunks(result, size):
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # The header only if there is no row
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -6,13 +6,15 @@ Owner: Frank Liang <xiliang@redhat.com>
 
 from flask_appbuilder.models.sqla.interface import SQLAInterface
 from flask_appbuilder.api import ModelRestApi
-from flask_appbuilder.models.sqla.filters import FilterEqualFunction, FilterContains
+from flask_appbuilder.models.sqla.filters import FilterEqualFunction, FilterEqual
 from flask_appbuilder.views import (ModelView, CompactCRUDMixin,
                                     MasterDetailView, SimpleFormView, expose)
+from flask_appbuilder import BaseView, has_access
 from flask_appbuilder.widgets import ListBlock, ShowBlockWidget, ListWidget, ShowWidget, FormWidget
 from flask_appbuilder import MultipleView
 from flask_appbuilder.actions import action
 from flask import redirect, render_template, flash, url_for, Markup, request, session
+from flask import Response, jsonify, stream_with_context
 from flask_babel import lazy_gettext as _
 
 from . import appbuilder, db
@@ -22,7 +24,10 @@ import tempfile
 import datetime
 
 from .models import (StorageRun, StorageResult, Bugs, FailureType,
-                     FailureStatus, ComparedResult, NetworkRun, NetworkResult)
+                     FailureStatus, ComparedResult, NetworkRun, NetworkResult,
+                     NetworkSummary, StorageSummary, get_platform_family)
+from .results import (KEYSET_COLUMNS, get_columns, get_keyset_query,
+                      get_row_dict, get_ndjson_chunks, get_csv_chunks)
 
 # Below import is for charts
 import calendar
@@ -271,7 +276,22 @@ class MyShowWidget(ShowWidget):
     template = 'widgets/my_show.html'
 
 
-class NetworkRunPubView(ModelView):
+class PlatformFamilyMixin(object):
+    '''
+    Keep the normalized platform, which the platform views filter on, for the
+    items added or edited in the views.
+    '''
+    add_exclude_columns = ["platform_family"]
+    edit_exclude_columns = ["platform_family"]
+
+    def pre_add(self, item):
+        item.platform_family = get_platform_family(item.platform)
+
+    def pre_update(self, item):
+        item.platform_family = get_platform_family(item.platform)
+
+
+class NetworkRunPubView(PlatformFamilyMixin, ModelView):
     datamodel = SQLAInterface(NetworkRun)
     base_permissions = ["can_list", "can_show", "menu_access"]
 
@@ -300,11 +320,16 @@ class NetworkRunPubView(ModelView):
     label_columns = {
         "result_url": "Result",
         "rawdata_url": "RawData",
+        "case_count": "Cases",
+        "sample_count": "Samples",
+        "date_range": "Date",
     }
+    add_exclude_columns = ["platform_family", "summary"]
+    edit_exclude_columns = ["platform_family", "summary"]
 
     list_columns = [
         "id", "testrun", "platform", "flavor", "branch", "compose", "kernel",
-        "casenum", "result_url", "rawdata_url"
+        "case_count", "sample_count", "date_range", "result_url", "rawdata_url"
     ]
     search_columns = [
         "id", "testrun", "platform", "flavor", "branch", "compose", "kernel",
@@ -315,7 +340,8 @@ class NetworkRunPubView(ModelView):
         ("Summary", {
             "fields": [
                 "id", "testrun", "platform", "flavor", "branch", "compose",
-                "kernel", "casenum", "result_url", "rawdata_url"
+                "kernel", "casenum", "case_count", "sample_count",
+                "date_range", "result_url", "rawdata_url"
             ]
         }),
         ("Description", {
@@ -327,19 +353,19 @@ class NetworkRunPubView(ModelView):
 
 
 class EC2NetworkRunPubView(NetworkRunPubView):
-    base_filters = [["platform", FilterContains, 'ec2']]
+    base_filters = [["platform_family", FilterEqual, 'ec2']]
 
 
 class AzureNetworkRunPubView(NetworkRunPubView):
-    base_filters = [["platform", FilterContains, 'azure']]
+    base_filters = [["platform_family", FilterEqual, 'azure']]
 
 
 class EsxiNetworkRunPubView(NetworkRunPubView):
-    base_filters = [["platform", FilterContains, 'esxi']]
+    base_filters = [["platform_family", FilterEqual, 'esxi']]
 
 
 class HypervNetworkRunPubView(NetworkRunPubView):
-    base_filters = [["platform", FilterContains, 'hyperv']]
+    base_filters = [["platform_family", FilterEqual, 'hyperv']]
 
 
 class NetworkRunEditView(NetworkRunPubView):
@@ -377,7 +403,7 @@ class HypervNetworkRunEditView(HypervNetworkRunPubView):
     ]
 
 
-class NetworkResultPubView(ModelView):
+class NetworkResultPubView(PlatformFamilyMixin, ModelView):
     datamodel = SQLAInterface(NetworkResult)
     base_permissions = ["can_list", "can_show", "menu_access"]
 
@@ -432,19 +458,19 @@ class NetworkResultPubView(ModelView):
 
 
 class EC2NetworkResultPubView(NetworkResultPubView):
-    base_filters = [["platform", FilterContains, 'ec2']]
+    base_filters = [["platform_family", FilterEqual, 'ec2']]
 
 
 class AzureNetworkResultPubView(NetworkResultPubView):
-    base_filters = [["platform", FilterContains, 'azure']]
+    base_filters = [["platform_family", FilterEqual, 'azure']]
 
 
 class EsxiNetworkResultPubView(NetworkResultPubView):
-    base_filters = [["platform", FilterContains, 'esxi']]
+    base_filters = [["platform_family", FilterEqual, 'esxi']]
 
 
 class HypervNetworkResultPubView(NetworkResultPubView):
-    base_filters = [["platform", FilterContains, 'hyperv']]
+    base_filters = [["platform_family", FilterEqual, 'hyperv']]
 
 
 class NetworkResultEditView(NetworkResultPubView):
@@ -482,7 +508,49 @@ class HypervNetworkResultEditView(HypervNetworkResultPubView):
     ]
 
 
-class StorageRunPubView(ModelView):
+class NetworkSummaryPubView(ModelView):
+    datamodel = SQLAInterface(NetworkSummary)
+    base_permissions = ["can_list", "can_show", "menu_access"]
+
+    label_columns = {
+        "case_count": "Cases",
+        "sample_count": "Samples",
+        "date_start": "Date Start",
+        "date_end": "Date End",
+    }
+
+    list_columns = [
+        "id", "testrun", "case_count", "sample_count", "date_start",
+        "date_end",
+        "throughput_mean", "throughput_min", "throughput_max", "trans_mean",
+        "trans_min", "trans_max", "latency_mean", "latency_min", "latency_max"
+    ]
+    search_columns = ["id", "testrun", "date_start", "date_end"]
+    base_order = ("id", "desc")
+
+
+class StorageSummaryPubView(ModelView):
+    datamodel = SQLAInterface(StorageSummary)
+    base_permissions = ["can_list", "can_show", "menu_access"]
+
+    label_columns = {
+        "case_count": "Cases",
+        "sample_count": "Samples",
+        "date_start": "Date Start",
+        "date_end": "Date End",
+    }
+
+    list_columns = [
+        "id", "testrun", "case_count", "sample_count", "date_start",
+        "date_end",
+        "iops_mean", "iops_min", "iops_max", "latency_mean", "latency_min",
+        "latency_max", "clat_mean", "clat_min", "clat_max"
+    ]
+    search_columns = ["id", "testrun", "date_start", "date_end"]
+    base_order = ("id", "desc")
+
+
+class StorageRunPubView(PlatformFamilyMixin, ModelView):
     datamodel = SQLAInterface(StorageRun)
     base_permissions = ["can_list", "can_show", "menu_access"]
     #show_widget = MyShowWidget
@@ -510,11 +578,19 @@ class StorageRunPubView(ModelView):
         return redirect("/yamlformview/form?baserun={}&testrun={}".format(
             testrun, baserun))
 
-    label_columns = {"rawdata_url": "RawData", "result_url": "Result"}
+    label_columns = {
+        "rawdata_url": "RawData",
+        "result_url": "Result",
+        "case_count": "Cases",
+        "sample_count": "Samples",
+        "date_range": "Date",
+    }
+    add_exclude_columns = ["platform_family", "summary"]
+    edit_exclude_columns = ["platform_family", "summary"]
 
     list_columns = [
         "id", "testrun", "platform", "flavor", "branch", "compose", "kernel",
-        "casenum", "result_url", "rawdata_url"
+        "case_count", "sample_count", "date_range", "result_url", "rawdata_url"
     ]
     search_columns = [
         "id", "testrun", "platform", "flavor", "branch", "compose", "kernel",
@@ -525,7 +601,8 @@ class StorageRunPubView(ModelView):
         ("Summary", {
             "fields": [
                 "id", "testrun", "platform", "flavor", "branch", "compose",
-                "kernel", "casenum", "result_url", "rawdata_url"
+                "kernel", "casenum", "case_count", "sample_count",
+                "date_range", "result_url", "rawdata_url"
             ]
         }),
         ("Description", {
@@ -546,19 +623,19 @@ class StorageRunEditView(StorageRunPubView):
 
 
 class EC2StorageRunPubView(StorageRunPubView):
-    base_filters = [["platform", FilterContains, 'ec2']]
+    base_filters = [["platform_family", FilterEqual, 'ec2']]
 
 
 class AzureStorageRunPubView(StorageRunPubView):
-    base_filters = [["platform", FilterContains, 'azure']]
+    base_filters = [["platform_family", FilterEqual, 'azure']]
 
 
 class EsxiStorageRunPubView(StorageRunPubView):
-    base_filters = [["platform", FilterContains, 'esxi']]
+    base_filters = [["platform_family", FilterEqual, 'esxi']]
 
 
 class HypervStorageRunPubView(StorageRunPubView):
-    base_filters = [["platform", FilterContains, 'hyperv']]
+    base_filters = [["platform_family", FilterEqual, 'hyperv']]
 
 
 class EC2StorageRunEditView(EC2StorageRunPubView):
@@ -594,7 +671,7 @@ class StorageRunModelApi(ModelRestApi):
     datamodel = SQLAInterface(StorageRun)
 
 
-class StorageResultPubView(ModelView):
+class StorageResultPubView(PlatformFamilyMixin, ModelView):
     datamodel = SQLAInterface(StorageResult)
     base_permissions = ["can_list", "can_show", "menu_access"]
     # list_widget = ListBlock
@@ -646,19 +723,19 @@ class StorageResultPubView(ModelView):
 
 
 class EC2StorageResultPubView(StorageResultPubView):
-    base_filters = [["platform", FilterContains, 'ec2']]
+    base_filters = [["platform_family", FilterEqual, 'ec2']]
 
 
 class AzureStorageResultPubView(StorageResultPubView):
-    base_filters = [["platform", FilterContains, 'azure']]
+    base_filters = [["platform_family", FilterEqual, 'azure']]
 
 
 class EsxiStorageResultPubView(StorageResultPubView):
-    base_filters = [["platform", FilterContains, 'esxi']]
+    base_filters = [["platform_family", FilterEqual, 'esxi']]
 
 
 class HypervStorageResultPubView(StorageResultPubView):
-    base_filters = [["platform", FilterContains, 'hyperv']]
+    base_filters = [["platform_family", FilterEqual, 'hyperv']]
 
 
 class StorageResultEditView(StorageResultPubView):
@@ -701,6 +778,140 @@ class HypervStorageResultEditView(HypervStorageResultPubView):
     ]
 
 
+class ResultDataView(BaseView):
+    '''
+    Read-only JSON API of the result tables for the notebooks and scripts.
+
+    GET /resultdata/<storage|network>?testrun=&platform=&fields=&limit=
+        &after_testrun=&after_id=&format=<json|ndjson>
+
+    The rows are ordered by (testrun, id) and paged by the keyset of the
+    last row (after_testrun and after_id), which is returned as "next" in
+    JSON. The rows are streamed line by line in NDJSON, without the limit
+    the rest of the rows are streamed.
+
+    GET /resultdata/<storage|network>/export?testrun=&platform=&branch=
+        &date_from=&date_to=&fields=&format=<csv|ndjson>
+
+    All the rows of the filters are streamed from the cursor in chunks,
+    the filters can be repeated to match any of the values.
+    '''
+    route_base = '/resultdata'
+    default_view = 'results'
+
+    tables = {
+        'storage': StorageResult.__table__,
+        'network': NetworkResult.__table__,
+    }
+    filter_columns = ['testrun', 'platform']
+    export_filter_columns = ['testrun', 'platform', 'branch']
+    page_size = 100
+    max_page_size = 10000
+
+    def _stream(self, query, chunks, keys, mimetype, filename=None):
+        '''
+        Stream the rows of the query, the connection is held until all the
+        rows are sent.
+        '''
+        def generate():
+            conn = db.engine.connect()
+            try:
+                for chunk in chunks(conn.execute(query), keys):
+                    yield chunk
+            finally:
+                conn.close()
+
+        headers = {}
+        if filename:
+            headers['Content-Disposition'] = \
+                'attachment; filename={}'.format(filename)
+        return Response(stream_with_context(generate()),
+                        mimetype=mimetype, headers=headers)
+
+    @expose('/<kind>')
+    @has_access
+    def results(self, kind):
+        if kind not in self.tables:
+            return jsonify(message='Unknown result type: {}'.format(kind)), 404
+        table = self.tables[kind]
+
+        output_format = request.args.get('format', 'json')
+        if output_format not in ('json', 'ndjson'):
+            return jsonify(
+                message='Unsupported format: {}'.format(output_format)), 400
+
+        try:
+            columns = get_columns(table, request.args.get('fields'))
+            limit = request.args.get('limit', type=int)
+            if limit is None and output_format == 'json':
+                limit = self.page_size
+            if limit is not None and not 0 < limit <= self.max_page_size:
+                raise ValueError('The limit should be 1 to {}'.format(
+                    self.max_page_size))
+            after = None
+            if 'after_testrun' in request.args:
+                after = (request.args['after_testrun'],
+                         request.args.get('after_id', 0, type=int))
+        except ValueError as err:
+            return jsonify(message=str(err)), 400
+
+        filters = {
+            x: request.args[x]
+            for x in self.filter_columns if x in request.args
+        }
+        query = get_keyset_query(table, columns, filters, after, limit)
+        keys = [x.name for x in columns]
+
+        if output_format == 'ndjson':
+            return self._stream(query, get_ndjson_chunks, keys,
+                                'application/x-ndjson')
+
+        results = [get_row_dict(x, keys) for x in db.session.execute(query)]
+        next_page = None
+        if len(results) == limit:
+            next_page = {
+                'after_' + x: results[-1][x]
+                for x in KEYSET_COLUMNS
+            }
+        return jsonify(results=results, next=next_page)
+
+    @expose('/<kind>/export')
+    @has_access
+    def export(self, kind):
+        if kind not in self.tables:
+            return jsonify(message='Unknown result type: {}'.format(kind)), 404
+        table = self.tables[kind]
+
+        output_format = request.args.get('format', 'csv')
+        if output_format not in ('csv', 'ndjson'):
+            return jsonify(
+                message='Unsupported format: {}'.format(output_format)), 400
+
+        try:
+            columns = get_columns(table, request.args.get('fields'))
+            dates = {}
+            for name in ('date_from', 'date_to'):
+                if name in request.args:
+                    dates[name] = datetime.datetime.strptime(
+                        request.args[name], '%Y-%m-%d').date()
+        except ValueError as err:
+            return jsonify(message=str(err)), 400
+
+        filters = {
+            x: request.args.getlist(x)
+            for x in self.export_filter_columns if x in request.args
+        }
+        query = get_keyset_query(table, columns, filters, **dates)
+        keys = [x.name for x in columns]
+
+        filename = '{}_results.{}'.format(kind, output_format)
+        if output_format == 'ndjson':
+            return self._stream(query, get_ndjson_chunks, keys,
+                                'application/x-ndjson', filename)
+        return self._stream(query, get_csv_chunks, keys, 'text/csv',
+                            filename)
+
+
 class ComparedResultPubView(ModelView):
     datamodel = SQLAInterface(ComparedResult)
     base_permissions = ["can_list", "can_show", "menu_access"]
@@ -824,6 +1035,10 @@ appbuilder.add_view(HypervStorageRunPubView,
                     "Storage Test Runs - HyperV",
                     icon="fa-angle-double-right",
                     category="StorageTest")
+appbuilder.add_view(StorageSummaryPubView,
+                    "Storage Test Run Summaries",
+                    icon="fa-angle-double-right",
+                    category="StorageTest")
 appbuilder.add_separator("StorageTest")
 appbuilder.add_view(StorageResultPubView,
                     "Storage Test Results - All",
@@ -866,6 +1081,10 @@ appbuilder.add_view(HypervNetworkRunPubView,
                     "Network Test Runs - HyperV",
                     icon="fa-angle-double-right",
                     category="NetworkTest")
+appbuilder.add_view(NetworkSummaryPubView,
+                    "Network Test Run Summaries",
+                    icon="fa-angle-double-right",
+                    category="NetworkTest")
 appbuilder.add_separator("NetworkTest")
 appbuilder.add_view(NetworkResultPubView,
                     "Network Test Results - All",
@@ -1003,6 +1222,7 @@ appbuilder.add_view(BugsPubView,
 # appbuilder.add_view(YamlFormView, "My form View", icon="fa-group", label=_('My form View'),
 #                     category="My Forms", category_icon="fa-cogs")
 appbuilder.add_view_no_menu(YamlFormView)
+appbuilder.add_view_no_menu(ResultDataView)
 appbuilder.add_api(StorageResultModelApi)
 
 # appbuilder.add_separator("TestReports")
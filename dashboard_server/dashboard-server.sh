@@ -30,6 +30,9 @@ if [ ! -e /data/app.db ]; then
     flask fab create-admin
 fi
 
+# Migrate the database (create the missing indexes)
+python3 /opt/perf-insight/utils/flask_migrate_db.py --db_file /data/app.db
+
 # Start Flask server
 cd /opt/perf-insight/dashboard_server/
 flask run --host 0.0.0.0 --port 8080
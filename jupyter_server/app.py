@@ -5,6 +5,8 @@ import logging
 import os
 import yaml
 import re
+import shutil
+import tempfile
 import time
 
 
@@ -240,19 +242,61 @@ class JupyterHelper():
             }
             return True, lab_safe
 
+    def _get_file_stats(self, path):
+        """Get the (size, mtime) of the files keyed by the relative paths."""
+        stats = {}
+        for dirpath, dirnames, filenames in os.walk(path):
+            for filename in filenames:
+                file = os.path.join(dirpath, filename)
+                stat = os.lstat(file)
+                stats[os.path.relpath(file, path)] = (stat.st_size,
+                                                      stat.st_mtime_ns)
+        return stats
+
+    def _write_back(self, source, target, stats):
+        """Write back the files changed in the source since the stats were
+        taken, each file is replaced atomically in the target."""
+        new_stats = self._get_file_stats(source)
+        changed = [x for x, stat in new_stats.items() if stats.get(x) != stat]
+        for name in changed:
+            file = os.path.join(target, name)
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+            temp_file = '{}.{}.tmp'.format(file, os.getpid())
+            shutil.copy2(os.path.join(source, name), temp_file)
+            os.replace(temp_file, file)
+        for name in set(stats) - set(new_stats):
+            os.unlink(os.path.join(target, name))
+        LOG.debug('Wrote back {} files to "{}".'.format(len(changed), target))
+
+    def _copy_to_scratch(self, src, dst):
+        """Copy a file to the scratch area, the data files are read only so
+        that they are linked instead (and read only if needed)."""
+        if os.path.basename(src) in ('test.datastore.json',
+                                     'base.datastore.json',
+                                     'test.datastore.parquet',
+                                     'base.datastore.parquet'):
+            os.symlink(os.path.abspath(src), dst)
+        else:
+            shutil.copy2(src, dst)
+
     # Report Functions
-    def create_report(self, report_id):
+    def create_report(self, report_id, regenerate=False, force=False):
         """Create the benchmark report in staging area.
 
+        The report pipeline executes only the stages whose inputs changed,
+        so that regenerating a report is incremental.
+
         Input:
-            report_id - the benchmark report ID
+            report_id  - the benchmark report ID
+            regenerate - regenerate an existing report
+            force      - execute all the stages of the report pipeline
         Return:
             - (True, json-block), or
             - (False, message) if something goes wrong.
         """
         # Criteria check
         source = os.path.join(PERF_INSIGHT_ROOT, 'reports', report_id)
-        if os.path.isdir(source):
+        if not regenerate and os.path.isdir(source):
             msg = 'Report ID "{}" already exists.'.format(id)
             LOG.error(msg)
             return False, msg
@@ -263,10 +307,29 @@ class JupyterHelper():
             LOG.error(msg)
             return False, msg
 
-        # Create the report html
-        cmd = 'cd {} && /bin/bash -x ./utils/html_report.sh . &>./html_report.log'.format(
-            workspace)
-        res = os.system(cmd)
+        # Create the report html in a scratch copy of the workspace, so that
+        # the intermediate files are written to the local disk, then write
+        # back the results (and the log)
+        os.makedirs(PERF_INSIGHT_SCRATCH, exist_ok=True)
+        scratch = tempfile.mkdtemp(prefix='report_', dir=PERF_INSIGHT_SCRATCH)
+        try:
+            # The mtimes are kept since the pipeline compares them
+            local = os.path.join(scratch, report_id)
+            shutil.copytree(workspace, local,
+                            copy_function=self._copy_to_scratch)
+            stats = self._get_file_stats(local)
+
+            cmd = 'cd {} && python3 ./utils/report_pipeline.py --html {}>./html_report.log 2>&1'.format(
+                local, '--force ' if force else '')
+            res = os.system(cmd)
+
+            self._write_back(local, workspace, stats)
+        except Exception as err:
+            msg = 'Failed to deal with the files. error: {}'.format(err)
+            LOG.error(msg)
+            return False, msg
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
 
         if res > 0:
             msg = 'Failed to generate report html, see html_report.log for more details.'
@@ -504,7 +567,14 @@ app = Flask(__name__)
 @app.post('/reports/<id>')
 def create_report(id):
     LOG.info('Received request to create report for "{}".'.format(id))
-    res, con = helper.create_report(id)
+
+    req = request.get_json() if request.is_json else {}
+
+    # Parse args
+    regenerate = req.get('regenerate', False)
+    force = req.get('force', False)
+
+    res, con = helper.create_report(id, regenerate, force)
     if res:
         return jsonify(con), 200
     else:
@@ -659,6 +729,8 @@ PERF_INSIGHT_ROOT = config.get('perf_insight_root', '/mnt/perf-insight')
 PERF_INSIGHT_REPO = config.get('perf_insight_repo', '/opt/perf-insight')
 PERF_INSIGHT_STAG = config.get(
     'perf_insight_stag', os.path.join(PERF_INSIGHT_ROOT, '.staging'))
+PERF_INSIGHT_SCRATCH = config.get(
+    'perf_insight_scratch', os.path.join(tempfile.gettempdir(), 'perf-insight'))
 JUPYTER_WORKSPACE = config.get('jupyter_workspace', '/app/workspace')
 JUPYTER_LAB_HOST = config.get('jupyter_lab_host', 'localhost')
 JUPYTER_LAB_PORTS = config.get('jupyter_lab_ports', '8890-8899')
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+'''
+Report the query plans of the dashboard's standard queries
+
+The queries are the ones issued by the list views of the dashboard (the
+pages, the row counts and the filters) and by flask_load_db.py. The plan
+steps which scan a whole table are flagged, they are the candidates for
+new indexes.
+'''
+import sys
+import argparse
+import logging
+import sqlite3
+
+import flask_load_db
+
+LOG = logging.getLogger(__name__)
+
+logging.basicConfig(level=logging.DEBUG, format='%(levelname)s: %(message)s')
+
+ARG_PARSER = argparse.ArgumentParser(
+    description="Report the query plans of the dashboard database")
+ARG_PARSER.add_argument('--db_file',
+                        dest='db_file',
+                        action='store',
+                        help="specify database location",
+                        default=None,
+                        required=True)
+ARG_PARSER.add_argument('--testrun',
+                        dest='testrun',
+                        action='store',
+                        help="the TestRunID used in the queries",
+                        default='fio_TestRunA',
+                        required=False)
+ARG_PARSER.add_argument('--platform',
+                        dest='platform',
+                        action='store',
+                        help="the platform used in the queries",
+                        default='ESXi',
+                        required=False)
+
+PAGE_SIZE = 25
+
+# (name, sql) of the queries, the parameters are filled by name
+RUN_QUERIES = [
+    ('list', 'SELECT * FROM {table} ORDER BY id DESC LIMIT {limit}'),
+    ('count', 'SELECT count(*) FROM {table}'),
+    ('filter by platform',
+     'SELECT * FROM {table} WHERE platform_family = :family '
+     'ORDER BY id DESC LIMIT {limit}'),
+    ('filter by platform count',
+     'SELECT count(*) FROM {table} WHERE platform_family = :family'),
+    ('lookup by testrun', 'SELECT * FROM {table} WHERE testrun = :testrun'),
+    ('delete by testrun', 'DELETE FROM {table} WHERE testrun = :testrun'),
+]
+
+RESULT_QUERIES = [
+    ('list', 'SELECT * FROM {table} ORDER BY id DESC LIMIT {limit}'),
+    ('count', 'SELECT count(*) FROM {table}'),
+    ('result_url',
+     'SELECT * FROM {table} WHERE testrun = :testrun AND '
+     'platform = :platform ORDER BY id DESC LIMIT {limit}'),
+    ('result_url count',
+     'SELECT count(*) FROM {table} WHERE testrun = :testrun AND '
+     'platform = :platform'),
+    ('filter by platform',
+     'SELECT * FROM {table} WHERE platform_family = :family '
+     'ORDER BY id DESC LIMIT {limit}'),
+    ('filter by platform count',
+     'SELECT count(*) FROM {table} WHERE platform_family = :family'),
+    ('keyset page',
+     'SELECT * FROM {table} WHERE (testrun, id) > (:testrun, 0) '
+     'ORDER BY testrun, id LIMIT {limit}'),
+    ('keyset page by testrun',
+     'SELECT * FROM {table} WHERE testrun = :testrun AND '
+     '(testrun, id) > (:testrun, 0) ORDER BY testrun, id LIMIT {limit}'),
+    ('filter by case',
+     'SELECT * FROM {table} WHERE case_id = :case_id '
+     'ORDER BY date DESC LIMIT {limit}'),
+    ('delete by testrun', 'DELETE FROM {table} WHERE testrun = :testrun'),
+]
+
+SUMMARY_QUERIES = [
+    ('lookup by testrun', 'SELECT * FROM {table} WHERE testrun = :testrun'),
+    ('delete by testrun', 'DELETE FROM {table} WHERE testrun = :testrun'),
+]
+
+QUERIES = {
+    'network_run': RUN_QUERIES,
+    'network_result': RESULT_QUERIES,
+    'storage_run': RUN_QUERIES,
+    'storage_result': RESULT_QUERIES,
+    'network_summary': SUMMARY_QUERIES,
+    'storage_summary': SUMMARY_QUERIES,
+    'compared_result': [
+        ('list', 'SELECT * FROM {table} ORDER BY id DESC LIMIT {limit}'),
+        ('lookup by report',
+         'SELECT * FROM {table} WHERE report_id = :report_id'),
+    ],
+}
+
+
+def explain_queries(db_file, testrun, platform):
+    '''
+    Print the query plans of the standard queries, return the number of the
+    queries which scan a whole table.
+    '''
+    params = {
+        'testrun': testrun,
+        'platform': platform,
+        'family': flask_load_db.get_platform_family(platform),
+        'case_id': 'read-4KiB-1d-1j',
+        'report_id': 'benchmark_{}'.format(testrun)
+    }
+
+    conn = sqlite3.connect(db_file)
+    tables = [x[0] for x in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table'")]
+
+    scan_count = 0
+    for table, queries in QUERIES.items():
+        if table not in tables:
+            LOG.info("Table '{}' doesn't exist. Skip.".format(table))
+            continue
+        for name, sql in queries:
+            sql = sql.format(table=table, limit=PAGE_SIZE)
+            plan = conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+            details = [x[-1] for x in plan]
+            # "SCAN <table>" without an index walks the whole table to
+            # filter the rows (a page without filter walks the rowids only)
+            is_scan = 'WHERE' in sql and any(
+                x.startswith('SCAN') and 'USING' not in x for x in details)
+            scan_count += is_scan
+            print('{}: {}{}'.format(table, name,
+                                    ' (FULL SCAN)' if is_scan else ''))
+            print('    {}'.format(sql))
+            for detail in details:
+                print('    -> {}'.format(detail))
+
+    conn.close()
+    LOG.info("Full scan queries: {}".format(scan_count))
+    return scan_count
+
+
+if __name__ == "__main__":
+    ARGS = ARG_PARSER.parse_args()
+    explain_queries(ARGS.db_file, ARGS.testrun, ARGS.platform)
+    sys.exit(0)
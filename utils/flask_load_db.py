@@ -24,9 +24,12 @@ import argparse
 import logging
 import time
 import csv
+import io
+import math
 import json
 from sqlalchemy import create_engine
-from sqlalchemy import Column, Integer, String, Float, Date
+from sqlalchemy import event
+from sqlalchemy import Column, Integer, String, Float, Date, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -64,6 +67,30 @@ ARG_PARSER.add_argument('--delete',
                         help="delete matched test record if you want",
                         default=None,
                         required=False)
+ARG_PARSER.add_argument('--replace',
+                        dest='is_replace',
+                        action='store_true',
+                        help='replace the TestRun (with --csv_file) or the \
+benchmark record (with --json_file) in a single transaction',
+                        required=False)
+ARG_PARSER.add_argument('--bulk',
+                        dest='is_bulk',
+                        action='store_true',
+                        help='write TestResults in a single transaction with \
+batched inserts',
+                        required=False)
+ARG_PARSER.add_argument('--batch_size',
+                        dest='batch_size',
+                        action='store',
+                        type=int,
+                        help='the number of rows per insert in bulk mode',
+                        default=1000,
+                        required=False)
+ARG_PARSER.add_argument('--wal',
+                        dest='is_wal',
+                        action='store_true',
+                        help='enable WAL journaling for the database',
+                        required=False)
 ARG_PARSER.add_argument('-d',
                         dest='is_debug',
                         action='store_true',
@@ -84,22 +111,50 @@ ARG_GROUP.add_argument('--benchmark',
                        action='store_true',
                        help='write benchmark ReportResult',
                        required=False)
-ARGS = ARG_PARSER.parse_args()
 
-DB_ENGINE = create_engine('sqlite:///%s' % ARGS.db_file, echo=ARGS.is_debug)
-DB_SESSION = sessionmaker(bind=DB_ENGINE)
 DB_BASE = declarative_base()
 
 
+def get_db_engine(db_file, is_debug=False, is_wal=False):
+    '''
+    Create the engine for the database file. WAL journaling is persistent in
+    the database file, readers are not blocked by the writer in this mode.
+    '''
+    engine = create_engine('sqlite:///%s' % db_file, echo=is_debug)
+
+    if is_wal:
+        @event.listens_for(engine, 'connect')
+        def set_sqlite_pragma(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+            cursor.close()
+
+    return engine
+
+
+def get_db_session(db_file, is_debug=False, is_wal=False):
+    '''
+    Create the session maker for the database file.
+    '''
+    return sessionmaker(bind=get_db_engine(db_file, is_debug, is_wal))
+
+
 # pylint: disable=R0902,R0903
 class NetworkRun(DB_BASE):
     '''
     The network run table's schema definication.
     '''
     __tablename__ = 'network_run'
+    __table_args__ = (
+        Index('ix_network_run_testrun', 'testrun'),
+        Index('ix_network_run_platform', 'platform'),
+        Index('ix_network_run_platform_family', 'platform_family'),
+    )
     id = Column(Integer, primary_key=True)
     testrun = Column(String(100))
     platform = Column(String(50))
+    platform_family = Column(String(50), nullable=True)
     flavor = Column(String(50))
     branch = Column(String(50))
     compose = Column(String(50), nullable=True)
@@ -115,11 +170,19 @@ class NetworkResult(DB_BASE):
     The network result table's schema definication.
     '''
     __tablename__ = 'network_result'
+    __table_args__ = (
+        Index('ix_network_result_testrun', 'testrun'),
+        Index('ix_network_result_testrun_platform', 'testrun', 'platform'),
+        Index('ix_network_result_case_id_date', 'case_id', 'date'),
+        Index('ix_network_result_platform_date', 'platform', 'date'),
+        Index('ix_network_result_platform_family', 'platform_family'),
+    )
     id = Column(Integer, primary_key=True)
     testrun = Column(String(200))
     case_id = Column(String(100))
     run_type = Column(String(50))
     platform = Column(String(50))
+    platform_family = Column(String(50), nullable=True)
     flavor = Column(String(50), nullable=True)
     cpu_model = Column(String(100), nullable=True)
     cpu = Column(String(100), nullable=True)
@@ -147,14 +210,48 @@ class NetworkResult(DB_BASE):
     sqlite_autoincrement = True
 
 
+class NetworkSummary(DB_BASE):
+    '''
+    The network summary table's schema definication, the aggregates of the
+    TestResults are written at load time.
+    '''
+    __tablename__ = 'network_summary'
+    __table_args__ = (
+        Index('ix_network_summary_testrun', 'testrun'),
+    )
+    kpis = ('throughput', 'trans', 'latency')
+    id = Column(Integer, primary_key=True)
+    testrun = Column(String(100))
+    case_count = Column(Integer)
+    sample_count = Column(Integer)
+    date_start = Column(String(50), nullable=True)
+    date_end = Column(String(50), nullable=True)
+    throughput_mean = Column(Float, nullable=True)
+    throughput_min = Column(Float, nullable=True)
+    throughput_max = Column(Float, nullable=True)
+    trans_mean = Column(Float, nullable=True)
+    trans_min = Column(Float, nullable=True)
+    trans_max = Column(Float, nullable=True)
+    latency_mean = Column(Float, nullable=True)
+    latency_min = Column(Float, nullable=True)
+    latency_max = Column(Float, nullable=True)
+    sqlite_autoincrement = True
+
+
 class StorageTestRun(DB_BASE):
     '''
     The table's schema definication.
     '''
     __tablename__ = 'storage_run'
+    __table_args__ = (
+        Index('ix_storage_run_testrun', 'testrun'),
+        Index('ix_storage_run_platform', 'platform'),
+        Index('ix_storage_run_platform_family', 'platform_family'),
+    )
     id = Column(Integer, primary_key=True)
     testrun = Column(String(100))
     platform = Column(String(50))
+    platform_family = Column(String(50), nullable=True)
     flavor = Column(String(50))
     branch = Column(String(50))
     compose = Column(String(50), nullable=True)
@@ -170,6 +267,13 @@ class StorageTestResult(DB_BASE):
     table for storing TestResult
     '''
     __tablename__ = 'storage_result'
+    __table_args__ = (
+        Index('ix_storage_result_testrun', 'testrun'),
+        Index('ix_storage_result_testrun_platform', 'testrun', 'platform'),
+        Index('ix_storage_result_case_id_date', 'case_id', 'date'),
+        Index('ix_storage_result_platform_date', 'platform', 'date'),
+        Index('ix_storage_result_platform_family', 'platform_family'),
+    )
     id = Column(Integer, primary_key=True)
     testrun = Column(String(100))
     case_id = Column(String(100))
@@ -191,6 +295,7 @@ class StorageTestResult(DB_BASE):
     cpu_model = Column(String(100), nullable=True)
     memory = Column(String(100), nullable=True)
     platform = Column(String(50))
+    platform_family = Column(String(50), nullable=True)
     flavor = Column(String(50), nullable=True)
     date = Column(String)
     comments = Column(String, nullable=True)
@@ -200,11 +305,42 @@ class StorageTestResult(DB_BASE):
     sqlite_autoincrement = True
 
 
+class StorageSummary(DB_BASE):
+    '''
+    The storage summary table's schema definication, the aggregates of the
+    TestResults are written at load time.
+    '''
+    __tablename__ = 'storage_summary'
+    __table_args__ = (
+        Index('ix_storage_summary_testrun', 'testrun'),
+    )
+    kpis = ('iops', 'latency', 'clat')
+    id = Column(Integer, primary_key=True)
+    testrun = Column(String(100))
+    case_count = Column(Integer)
+    sample_count = Column(Integer)
+    date_start = Column(String(50), nullable=True)
+    date_end = Column(String(50), nullable=True)
+    iops_mean = Column(Float, nullable=True)
+    iops_min = Column(Float, nullable=True)
+    iops_max = Column(Float, nullable=True)
+    latency_mean = Column(Float, nullable=True)
+    latency_min = Column(Float, nullable=True)
+    latency_max = Column(Float, nullable=True)
+    clat_mean = Column(Float, nullable=True)
+    clat_min = Column(Float, nullable=True)
+    clat_max = Column(Float, nullable=True)
+    sqlite_autoincrement = True
+
+
 class BenchmarkReport(DB_BASE):
     '''
     The benchmark report table's schema definication.
     '''
     __tablename__ = 'compared_result'
+    __table_args__ = (
+        Index('ix_compared_result_report_id', 'report_id'),
+    )
     id = Column(Integer, primary_key=True)
     report_id = Column(String(200))
     baseid = Column(String(200))
@@ -216,21 +352,53 @@ class BenchmarkReport(DB_BASE):
     sqlite_autoincrement = True
 
 
-def network_testrun_write():
+PLATFORM_FAMILIES = ('ec2', 'azure', 'esxi', 'hyperv')
+
+
+def get_platform_family(platform):
+    '''
+    Normalize the platform into the family used by the dashboard views, such
+    as 'esxi' for 'ESXi'. The platform in lower case is used if no family
+    matches.
+    '''
+    if platform is None:
+        return None
+    platform = platform.lower()
+    for family in PLATFORM_FAMILIES:
+        if family in platform:
+            return family
+    return platform
+
+
+def iter_csv_rows(csv_file):
+    '''
+    Iterate the rows of the CSV file. A DataFrame is accepted as well, its
+    rows are read back from its CSV text, the same as from the CSV file.
+    '''
+    if hasattr(csv_file, 'to_csv'):
+        yield from csv.DictReader(io.StringIO(csv_file.to_csv()))
+        return
+    with open(csv_file, newline='') as csv_h:
+        yield from csv.DictReader(csv_h)
+
+
+def get_testrun(runmode, csv_file):
+    '''
+    Build the TestRun entry from the CSV file (or DataFrame), return None if
+    no row found.
+    '''
     tmp_raw = {}
     case_count = 0
-    with open(ARGS.csv_file, newline='') as csv_h:
-        readers = csv.DictReader(csv_h)
-        for r in readers:
-            tmp_raw = r
-            case_count += 1
+    for r in iter_csv_rows(csv_file):
+        tmp_raw = r
+        case_count += 1
 
     if case_count == 0:
-        LOG.info("No row found, please check!")
-        sys.exit(1)
-    testrun = NetworkRun()
+        return None
+    testrun = runmode()
     testrun.testrun = tmp_raw['Testrun']
     testrun.platform = tmp_raw['Platform']
+    testrun.platform_family = get_platform_family(tmp_raw['Platform'])
     testrun.flavor = tmp_raw['Flavor']
     testrun.branch = tmp_raw['Branch']
     testrun.compose = tmp_raw['Compose']
@@ -238,6 +406,14 @@ def network_testrun_write():
     testrun.casenum = case_count
     testrun.result = ''
     testrun.rawdata = tmp_raw['Testrun']
+    return testrun
+
+
+def network_testrun_write():
+    testrun = get_testrun(NetworkRun, ARGS.csv_file)
+    if testrun is None:
+        LOG.info("No row found, please check!")
+        sys.exit(1)
 
     if not testrun.testrun.startswith('uperf_'):
         LOG.error('TestRun ID "{}" is invalid.'.format(testrun.testrun))
@@ -259,7 +435,48 @@ def network_testrun_write():
         session.commit()
 
 
+def get_network_testresult(tmp_raw):
+    '''
+    Map a CSV row to the columns of NetworkResult.
+    '''
+    return {
+        'testrun': tmp_raw['Testrun'],
+        'run_type': tmp_raw['Type'],
+        'platform': tmp_raw['Platform'],
+        'platform_family': get_platform_family(tmp_raw['Platform']),
+        'flavor': tmp_raw['Flavor'],
+        'cpu_model': tmp_raw['CPU_Model'],
+        'cpu': tmp_raw['CPU'],
+        'hypervisor': tmp_raw['Hypervisor'],
+        'branch': tmp_raw['Branch'],
+        'compose': tmp_raw['Compose'],
+        'kernel': tmp_raw['Kernel'],
+        'vcpu': tmp_raw['vCPU'],
+        'memory': tmp_raw['Memory'],
+        'net_driver': tmp_raw['Net-Driver'],
+        'net_duplex': tmp_raw['Net-Duplex'],
+        'net_speed': tmp_raw['Net-Speed'],
+        'protocol': tmp_raw['Protocol'],
+        'testtype': tmp_raw['TestType'],
+        'case_id': tmp_raw['CaseID'],
+        'msize': tmp_raw['MSize'],
+        'instance': tmp_raw['Instance'],
+        'sample': tmp_raw['Sample'],
+        'throughput': tmp_raw['Throughput(Mb/s)'],
+        'trans': tmp_raw['Trans(t/s)'],
+        'latency': tmp_raw['Latency(us)'],
+        'tool_version': tmp_raw['Tool_Version'],
+        'rawdata': tmp_raw['Path'],
+        'date': tmp_raw['Date'],
+        'comments': ''
+    }
+
+
 def network_testresult_write():
+    if ARGS.is_bulk:
+        return testresult_bulk_write(NetworkResult, get_network_testresult,
+                                     'uperf_')
+
     tmp_raw = {}
     case_count = 0
     with open(ARGS.csv_file, newline='') as csv_h:
@@ -268,35 +485,7 @@ def network_testresult_write():
             tmp_raw = r
             case_count += 1
             print('.', end='', flush=True)
-            testresult = NetworkResult()
-            testresult.testrun = tmp_raw['Testrun']
-            testresult.run_type = tmp_raw['Type']
-            testresult.platform = tmp_raw['Platform']
-            testresult.flavor = tmp_raw['Flavor']
-            testresult.cpu_model = tmp_raw['CPU_Model']
-            testresult.cpu = tmp_raw['CPU']
-            testresult.hypervisor = tmp_raw['Hypervisor']
-            testresult.branch = tmp_raw['Branch']
-            testresult.compose = tmp_raw['Compose']
-            testresult.kernel = tmp_raw['Kernel']
-            testresult.vcpu = tmp_raw['vCPU']
-            testresult.memory = tmp_raw['Memory']
-            testresult.net_driver = tmp_raw['Net-Driver']
-            testresult.net_duplex = tmp_raw['Net-Duplex']
-            testresult.net_speed = tmp_raw['Net-Speed']
-            testresult.protocol = tmp_raw['Protocol']
-            testresult.testtype = tmp_raw['TestType']
-            testresult.case_id = tmp_raw['CaseID']
-            testresult.msize = tmp_raw['MSize']
-            testresult.instance = tmp_raw['Instance']
-            testresult.sample = tmp_raw['Sample']
-            testresult.throughput = tmp_raw['Throughput(Mb/s)']
-            testresult.trans = tmp_raw['Trans(t/s)']
-            testresult.latency = tmp_raw['Latency(us)']
-            testresult.tool_version = tmp_raw['Tool_Version']
-            testresult.rawdata = tmp_raw['Path']
-            testresult.date = tmp_raw['Date']
-            testresult.comments = ''
+            testresult = NetworkResult(**get_network_testresult(tmp_raw))
 
             if not testresult.testrun.startswith('uperf_'):
                 LOG.error('TestRun ID "{}" is invalid.'.format(
@@ -321,27 +510,10 @@ def network_testresult_write():
 
 
 def storage_testrun_write():
-    tmp_raw = {}
-    case_count = 0
-    with open(ARGS.csv_file, newline='') as csv_h:
-        readers = csv.DictReader(csv_h)
-        for r in readers:
-            tmp_raw = r
-            case_count += 1
-
-    if case_count == 0:
+    testrun = get_testrun(StorageTestRun, ARGS.csv_file)
+    if testrun is None:
         LOG.info("No row found, please check!")
         sys.exit(1)
-    testrun = StorageTestRun()
-    testrun.testrun = tmp_raw['Testrun']
-    testrun.platform = tmp_raw['Platform']
-    testrun.flavor = tmp_raw['Flavor']
-    testrun.branch = tmp_raw['Branch']
-    testrun.compose = tmp_raw['Compose']
-    testrun.kernel = tmp_raw['Kernel']
-    testrun.casenum = case_count
-    testrun.result = ''
-    testrun.rawdata = tmp_raw['Testrun']
 
     if not testrun.testrun.startswith('fio_'):
         LOG.error('TestRun ID "{}" is invalid.'.format(testrun.testrun))
@@ -363,7 +535,47 @@ def storage_testrun_write():
         session.commit()
 
 
+def get_storage_testresult(tmp_raw):
+    '''
+    Map a CSV row to the columns of StorageTestResult.
+    '''
+    return {
+        'testrun': tmp_raw['Testrun'],
+        'kernel': tmp_raw['Kernel'],
+        'branch': tmp_raw['Branch'],
+        'backend': tmp_raw['Backend'],
+        'driver': tmp_raw['Driver'],
+        'format': tmp_raw['Format'],
+        'case_id': tmp_raw['CaseID'],
+        'rw': tmp_raw['RW'],
+        'bs': tmp_raw['BS'],
+        'iodepth': tmp_raw['IOdepth'],
+        'numjobs': tmp_raw['Numjobs'],
+        'iops': tmp_raw['IOPS'],
+        'latency': tmp_raw['LAT(ms)'],
+        'clat': tmp_raw['CLAT(ms)'],
+        'tool_version': tmp_raw[''],
+        'compose': tmp_raw['Tool_Version'],
+        'cpu': tmp_raw['CPU'],
+        'cpu_model': tmp_raw['CPU_Model'],
+        'memory': tmp_raw['Memory'],
+        'platform': tmp_raw['Platform'],
+        'platform_family': get_platform_family(tmp_raw['Platform']),
+        'flavor': tmp_raw['Flavor'],
+        #tmp_date = time.strptime(tmp_raw['date'], "%a %b %d %H:%M:%S %Z %Y")
+        #'date': "{}-{}-{}".format(tmp_date.tm_year,tmp_date.tm_mon,tmp_date.tm_mday),
+        'date': tmp_raw['Date'],
+        'comments': tmp_raw['Comments'],
+        'sample': tmp_raw['Sample'],
+        'rawdata': tmp_raw['Path']
+    }
+
+
 def storage_testresult_write():
+    if ARGS.is_bulk:
+        return testresult_bulk_write(StorageTestResult, get_storage_testresult,
+                                     'fio_')
+
     tmp_raw = {}
     case_count = 0
     with open(ARGS.csv_file, newline='') as csv_h:
@@ -371,34 +583,7 @@ def storage_testresult_write():
         for r in readers:
             tmp_raw = r
             case_count += 1
-            testresult = StorageTestResult()
-            testresult.testrun = tmp_raw['Testrun']
-            testresult.kernel = tmp_raw['Kernel']
-            testresult.branch = tmp_raw['Branch']
-            testresult.backend = tmp_raw['Backend']
-            testresult.driver = tmp_raw['Driver']
-            testresult.format = tmp_raw['Format']
-            testresult.case_id = tmp_raw['CaseID']
-            testresult.rw = tmp_raw['RW']
-            testresult.bs = tmp_raw['BS']
-            testresult.iodepth = tmp_raw['IOdepth']
-            testresult.numjobs = tmp_raw['Numjobs']
-            testresult.iops = tmp_raw['IOPS']
-            testresult.latency = tmp_raw['LAT(ms)']
-            testresult.clat = tmp_raw['CLAT(ms)']
-            testresult.tool_version = tmp_raw['']
-            testresult.compose = tmp_raw['Tool_Version']
-            testresult.cpu = tmp_raw['CPU']
-            testresult.cpu_model = tmp_raw['CPU_Model']
-            testresult.memory = tmp_raw['Memory']
-            testresult.platform = tmp_raw['Platform']
-            testresult.flavor = tmp_raw['Flavor']
-            #tmp_date = time.strptime(tmp_raw['date'], "%a %b %d %H:%M:%S %Z %Y")
-            #testresult.date = "{}-{}-{}".format(tmp_date.tm_year,tmp_date.tm_mon,tmp_date.tm_mday)
-            testresult.date = tmp_raw['Date']
-            testresult.comments = tmp_raw['Comments']
-            testresult.sample = tmp_raw['Sample']
-            testresult.rawdata = tmp_raw['Path']
+            testresult = StorageTestResult(**get_storage_testresult(tmp_raw))
 
             if not testresult.testrun.startswith('fio_'):
                 LOG.error('TestRun ID "{}" is invalid.'.format(
@@ -421,60 +606,181 @@ def storage_testresult_write():
         LOG.info("Line wrote: {}".format(case_count))
 
 
-def testrun_delete(runmode=None):
-    if ARGS.testrun_delete is None:
-        LOG.info("Please specify --delete option to delete a TestRun.")
-        return False
-    testrun = ARGS.testrun_delete
+def testresult_bulk_insert(session, resultmode, get_testresult, prefix,
+                           csv_file, batch_size=1000):
+    '''
+    Insert the TestResults from the CSV file (or DataFrame) in batches of
+    batch_size with executemany, return the number of rows, or None if any
+    of them is invalid. The caller commits or rolls back the session.
+    '''
+    case_count = 0
+    batch = []
+    for r in iter_csv_rows(csv_file):
+        testresult = get_testresult(r)
+        if not testresult['testrun'].startswith(prefix):
+            LOG.error('TestRun ID "{}" is invalid.'.format(
+                testresult['testrun']))
+            return None
+
+        batch.append(testresult)
+        case_count += 1
+        if len(batch) >= batch_size:
+            session.bulk_insert_mappings(resultmode, batch)
+            batch = []
+
+    if batch:
+        session.bulk_insert_mappings(resultmode, batch)
+    return case_count
+
+
+def testresult_bulk_write(resultmode, get_testresult, prefix):
+    '''
+    Write the TestResults of a TestRun in a single transaction, nothing will
+    be written if any of them is invalid.
+    '''
     session = DB_SESSION()
-    results = session.query(runmode).filter_by(testrun=testrun).all()
-    if len(results) == 0:
-        LOG.info("No related TestRun entries. Skip.".format(ARGS.testrun_delete))
-        return True
-    for testrun in results:
-        try:
-            LOG.info("Delete TestRun '{}'".format(testrun.testrun))
-            session.delete(testrun)
-        except Exception as err:
-            session.rollback()
-            LOG.info("{}".format(err))
-        else:
-            session.commit()
+    try:
+        case_count = testresult_bulk_insert(session, resultmode,
+                                            get_testresult, prefix,
+                                            ARGS.csv_file, ARGS.batch_size)
+    except Exception as err:
+        session.rollback()
+        LOG.info("{}".format(err))
+        return 1
+
+    if case_count is None:
+        session.rollback()
+        return 1
+
+    if case_count == 0:
+        session.rollback()
+        LOG.info("No row found, please check!")
+        sys.exit(1)
+
+    session.commit()
+    LOG.info("Line wrote: {}".format(case_count))
+
+
+def entries_delete(session, mode, **filters):
+    '''
+    Delete the matched entries with a single DELETE statement, return the
+    number of deleted rows. The caller commits or rolls back the session.
+    '''
+    return session.query(mode).filter_by(**filters).delete(
+        synchronize_session=False)
 
 
-def testresult_delete(resultmode=None):
+def testrun_delete(runmode=None, resultmode=None, summarymode=None):
+    '''
+    Delete the TestRun, its TestResults and summary in a single transaction,
+    return the number of deleted (TestRun, TestResult) rows.
+    '''
     if ARGS.testrun_delete is None:
         LOG.info("Please specify --delete option to delete a TestRun.")
         return False
-    case_count = 0
     testrun = ARGS.testrun_delete
     session = DB_SESSION()
-    results = session.query(resultmode).filter_by(testrun=testrun).all()
-    if len(results) == 0:
-        LOG.info("No related TestResult entries. Skip.".format(
-            ARGS.testrun_delete))
-        return True
-    for testresult in results:
-        try:
-            print('.', end='', flush=True)
-            #LOG.info("Delete TestResult: id-{} {}".format(testresult.id, testresult.testrun))
-            session.delete(testresult)
-            case_count += 1
-        except Exception as err:
-            session.rollback()
-            LOG.info("{}".format(err))
-        else:
-            session.commit()
-    print('Done')
-    LOG.info("Line delete: {}".format(case_count))
+    try:
+        run_count = entries_delete(session, runmode, testrun=testrun)
+        result_count = entries_delete(session, resultmode, testrun=testrun)
+        if summarymode is not None:
+            entries_delete(session, summarymode, testrun=testrun)
+    except Exception as err:
+        session.rollback()
+        LOG.info("{}".format(err))
+        return False
+    else:
+        session.commit()
 
+    if run_count == 0 and result_count == 0:
+        LOG.info("No related TestRun entries. Skip.")
+    else:
+        LOG.info("Delete TestRun '{}'".format(testrun))
+        LOG.info("Line delete: {}".format(result_count))
+    return run_count, result_count
 
-def benchmark_report_write():
+
+def get_testrun_id(csv_file):
+    '''
+    Get the TestRun ID from the first row of the CSV file.
+    '''
+    with open(csv_file, newline='') as csv_h:
+        for r in csv.DictReader(csv_h):
+            return r['Testrun']
+    return None
+
+
+def get_kpi_value(value):
+    '''
+    Convert the KPI value into float, return None if it is not a number.
+    '''
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
+
+
+def testrun_summary_write(session, summarymode, resultmode, testrun):
+    '''
+    Aggregate the TestResults of the TestRun into its summary (case count,
+    sample count, date range and the mean/min/max of each KPI). The former
+    summary is replaced, the caller commits or rolls back the session.
+    Return the summary, or None if the TestRun has no TestResult.
+    '''
+    entries_delete(session, summarymode, testrun=testrun)
+
+    columns = [resultmode.case_id, resultmode.date] + [
+        getattr(resultmode, kpi) for kpi in summarymode.kpis]
+    rows = session.query(*columns).filter(
+        resultmode.testrun == testrun).all()
+    if len(rows) == 0:
+        return None
+
+    summary = summarymode()
+    summary.testrun = testrun
+    summary.case_count = len(set(r[0] for r in rows))
+    summary.sample_count = len(rows)
+    dates = sorted(str(r[1]) for r in rows if r[1])
+    if dates:
+        summary.date_start = dates[0]
+        summary.date_end = dates[-1]
+    for index, kpi in enumerate(summarymode.kpis, start=2):
+        values = [get_kpi_value(r[index]) for r in rows]
+        values = [x for x in values if x is not None]
+        if values:
+            setattr(summary, kpi + '_mean', sum(values) / len(values))
+            setattr(summary, kpi + '_min', min(values))
+            setattr(summary, kpi + '_max', max(values))
+
+    session.add(summary)
+    return summary
+
+
+def testrun_summary_update(summarymode, resultmode):
+    '''
+    Update the summary of the TestRun loaded from ARGS.csv_file in a single
+    transaction.
+    '''
+    testrun = get_testrun_id(ARGS.csv_file)
+    session = DB_SESSION()
+    try:
+        testrun_summary_write(session, summarymode, resultmode, testrun)
+    except Exception as err:
+        session.rollback()
+        LOG.info("{}".format(err))
+        return 1
+    else:
+        session.commit()
+    LOG.info("Update summary of TestRun '{}'".format(testrun))
+
+
+def get_benchmark_report(json_file):
+    '''
+    Build the benchmark report entry from the JSON file.
+    '''
     tmp_data = {}
-    if not os.path.exists(ARGS.json_file):
-        LOG.info("{} not found".format(ARGS.json_file))
-        sys.exit(1)
-    with open(ARGS.json_file) as fh:
+    with open(json_file) as fh:
         tmp_data = json.load(fh)
 
     BS = BenchmarkReport()
@@ -485,6 +791,15 @@ def benchmark_report_write():
     BS.reportlink = tmp_data['report_url']
     BS.comments = tmp_data['comments']
     BS.benchmark_metadata = str(tmp_data['metadata'])
+    return BS
+
+
+def benchmark_report_write():
+    if not os.path.exists(ARGS.json_file):
+        LOG.info("{} not found".format(ARGS.json_file))
+        sys.exit(1)
+
+    BS = get_benchmark_report(ARGS.json_file)
 
     if not BS.report_id.startswith('benchmark_'):
         LOG.error('Benchmark Report id "{}" is invalid, start with "benchmark_" expected'.format(
@@ -508,35 +823,172 @@ def benchmark_report_write():
 
 
 def benchmark_delete(runmode=None):
+    '''
+    Delete the benchmark report, return the number of deleted rows.
+    '''
     if ARGS.testrun_delete is None:
         LOG.info("Please specify --delete option to delete a benchmark record.")
         return False
     report = ARGS.testrun_delete
     session = DB_SESSION()
-    results = session.query(runmode).filter_by(report_id=report).all()
-    if len(results) == 0:
+    try:
+        count = entries_delete(session, runmode, report_id=report)
+    except Exception as err:
+        session.rollback()
+        LOG.info("{}".format(err))
+        return False
+    else:
+        session.commit()
+
+    if count == 0:
         LOG.info("No related benchmark entries. Skip.")
-        return True
-    for report in results:
-        try:
-            LOG.info("Delete Report '{}'".format(report.report_id))
-            session.delete(report)
-        except Exception as err:
-            session.rollback()
-            LOG.info("{}".format(err))
-        else:
-            session.commit()
+    else:
+        LOG.info("Delete Report '{}'".format(report))
+    return count
+
+
+TESTRUN_MODES = {
+    'network': (NetworkRun, NetworkResult, NetworkSummary,
+                get_network_testresult, 'uperf_'),
+    'storage': (StorageTestRun, StorageTestResult, StorageSummary,
+                get_storage_testresult, 'fio_')
+}
+
+
+def testrun_replace(db_file, testrun_type, csv_file, batch_size=1000,
+                    is_wal=False, is_debug=False):
+    '''
+    Replace the TestRun, its TestResults and summary with the ones from the
+    CSV file in a single transaction, so that the dashboard never sees a
+    partially loaded TestRun.
+
+    Input:
+        db_file      - the database file
+        testrun_type - 'network' or 'storage'
+        csv_file     - the CSV file generated for the DB loader, or the
+                       DataFrame of it
+        batch_size   - the number of rows per insert
+        is_wal       - enable WAL journaling
+        is_debug     - enable sqlalchemy output
+    Return:
+        - the number of (deleted, inserted) TestResults, or
+        - False if something goes wrong.
+    '''
+    runmode, resultmode, summarymode, get_testresult, prefix = TESTRUN_MODES[
+        testrun_type]
+
+    testrun = get_testrun(runmode, csv_file)
+    if testrun is None:
+        LOG.info("No row found, please check!")
+        return False
+    if not testrun.testrun.startswith(prefix):
+        LOG.error('TestRun ID "{}" is invalid.'.format(testrun.testrun))
+        return False
+
+    session = get_db_session(db_file, is_debug, is_wal)()
+    try:
+        entries_delete(session, runmode, testrun=testrun.testrun)
+        del_count = entries_delete(session, resultmode,
+                                   testrun=testrun.testrun)
+        session.add(testrun)
+        case_count = testresult_bulk_insert(session, resultmode,
+                                            get_testresult, prefix,
+                                            csv_file, batch_size)
+        if case_count is not None:
+            testrun_summary_write(session, summarymode, resultmode,
+                                  testrun.testrun)
+    except Exception as err:
+        session.rollback()
+        LOG.info("{}".format(err))
+        return False
+
+    if case_count is None:
+        session.rollback()
+        return False
+
+    session.commit()
+    LOG.info("Replace TestRun '{}'".format(testrun.testrun))
+    LOG.info("Line delete: {}".format(del_count))
+    LOG.info("Line wrote: {}".format(case_count))
+    return del_count, case_count
+
+
+def benchmark_replace(db_file, json_file, is_wal=False, is_debug=False):
+    '''
+    Replace the benchmark record with the one from the JSON file in a single
+    transaction.
+
+    Input:
+        db_file   - the database file
+        json_file - the JSON file of the benchmark report
+        is_wal    - enable WAL journaling
+        is_debug  - enable sqlalchemy output
+    Return:
+        - the number of deleted benchmark records, or
+        - False if something goes wrong.
+    '''
+    if not os.path.exists(json_file):
+        LOG.info("{} not found".format(json_file))
+        return False
+
+    BS = get_benchmark_report(json_file)
+    if not BS.report_id.startswith('benchmark_'):
+        LOG.error('Benchmark Report id "{}" is invalid, start with "benchmark_" expected'.format(
+            BS.report_id))
+        return False
+
+    session = get_db_session(db_file, is_debug, is_wal)()
+    try:
+        count = entries_delete(session, BenchmarkReport,
+                               report_id=BS.report_id)
+        session.add(BS)
+    except Exception as err:
+        session.rollback()
+        LOG.info("{}".format(err))
+        return False
+    else:
+        session.commit()
+
+    LOG.info("Replace benchmark record: {}".format(BS.report_id))
+    return count
 
 
 if __name__ == "__main__":
+    ARGS = ARG_PARSER.parse_args()
+
+    if ARGS.batch_size < 1:
+        LOG.error("The batch size must be a positive integer.")
+        sys.exit(1)
+
+    if ARGS.is_replace:
+        if ARGS.csv_file is not None and not ARGS.is_benchmark:
+            LOG.info("Replace TestRun in database.")
+            res = testrun_replace(ARGS.db_file,
+                                  'network' if ARGS.is_network else 'storage',
+                                  ARGS.csv_file, ARGS.batch_size, ARGS.is_wal,
+                                  ARGS.is_debug)
+        elif ARGS.json_file is not None and ARGS.is_benchmark:
+            LOG.info("Replace benchmark report in database.")
+            res = benchmark_replace(ARGS.db_file, ARGS.json_file, ARGS.is_wal,
+                                    ARGS.is_debug)
+        else:
+            LOG.error("Please specify --csv_file (with --network or \
+--storage) or --json_file (with --benchmark) to replace.")
+            res = False
+        sys.exit(0 if res is not False else 1)
+
+    DB_SESSION = get_db_session(ARGS.db_file, ARGS.is_debug, ARGS.is_wal)
+
     if ARGS.csv_file is not None:
         LOG.info("Load TestRun into database.")
         if ARGS.is_network:
             network_testrun_write()
             network_testresult_write()
+            testrun_summary_update(NetworkSummary, NetworkResult)
         elif ARGS.is_storage:
             storage_testrun_write()
             storage_testresult_write()
+            testrun_summary_update(StorageSummary, StorageTestResult)
     if ARGS.json_file is not None:
         LOG.info("Load benchmark report into database.")
         if ARGS.is_benchmark:
@@ -544,10 +996,11 @@ if __name__ == "__main__":
     if ARGS.testrun_delete is not None:
         LOG.info("Delete '{}' from database.".format(ARGS.testrun_delete))
         if ARGS.is_network:
-            testrun_delete(runmode=NetworkRun)
-            testresult_delete(resultmode=NetworkResult)
+            testrun_delete(runmode=NetworkRun, resultmode=NetworkResult,
+                           summarymode=NetworkSummary)
         elif ARGS.is_storage:
-            testrun_delete(runmode=StorageTestRun)
-            testresult_delete(resultmode=StorageTestResult)
+            testrun_delete(runmode=StorageTestRun,
+                           resultmode=StorageTestResult,
+                           summarymode=StorageSummary)
         elif ARGS.is_benchmark:
             benchmark_delete(runmode=BenchmarkReport)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+'''
+Migrate the dashboard database to the schema defined in flask_load_db.py
+
+It adds the missing columns of the existing tables (and fills the derived
+ones, such as the platform family), creates the missing summary tables (and
+summarizes the TestRuns loaded before), creates the missing indexes (such as
+the composite indexes on the result tables) and refreshes the statistics for
+the query planner. The other tables are created by the dashboard server, and
+running the migration again is harmless.
+'''
+import sys
+import argparse
+import logging
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import sessionmaker
+
+import flask_load_db
+
+LOG = logging.getLogger(__name__)
+
+logging.basicConfig(level=logging.DEBUG, format='%(levelname)s: %(message)s')
+
+ARG_PARSER = argparse.ArgumentParser(
+    description="Migrate the dashboard database")
+ARG_PARSER.add_argument('--db_file',
+                        dest='db_file',
+                        action='store',
+                        help="specify database location",
+                        default=None,
+                        required=True)
+ARG_PARSER.add_argument('-d',
+                        dest='is_debug',
+                        action='store_true',
+                        help='enable sqlalchemy output for debug purpose',
+                        required=False)
+
+
+def platform_family_fill(conn, table):
+    '''
+    Fill the platform family of the rows loaded before it was introduced,
+    the same way as flask_load_db.get_platform_family does.
+    '''
+    sql = 'UPDATE {} SET platform_family = {} WHERE platform_family IS NULL'
+    for family in flask_load_db.PLATFORM_FAMILIES:
+        conn.execute(text(sql.format(table, ':family') +
+                          ' AND lower(platform) LIKE :pattern'),
+                     {'family': family, 'pattern': '%{}%'.format(family)})
+    conn.execute(text(sql.format(table, 'lower(platform)')))
+
+
+def testrun_summary_fill(engine, runmode, resultmode, summarymode):
+    '''
+    Summarize the TestRuns which have no summary, return the number of the
+    written summaries.
+    '''
+    session = sessionmaker(bind=engine)()
+    summarized = session.query(summarymode.testrun)
+    testruns = [x[0] for x in session.query(runmode.testrun).filter(
+        runmode.testrun.notin_(summarized)).distinct()]
+    try:
+        for testrun in testruns:
+            LOG.info("Summarize TestRun '{}'.".format(testrun))
+            flask_load_db.testrun_summary_write(session, summarymode,
+                                                resultmode, testrun)
+    except Exception:
+        session.rollback()
+        raise
+    else:
+        session.commit()
+    finally:
+        session.close()
+    return len(testruns)
+
+
+def db_migrate(db_file, is_debug=False):
+    '''
+    Add the missing columns, create the missing indexes and analyze the
+    database, return the names of the created indexes.
+    '''
+    engine = flask_load_db.get_db_engine(db_file, is_debug)
+    inspector = inspect(engine)
+    tables = inspector.get_table_names()
+
+    created = []
+    for runmode, resultmode, summarymode, _, _ in \
+            flask_load_db.TESTRUN_MODES.values():
+        if summarymode.__tablename__ in tables:
+            continue
+        LOG.info("Create table '{}'.".format(summarymode.__tablename__))
+        summarymode.__table__.create(engine)
+        tables.append(summarymode.__tablename__)
+        if runmode.__tablename__ in tables and \
+                resultmode.__tablename__ in tables:
+            testrun_summary_fill(engine, runmode, resultmode, summarymode)
+
+    for table in flask_load_db.DB_BASE.metadata.sorted_tables:
+        if table.name not in tables:
+            LOG.info("Table '{}' doesn't exist. Skip.".format(table.name))
+            continue
+
+        existing = [x['name'] for x in inspector.get_columns(table.name)]
+        with engine.begin() as conn:
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                LOG.info("Add column '{}' to '{}'.".format(
+                    column.name, table.name))
+                conn.execute(text('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                    table.name, column.name,
+                    column.type.compile(dialect=engine.dialect))))
+            if 'platform_family' in table.columns:
+                platform_family_fill(conn, table.name)
+
+        existing = [x['name'] for x in inspector.get_indexes(table.name)]
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            LOG.info("Create index '{}' on '{}'.".format(
+                index.name, table.name))
+            index.create(engine)
+            created.append(index.name)
+
+    # Refresh the statistics for the query planner
+    with engine.connect() as conn:
+        conn.execute(text('ANALYZE'))
+
+    LOG.info("Index created: {}".format(len(created)))
+    return created
+
+
+if __name__ == "__main__":
+    ARGS = ARG_PARSER.parse_args()
+    db_migrate(ARGS.db_file, ARGS.is_debug)
+    sys.exit(0)
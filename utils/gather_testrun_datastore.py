@@ -7,9 +7,19 @@ Currently supports:
 """
 
 import argparse
+import functools
 import logging
 import json
+import multiprocessing
 import os
+import shutil
+import tempfile
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
 LOG = logging.getLogger(__name__)
 logging.basicConfig(level=logging.DEBUG, format='%(levelname)s: %(message)s')
@@ -47,12 +57,536 @@ to reserve the first one if the case failed all the time, choose "permissive" \
 to disable this feature. Default is "restricted".',
                         default='restricted',
                         required=False)
+ARG_PARSER.add_argument('--streaming',
+                        dest='streaming',
+                        action='store_true',
+                        help='Parse the result.json files incrementally and \
+write the records to the output as they are produced, so that the memory \
+usage is bounded by the largest iteration instead of the whole testrun.',
+                        required=False)
+ARG_PARSER.add_argument('--jobs',
+                        dest='jobs',
+                        action='store',
+                        type=int,
+                        help='The number of processes to parse the subfolders \
+in parallel, the output is the same as the serial mode. Default is 1.',
+                        default=1,
+                        required=False)
+ARG_PARSER.add_argument('--output-format',
+                        dest='output_format',
+                        action='store',
+                        choices=('json', 'jsonl'),
+                        help='The output file format, "json" for a JSON array \
+and "jsonl" for JSON Lines. Default is "json".',
+                        default='json',
+                        required=False)
 ARG_PARSER.add_argument('--output',
                         dest='output',
                         action='store',
                         help='The name of the json output file.',
                         default='datastore.json',
                         required=False)
+ARG_PARSER.add_argument('--sidecar',
+                        dest='sidecar',
+                        action='store_true',
+                        help='Also write a columnar copy of the datastore \
+into a Parquet file named after the output file (such as "datastore.parquet"), \
+which will be read by generate_testrun_results.py instead of the json file. \
+This feature requires pyarrow.',
+                        required=False)
+
+
+def iter_json_array(filename, chunk_size=1024 * 1024):
+    """Parse a JSON array from file incrementally.
+
+    Input:
+        filename   - the JSON file which contains an array
+        chunk_size - the size of data to be read at a time
+    Yield:
+        The items of the array one by one.
+    """
+    decoder = json.JSONDecoder()
+
+    with open(filename, 'r') as f:
+        buffer = ''
+        pos = 0
+        eof = False
+        read_size = chunk_size
+
+        # the tokens expected next: "[" at the beginning, an item or "]"
+        # after "[", "," or "]" after an item, and an item after ","
+        state = 'begin'
+
+        while True:
+            # skip the whitespaces, read more data when running out
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos == len(buffer):
+                if eof:
+                    raise ValueError(
+                        'Unexpected end of JSON array in {}.'.format(filename))
+                buffer = f.read(read_size)
+                pos = 0
+                eof = not buffer
+                continue
+
+            token = buffer[pos]
+            if state == 'begin':
+                if token != '[':
+                    raise ValueError(
+                        'Expecting "[" in {}.'.format(filename))
+                pos += 1
+                state = 'first'
+                continue
+            if state in ('first', 'next') and token == ']':
+                return
+            if state == 'next':
+                if token != ',':
+                    raise ValueError(
+                        'Expecting "," or "]" in {}.'.format(filename))
+                pos += 1
+                state = 'item'
+                continue
+
+            # decode the next item, read more data if it may be incomplete,
+            # which means the delimiter following it is not in the buffer
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                end = None
+            if end is not None:
+                delimiter = end
+                while (delimiter < len(buffer)
+                       and buffer[delimiter].isspace()):
+                    delimiter += 1
+            if not eof and (end is None or delimiter == len(buffer)
+                            or buffer[delimiter] not in ',]'):
+                more = f.read(read_size)
+                eof = not more
+                buffer = buffer[pos:] + more
+                pos = 0
+                read_size *= 2
+                continue
+
+            yield item
+
+            # keep the buffer, it is trimmed only when reading more data
+            pos = end
+            read_size = chunk_size
+            state = 'next'
+
+
+def iter_subfolder_records(logdir, subfolder, streaming=False):
+    """Get the records of a subfolder with the additional information.
+
+    Input:
+        logdir    - the directory with collection of pbench-agent logs
+        subfolder - the subfolder to be collected
+        streaming - parse the result.json incrementally
+    Yield:
+        The records one by one.
+    """
+    try:
+        with open(os.path.join(logdir, subfolder, 'external_url.txt'),
+                  'r') as f:
+            external_url = f.readline().strip().rstrip('/')
+    except:
+        external_url = ''
+
+    result_file = os.path.join(logdir, subfolder, 'result.json')
+    if streaming:
+        data = iter_json_array(result_file)
+    else:
+        with open(result_file, 'r') as f:
+            data = json.load(f)
+
+    for idata in data:
+        idata['external_url'] = external_url
+        idata['path_lv_1'] = subfolder
+        idata['path_lv_2'] = idata['iteration_name_format'] % (
+            idata['iteration_number'], idata['iteration_name'])
+        yield idata
+
+
+def get_label(record):
+    """Get the label which identifies an iteration in the testrun.
+
+    Input:
+        record - the record of the iteration
+    Return:
+        A tuple of (external_url, path_lv_1, path_lv_2).
+    """
+    return (record.get('external_url'), record.get('path_lv_1'),
+            record.get('path_lv_2'))
+
+
+def get_drop_reason(record, drop_failures, labels):
+    """Check if the record should be dropped as a failure.
+
+    Input:
+        record        - the record to be checked
+        drop_failures - the mode of dropping failures
+        labels        - a set of the labels of the records, which is used
+                        to look up the passed counterparts in restricted mode
+    Return:
+        - None if the record should be reserved, or
+        - the reason why the record should be dropped.
+    """
+    external_url, path_lv_1, path_lv_2 = get_label(record)
+
+    if '-fail' not in path_lv_2:
+        return None
+
+    # drop any failed records in enforcing mode
+    if drop_failures == 'enforcing':
+        return 'failed'
+
+    # drop selected failed records in restricted mode
+    if drop_failures == 'restricted':
+        if not path_lv_2.endswith('-fail1'):
+            # drop the second and above failed records
+            return 'repeated'
+
+        # drop the first failed record only when passed one exists
+        passed_label = path_lv_2.replace('-fail1', '')
+        if (external_url, path_lv_1, passed_label) in labels:
+            return 'passed'
+
+    return None
+
+
+def drop_failed_records(records, drop_failures, labels, summary):
+    """Drop the failed records in a single pass.
+
+    Input:
+        records       - an iterable of the records
+        drop_failures - the mode of dropping failures
+        labels        - a set of the labels of the records
+        summary       - a dict counts the records by the drop reasons
+    Yield:
+        The reserved records one by one.
+    Updates:
+        summary       - the counts of this pass are added
+    """
+    # nothing is dropped in permissive mode
+    if drop_failures not in ('enforcing', 'restricted'):
+        yield from records
+        return
+
+    for record in records:
+        reason = get_drop_reason(record, drop_failures, labels)
+
+        if reason is None:
+            if '-fail' in record.get('path_lv_2'):
+                summary['reserved'] = summary.get('reserved', 0) + 1
+            yield record
+            continue
+
+        summary[reason] = summary.get(reason, 0) + 1
+        external_url, path_lv_1, path_lv_2 = get_label(record)
+        if external_url:
+            LOG.info('{}/{} has been droped.'.format(external_url, path_lv_2))
+        else:
+            LOG.info('{}/{} has been droped.'.format(path_lv_1, path_lv_2))
+
+
+def show_drop_summary(summary, drop_failures):
+    """Show the summary of the dropped failures.
+
+    Input:
+        summary       - a dict counts the records by the drop reasons
+        drop_failures - the mode of dropping failures, nothing is shown in
+                        permissive mode
+    """
+    if drop_failures not in ('enforcing', 'restricted'):
+        return
+
+    dropped = sum(summary.get(x, 0) for x in ('failed', 'repeated', 'passed'))
+    LOG.info('Dropped {} failed records ({} in enforcing mode, {} repeated '
+             'failures, {} with passed runs), reserved {} failed records.'
+             .format(dropped, summary.get('failed', 0),
+                     summary.get('repeated', 0), summary.get('passed', 0),
+                     summary.get('reserved', 0)))
+
+
+def serialize_record(record, output_format='json'):
+    """Serialize a record as an item of the output file.
+
+    Input:
+        record        - the record to be serialized
+        output_format - "json" for a JSON array, "jsonl" for JSON Lines
+    Return:
+        The text of the item, which is indented as the second level of
+        json.dump(records, f, indent=3) for the JSON array.
+    """
+    if output_format == 'jsonl':
+        return json.dumps(record)
+    else:
+        return json.dumps(record, indent=3).replace('\n', '\n   ')
+
+
+def get_separator(output_format, count):
+    """Get the text to be written before an item of the output file.
+
+    Input:
+        output_format - "json" for a JSON array, "jsonl" for JSON Lines
+        count         - the number of the items written before
+    Return:
+        The separator text.
+    """
+    if output_format == 'jsonl':
+        return '' if count == 0 else '\n'
+    else:
+        return '[\n   ' if count == 0 else ',\n   '
+
+
+def get_ending(output_format, count):
+    """Get the text to be written after all items of the output file.
+
+    Input:
+        output_format - "json" for a JSON array, "jsonl" for JSON Lines
+        count         - the number of the items written
+    Return:
+        The ending text.
+    """
+    if output_format == 'jsonl':
+        return '' if count == 0 else '\n'
+    else:
+        return '[]' if count == 0 else '\n]'
+
+
+def dump_records(records, f, output_format='json'):
+    """Dump the records to a file as they are produced.
+
+    The JSON array is formatted the same as json.dump(records, f, indent=3).
+
+    Input:
+        records       - an iterable of the records
+        f             - the file object to write
+        output_format - "json" for a JSON array, "jsonl" for JSON Lines
+    Return:
+        The number of the records written.
+    """
+    count = 0
+    for record in records:
+        f.write(get_separator(output_format, count))
+        f.write(serialize_record(record, output_format))
+        count += 1
+    f.write(get_ending(output_format, count))
+
+    return count
+
+
+def iter_datastore_file(filename, output_format='json'):
+    """Read the records from a datastore file incrementally.
+
+    Input:
+        filename      - the datastore file
+        output_format - "json" for a JSON array, "jsonl" for JSON Lines
+    Yield:
+        The records one by one.
+    """
+    if output_format == 'jsonl':
+        with open(filename, 'r') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        yield from iter_json_array(filename)
+
+
+def merge_value_type(vtype, value):
+    """Merge the type of a json value into the type inferred so far.
+
+    The type is None (unknown, for nulls), "bool", "int", "float", "str",
+    ("list", item_type) or ("struct", {name: field_type}). The fields of a
+    struct keep the order they appear, so the objects can be restored with
+    the same order of keys.
+
+    Input:
+        vtype - the type inferred so far
+        value - the json value
+    Return:
+        The merged type.
+    Raises:
+        ValueError if the value doesn't fit the type.
+    """
+    if value is None:
+        return vtype
+
+    if isinstance(value, bool):
+        ntype = 'bool'
+    elif isinstance(value, int):
+        ntype = 'int'
+    elif isinstance(value, float):
+        ntype = 'float'
+    elif isinstance(value, str):
+        ntype = 'str'
+    elif isinstance(value, list):
+        item_type = vtype[1] if isinstance(vtype, tuple) and \
+            vtype[0] == 'list' else None
+        for item in value:
+            item_type = merge_value_type(item_type, item)
+        ntype = ('list', item_type)
+    elif isinstance(value, dict):
+        fields = vtype[1] if isinstance(vtype, tuple) and \
+            vtype[0] == 'struct' else {}
+        names = list(fields)
+        last = -1
+        for name, item in value.items():
+            if name not in fields:
+                names.append(name)
+                fields[name] = None
+            position = names.index(name)
+            if position < last:
+                raise ValueError('Inconsistent order of keys: {}'.format(
+                    list(value)))
+            last = position
+            fields[name] = merge_value_type(fields[name], item)
+        ntype = ('struct', fields)
+    else:
+        raise ValueError('Unsupported value: {}'.format(value))
+
+    # The types may contain dicts (the fields of structs), so that they are
+    # compared without hashing
+    if vtype is None or vtype == ntype:
+        return ntype
+    if vtype in ('int', 'float') and ntype in ('int', 'float'):
+        return 'float'
+    if isinstance(vtype, tuple) and isinstance(ntype, tuple) and \
+            vtype[0] == ntype[0]:
+        # The items of the list (or the fields of the struct) have been
+        # merged into the new type, an empty list fits any list
+        if ntype[0] == 'list' and ntype[1] is None:
+            return vtype
+        return ntype
+
+    raise ValueError('Inconsistent types: {} and {}'.format(vtype, ntype))
+
+
+def get_arrow_type(vtype):
+    """Get the pyarrow type of an inferred type (see merge_value_type)."""
+    if vtype is None:
+        return pyarrow.null()
+    if isinstance(vtype, tuple):
+        if vtype[0] == 'list':
+            return pyarrow.list_(get_arrow_type(vtype[1]))
+        return pyarrow.struct([(k, get_arrow_type(v))
+                               for k, v in vtype[1].items()])
+    return {'bool': pyarrow.bool_(), 'int': pyarrow.int64(),
+            'float': pyarrow.float64(), 'str': pyarrow.string()}[vtype]
+
+
+def write_sidecar(get_records, filename, batch_size=256):
+    """Write the records into a columnar sidecar file (Parquet).
+
+    The schema is inferred from all the records at first, then the records
+    are written batch by batch. The sidecar is abandoned if the records
+    can't be presented in columns, and the consumers will fall back to the
+    json file.
+
+    Input:
+        get_records - a function which returns an iterable of the records,
+                      it will be called twice
+        filename    - the Parquet file to write
+        batch_size  - the number of records in each row group
+    Return:
+        - True if the sidecar is written, or
+        - False if the sidecar is abandoned.
+    """
+    if os.path.exists(filename):
+        os.unlink(filename)
+
+    if pyarrow is None:
+        LOG.warning('Module pyarrow is not installed, skip the sidecar.')
+        return False
+
+    def _iter_batches():
+        batch = []
+        for record in get_records():
+            batch.append(record)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    writer = None
+    try:
+        vtype = None
+        for record in get_records():
+            vtype = merge_value_type(vtype, record)
+        if vtype is None:
+            LOG.warning('No record in the datastore, skip the sidecar.')
+            return False
+
+        schema = pyarrow.schema(get_arrow_type(vtype))
+        writer = pyarrow.parquet.ParquetWriter(filename, schema)
+        for batch in _iter_batches():
+            writer.write_table(
+                pyarrow.Table.from_pylist(batch, schema=schema))
+    except Exception as e:
+        LOG.warning('Failed to present the datastore in columns, skip the '
+                    'sidecar: {}'.format(e))
+        if writer is not None:
+            writer.close()
+            os.unlink(filename)
+        return False
+
+    writer.close()
+    LOG.info('The sidecar has been written to "{}".'.format(filename))
+
+    return True
+
+
+def collect_subfolder(subfolder, logdir, drop_failures, streaming,
+                      output_format, tmpdir):
+    """Collect the records of a subfolder into a fragment file.
+
+    This function runs in the worker processes of the parallel mode. The
+    passed counterparts of the failures can only be in the same subfolder,
+    so the failures can be dropped here as well.
+
+    Input:
+        subfolder     - the subfolder to be collected
+        logdir        - the directory with collection of pbench-agent logs
+        drop_failures - the mode of dropping failures
+        streaming     - parse the result.json incrementally
+        output_format - "json" for a JSON array, "jsonl" for JSON Lines
+        tmpdir        - the directory to place the fragment file
+    Return:
+        A tuple of (fragment, count, summary), where the fragment is the
+        file with the serialized records joined by the separators.
+    """
+    LOG.info('Collecting data from "{}".'.format(subfolder))
+
+    records = iter_subfolder_records(logdir, subfolder, streaming)
+
+    labels = set()
+    if drop_failures == 'restricted':
+        if streaming:
+            labels = {get_label(x) for x in
+                      iter_subfolder_records(logdir, subfolder, True)}
+        else:
+            records = list(records)
+            labels = {get_label(x) for x in records}
+
+    summary = {}
+    count = 0
+
+    fd, fragment = tempfile.mkstemp(dir=tmpdir, suffix='.fragment')
+    with os.fdopen(fd, 'w') as f:
+        for record in drop_failed_records(records, drop_failures, labels,
+                                          summary):
+            if count:
+                f.write(get_separator(output_format, count))
+            f.write(serialize_record(record, output_format))
+            count += 1
+
+    return fragment, count, summary
+
 
 if __name__ == '__main__':
 
@@ -62,82 +596,114 @@ if __name__ == '__main__':
     # testrun = ARGS.testrun or os.path.basename(os.path.abspath(logdir))
     prefix = ARGS.prefix if ARGS.prefix else ('fio_', 'uperf_')
     drop_failures = ARGS.drop_failures
+    streaming = ARGS.streaming
+    jobs = ARGS.jobs
+    output_format = ARGS.output_format
     output = ARGS.output
+    sidecar = os.path.splitext(output)[0] + '.parquet'
 
-    # Gather data for the datastore
-    LOG.info('Gathering datastore.')
-    datastore = []
+    if jobs < 1:
+        LOG.error('The number of jobs should be a positive integer.')
+        exit(1)
 
+    subfolders = []
     for d in os.listdir(logdir):
         dname = os.path.join(logdir, d)
         if os.path.isdir(dname) and d.startswith(prefix):
+            subfolders.append(d)
+
+    if jobs > 1:
+        # Gather data in parallel and merge the fragments in order
+        LOG.info('Gathering datastore with {} processes.'.format(jobs))
+        if drop_failures in ('enforcing', 'restricted'):
+            LOG.info('Analyzing and dropping failures.')
+
+        summary = {}
+        total = 0
+
+        with tempfile.TemporaryDirectory(
+                dir=os.path.dirname(os.path.abspath(output))) as tmpdir:
+            worker = functools.partial(
+                collect_subfolder, logdir=logdir, drop_failures=drop_failures,
+                streaming=streaming, output_format=output_format,
+                tmpdir=tmpdir)
+
+            with multiprocessing.Pool(jobs) as pool, open(output, 'w') as f:
+                for fragment, count, part in pool.imap(worker, subfolders):
+                    if count:
+                        f.write(get_separator(output_format, total))
+                        with open(fragment, 'r') as ff:
+                            shutil.copyfileobj(ff, f)
+                        total += count
+                    os.unlink(fragment)
+
+                    for k, v in part.items():
+                        summary[k] = summary.get(k, 0) + v
+
+                f.write(get_ending(output_format, total))
+
+        show_drop_summary(summary, drop_failures)
+
+    elif streaming:
+        # Gather data and dump the datastore subfolder by subfolder
+        LOG.info('Gathering datastore in streaming mode.')
+        if drop_failures in ('enforcing', 'restricted'):
+            LOG.info('Analyzing and dropping failures.')
+
+        summary = {}
+
+        def _iter_datastore():
+            for d in subfolders:
+                LOG.info('Collecting data from "{}".'.format(d))
+                records = iter_subfolder_records(logdir, d, True)
+
+                # the passed counterparts can only be in the same subfolder
+                labels = set()
+                if drop_failures == 'restricted':
+                    labels = {get_label(x) for x in
+                              iter_subfolder_records(logdir, d, True)}
+
+                yield from drop_failed_records(
+                    records, drop_failures, labels, summary)
+
+        with open(output, 'w') as f:
+            dump_records(_iter_datastore(), f, output_format)
+
+        show_drop_summary(summary, drop_failures)
+
+    else:
+        # Gather data for the datastore
+        LOG.info('Gathering datastore.')
+        datastore = []
+
+        for d in subfolders:
             LOG.info('Collecting data from "{}".'.format(d))
-            with open(os.path.join(logdir, d, 'result.json'), 'r') as f:
-                data = json.load(f)
+            datastore += list(iter_subfolder_records(logdir, d))
 
-            try:
-                with open(os.path.join(
-                        logdir, d, 'external_url.txt'), 'r') as f:
-                    external_url = f.readline().strip().rstrip('/')
-            except:
-                external_url = ''
-
-            for idata in data:
-                idata['external_url'] = external_url
-                idata['path_lv_1'] = d
-                idata['path_lv_2'] = idata['iteration_name_format'] % (
-                    idata['iteration_number'], idata['iteration_name'])
-
-            datastore += data
-
-    # Drop failures
-    if drop_failures in ('enforcing', 'restricted'):
-        LOG.info('Analyzing and dropping failures.')
-        records = datastore.copy()
-        datastore.clear()
-
-        for record in records:
-            drop_this_record = False
-
-            external_url = record.get('external_url')
-            path_lv_1 = record.get('path_lv_1')
-            path_lv_2 = record.get('path_lv_2')
-
-            # drop any failed records in enforcing mode
-            if drop_failures == 'enforcing' and '-fail' in path_lv_2:
-                drop_this_record = True
-
-            # drop selected failed records in restricted mode
-            if drop_failures == 'restricted' and '-fail' in path_lv_2:
-                if not path_lv_2.endswith('-fail1'):
-                    # drop the second and above failed records
-                    drop_this_record = True
-                else:
-                    # drop the first failed record only when passed one exists
-                    passed_label = path_lv_2.replace('-fail1', '')
-                    for x in records:
-                        if (
-                            x.get('path_lv_2') == passed_label
-                            and x.get('path_lv_1') == path_lv_1
-                            and x.get('external_url') == external_url
-                        ):
-                            # found the passed record
-                            drop_this_record = True
-                            break
-
-            # drop or save this record
-            if drop_this_record:
-                if external_url:
-                    LOG.info('{}/{} has been droped.'.format(
-                        external_url, path_lv_2))
-                else:
-                    LOG.info('{}/{} has been droped.'.format(
-                        path_lv_1, path_lv_2))
-            else:
-                datastore.append(record)
-
-    # Dump the datastore to a json file
-    with open(output, 'w') as f:
-        json.dump(datastore, f, indent=3)
+        # Drop failures
+        if drop_failures in ('enforcing', 'restricted'):
+            LOG.info('Analyzing and dropping failures.')
+
+        summary = {}
+        labels = set()
+        if drop_failures == 'restricted':
+            labels = {get_label(x) for x in datastore}
+
+        datastore = list(drop_failed_records(
+            datastore, drop_failures, labels, summary))
+        show_drop_summary(summary, drop_failures)
+
+        # Dump the datastore to a file
+        with open(output, 'w') as f:
+            dump_records(datastore, f, output_format)
+
+    # Write the sidecar, the datastore is read back from the output file
+    # unless it has been loaded into the memory
+    if ARGS.sidecar:
+        if jobs > 1 or streaming:
+            write_sidecar(lambda: iter_datastore_file(output, output_format),
+                          sidecar)
+        else:
+            write_sidecar(lambda: datastore, sidecar)
 
     exit(0)
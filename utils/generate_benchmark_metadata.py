@@ -45,8 +45,6 @@ ARG_PARSER.add_argument('--output',
                         default='benchmark_metadata.csv',
                         required=False)
 
-ARGS = ARG_PARSER.parse_args()
-
 
 class MetadataComparisonGenerator():
     """Generate TestRun Results according to the customized configuration."""
@@ -179,7 +177,8 @@ class MetadataComparisonGenerator():
 
 
 if __name__ == '__main__':
+    ARGS = ARG_PARSER.parse_args()
     gen = MetadataComparisonGenerator(ARGS)
     gen.dump_to_file()
 
-exit(0)
+    exit(0)
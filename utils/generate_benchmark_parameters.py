@@ -34,8 +34,6 @@ ARG_PARSER.add_argument('--output',
                         default=None,
                         required=False)
 
-ARGS = ARG_PARSER.parse_args()
-
 
 class BenchmarkParametersGenerator():
     """Generate user parameter report for the benchmark results.."""
@@ -135,8 +133,9 @@ class BenchmarkParametersGenerator():
 
 
 if __name__ == '__main__':
+    ARGS = ARG_PARSER.parse_args()
     gen = BenchmarkParametersGenerator(ARGS)
     # gen.show_vars()
     gen.dump_to_file()
 
-exit(0)
+    exit(0)
@@ -9,8 +9,7 @@ import yaml
 import os
 import pandas as pd
 import numpy as np
-from scipy.stats import ttest_rel
-from scipy.stats import ttest_ind
+from scipy.special import stdtr
 
 LOG = logging.getLogger(__name__)
 logging.basicConfig(level=logging.DEBUG, format='%(levelname)s:%(message)s')
@@ -49,8 +48,6 @@ ARG_PARSER.add_argument('--output',
                         default=None,
                         required=False)
 
-ARGS = ARG_PARSER.parse_args()
-
 
 class BenchmarkResultsGenerator():
     """Generate benchmark results report."""
@@ -97,10 +94,14 @@ class BenchmarkResultsGenerator():
             if 'regression_threshold' not in item:
                 item['regression_threshold'] = kpi_defaults.get(
                     'regression_threshold', 0.10)
+            if 'equal_var' not in item:
+                item['equal_var'] = kpi_defaults.get('equal_var', True)
 
-    # load testrun results for test and base samples
-        self.df_test = pd.read_csv(ARGS.test, index_col=0)
-        self.df_base = pd.read_csv(ARGS.base, index_col=0)
+    # load testrun results for test and base samples (CSV files or dataframes)
+        self.df_test = ARGS.test if isinstance(
+            ARGS.test, pd.DataFrame) else pd.read_csv(ARGS.test, index_col=0)
+        self.df_base = ARGS.base if isinstance(
+            ARGS.base, pd.DataFrame) else pd.read_csv(ARGS.base, index_col=0)
 
         # parse parameters
         self.output = ARGS.output
@@ -206,9 +207,90 @@ class BenchmarkResultsGenerator():
             'Dramatic Improvement': 'DI',
             'Dramatic Regression': 'DR'
         }
+        de_abbrs = {v: k for k, v in abbrs.items()}
+
+        def _get_grouped_statistics(df, keys_from, kpis_from):
+            """Calculate basic statistics for all KPIs in one groupby pass.
 
-        def _get_statistics(df_base, df_test, kpi_cfg):
-            """Calculate basic statistics for the specified KPI.
+            The samples are sorted by their groups and the statistics of
+            each group are reduced from a contiguous block, so the results
+            are exactly the same as Series.mean() and Series.std(ddof=1)
+            on the filtered samples.
+
+            Returns:
+                A dataframe with one row for each combination of the KEYs,
+                it contains the KEY columns and the following columns for
+                each KPI:
+                1. "<kpi>|mean": mean of the samples
+                2. "<kpi>|var": variance of the samples
+                3. "<kpi>|std": stddev of the samples
+                4. "<kpi>|nobs": number of the samples
+                5. "<kpi>|isnan": whether any sample is a non-value
+            """
+            # samples with non-value KEYs never match any report row
+            df = df.dropna(subset=keys_from)
+            grouped = df.groupby(keys_from)
+
+            df_stats = grouped.size().reset_index(name='|nobs')
+            nobs = df_stats.pop('|nobs').to_numpy()
+            bounds = np.cumsum(nobs)
+            starts = bounds - nobs
+
+            # put the samples of each group into a contiguous block
+            order = np.argsort(grouped.ngroup().to_numpy(), kind='stable')
+            samples = df[kpis_from].to_numpy(dtype=float)[order]
+            isnan = np.isnan(samples)
+            values = np.asfortranarray(np.where(isnan, 0, samples))
+
+            def _sum_by_group(values):
+                sums = np.zeros((len(nobs), len(kpis_from)))
+                for index, (start, stop) in enumerate(zip(starts, bounds)):
+                    sums[index] = values[start:stop].sum(axis=0)
+                return sums
+
+            count = _sum_by_group(np.asfortranarray(~isnan))
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                mean = _sum_by_group(values) / count
+                sqr = (np.repeat(mean, nobs, axis=0) - values)**2
+                sqr = np.asfortranarray(np.where(isnan, 0, sqr))
+                var = np.where(count > 1,
+                               _sum_by_group(sqr) / (count - 1), np.nan)
+                std = np.sqrt(var)
+
+            for index, kpi_from in enumerate(kpis_from):
+                df_stats[kpi_from + '|mean'] = mean[:, index]
+                df_stats[kpi_from + '|var'] = var[:, index]
+                df_stats[kpi_from + '|std'] = std[:, index]
+                df_stats[kpi_from + '|nobs'] = nobs
+                df_stats[kpi_from + '|isnan'] = count[:, index] < nobs
+
+            return df_stats
+
+        def _get_stacked_statistics(df_stats, kpis_cfg):
+            """Stack the grouped statistics of all KPIs.
+
+            Returns:
+                A dictionary of the statistics, each of them is an array
+                with one row for each case and one column for each KPI.
+            """
+            stacked = {}
+            for name in ('mean', 'var', 'std', 'nobs', 'isnan'):
+                columns = ['{0}|{1}'.format(x['from'], name) for x in kpis_cfg]
+                stacked[name] = df_stats[columns].to_numpy(dtype=float)
+
+            # cases not found in the samples
+            stacked['nobs'] = np.nan_to_num(stacked['nobs'], nan=0)
+            stacked['isnan'] = stacked['isnan'] == 1
+
+            return stacked
+
+        def _get_statistics(base, test):
+            """Calculate basic statistics for all KPIs at once.
+
+            Input:
+                - base: stacked statistics of the base samples.
+                - test: stacked statistics of the test samples.
 
             Returns:
             1. mean of the base samples
@@ -217,49 +299,74 @@ class BenchmarkResultsGenerator():
             4. %stddev of the test samples
             5. %diff of the test mean over base mean
             """
-            kpi_from = kpi_cfg['from']
+            base_mean = base['mean']
+            test_mean = test['mean']
 
-            # calculate the "mean" and "%stddev"
-            base_mean = df_base[kpi_from].mean()
-            base_pctsd = df_base[kpi_from].std(
-                ddof=1) / base_mean * 100 if base_mean != 0 else np.nan
-            test_mean = df_test[kpi_from].mean()
-            test_pctsd = df_test[kpi_from].std(
-                ddof=1) / test_mean * 100 if test_mean != 0 else np.nan
+            with np.errstate(divide='ignore', invalid='ignore'):
+                # calculate the "%stddev"
+                base_pctsd = np.where(base_mean != 0,
+                                      base['std'] / base_mean * 100, np.nan)
+                test_pctsd = np.where(test_mean != 0,
+                                      test['std'] / test_mean * 100, np.nan)
 
-            # calculate the "%diff"
-            pctdiff = (test_mean - base_mean
-                       ) / base_mean * 100 if base_mean != 0 else np.nan
+                # calculate the "%diff"
+                pctdiff = np.where(base_mean != 0,
+                                   (test_mean - base_mean) / base_mean * 100,
+                                   np.nan)
 
             return (base_mean, base_pctsd, test_mean, test_pctsd, pctdiff)
 
-        def _get_significance(df_base, df_test, kpi_cfg, paired=False):
-            """Get the t-test significance for the specified KPI.
+        def _get_significance(base, test, kpis_cfg):
+            """Get the t-test significance for all KPIs at once.
+
+            The t-statistics are calculated from the stacked means,
+            variances and numbers of the samples. The Student's t-test is
+            performed by default, and the Welch's t-test is performed for
+            the KPIs with "equal_var" disabled.
 
             Returns:
                 The Significance which value between 0 and 1. When the
-                calculation fails, it will return 'nan' instead.
+                calculation fails, it will be 'nan' instead.
             """
-            kpi_from = kpi_cfg['from']
-            array1 = df_base[kpi_from]
-            array2 = df_test[kpi_from]
-
-            if paired:
-                (statistic, pvalue) = ttest_rel(array1, array2)
-            else:
-                (statistic, pvalue) = ttest_ind(array1, array2)
+            equal_var = np.array([x['equal_var'] for x in kpis_cfg],
+                                 dtype=bool)
+
+            (mean1, var1, nobs1) = (base['mean'], base['var'], base['nobs'])
+            (mean2, var2, nobs2) = (test['mean'], test['var'], test['nobs'])
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                # the Student's t-test with the pooled variance, a single
+                # sample contributes nothing to the pooled variance
+                pooled_df = nobs1 + nobs2 - 2
+                pooled_var = ((nobs1 - 1) * np.where(nobs1 == 1, 0, var1) +
+                              (nobs2 - 1) * np.where(nobs2 == 1, 0, var2)
+                              ) / pooled_df
+                pooled_denom = np.sqrt(pooled_var * (1 / nobs1 + 1 / nobs2))
+
+                # the Welch's t-test with the unequal variances
+                vn1 = var1 / nobs1
+                vn2 = var2 / nobs2
+                welch_df = (vn1 + vn2)**2 / (vn1**2 / (nobs1 - 1) +
+                                             vn2**2 / (nobs2 - 1))
+                welch_df = np.where(np.isnan(welch_df), 1, welch_df)
+                welch_denom = np.sqrt(vn1 + vn2)
+
+                df = np.where(equal_var, pooled_df, welch_df)
+                denom = np.where(equal_var, pooled_denom, welch_denom)
+
+                statistic = (mean1 - mean2) / denom
+                pvalue = 2 * stdtr(df, -np.abs(statistic))
+
+            # non-values in samples always make the t-test fail
+            pvalue = np.where(base['isnan'] | test['isnan'], np.nan, pvalue)
 
             significance = 1 - pvalue
 
             return significance
 
-        def _get_conclusion(base_pctsd,
-                            test_pctsd,
-                            pctdiff,
-                            significance,
-                            kpi_cfg,
-                            use_abbr=False):
-            """Get the conclusion of the specified KPI.
+        def _get_conclusion(base_pctsd, test_pctsd, pctdiff, significance,
+                            kpis_cfg):
+            """Get the conclusion of all KPIs at once.
 
             An algorithm helps reaching a preliminary conclusion for each KPI.
             ID - Invalid Data           Any of the input data is invalid.
@@ -274,79 +381,70 @@ class BenchmarkResultsGenerator():
             DR - Dramatic Regression    Same as above, but in the negative
                                         direction.
 
-            Returns: any of the conclusion mentioned above or "np.nan".
+            The thresholds of each KPI are applied to its column, and the
+            checks are applied in the order above.
+
+            Returns: the codes (abbreviations) of the conclusions mentioned
+            above or "np.nan".
             """
 
-            higher_is_better = kpi_cfg['higher_is_better']
-            MAX_PCTDEV_THRESHOLD = kpi_cfg['max_pctdev_threshold'] * 100
-            NEGLIGIBLE_THRESHOLD = kpi_cfg['negligible_threshold'] * 100
-            REGRESSION_THRESHOLD = kpi_cfg['regression_threshold'] * 100
-            CONFIDENCE_THRESHOLD = kpi_cfg['confidence_threshold']
+            def _get_threshold(name):
+                return np.array([x[name] for x in kpis_cfg], dtype=float)
+
+            higher_is_better = np.array(
+                [x['higher_is_better'] for x in kpis_cfg], dtype=bool)
+            MAX_PCTDEV_THRESHOLD = _get_threshold('max_pctdev_threshold') * 100
+            NEGLIGIBLE_THRESHOLD = _get_threshold('negligible_threshold') * 100
+            REGRESSION_THRESHOLD = _get_threshold('regression_threshold') * 100
+            CONFIDENCE_THRESHOLD = _get_threshold('confidence_threshold')
 
             # data check
-            if MAX_PCTDEV_THRESHOLD < 0:
+            if (MAX_PCTDEV_THRESHOLD < 0).any():
                 raise ValueError('Invalid value: max_pctdev_threshold')
-            if CONFIDENCE_THRESHOLD < 0 or CONFIDENCE_THRESHOLD > 1:
+            if ((CONFIDENCE_THRESHOLD < 0) | (CONFIDENCE_THRESHOLD > 1)).any():
                 raise ValueError('Invalid value: confidence_threshold')
-            if NEGLIGIBLE_THRESHOLD < 0:
+            if (NEGLIGIBLE_THRESHOLD < 0).any():
                 raise ValueError('Invalid value: negligible_threshold')
-            if REGRESSION_THRESHOLD < 0:
+            if (REGRESSION_THRESHOLD < 0).any():
                 raise ValueError('Invalid value: regression_threshold')
 
-            # get conclusion
-            conclusion = None
+            # the larger %SD, a 'nan' in BASE hides the one in TEST
+            max_pctsd = np.where(test_pctsd > base_pctsd, test_pctsd,
+                                 base_pctsd)
+            abs_pctdiff = np.abs(pctdiff)
+
+            # masks in the prioritized order
+            invalid_data = (np.isnan(significance) | (significance < 0) |
+                            (significance > 1) | (base_pctsd < 0) |
+                            (test_pctsd < 0))
+            high_variance = ((MAX_PCTDEV_THRESHOLD != 0) &
+                             (max_pctsd > MAX_PCTDEV_THRESHOLD))
+            no_significance = significance < CONFIDENCE_THRESHOLD
+            negligible_changes = abs_pctdiff <= NEGLIGIBLE_THRESHOLD
+            moderate = abs_pctdiff <= REGRESSION_THRESHOLD
+            improvement = np.where(higher_is_better, pctdiff > 0, pctdiff < 0)
+
+            codes = np.select([
+                invalid_data, high_variance, no_significance,
+                negligible_changes, moderate & improvement, moderate,
+                improvement
+            ], ['ID', 'HV', 'NS', 'NC', 'MI', 'MR', 'DI'],
+                default='DR').astype(object)
 
             # check for 'not available'
-            if np.isnan(pctdiff):
-                conclusion = np.nan
-
-            # check for 'Invalid Data'
-            if not conclusion:
-                if np.isnan(significance):
-                    conclusion = 'Invalid Data'
-                elif significance < 0 or significance > 1:
-                    conclusion = 'Invalid Data'
-                elif base_pctsd < 0 or test_pctsd < 0:
-                    conclusion = 'Invalid Data'
-
-            # check for 'High Variance'
-            if not conclusion and MAX_PCTDEV_THRESHOLD != 0:
-                if max(base_pctsd, test_pctsd) > MAX_PCTDEV_THRESHOLD:
-                    conclusion = 'High Variance'
-
-            # check for 'No Significance'
-            if not conclusion and significance < CONFIDENCE_THRESHOLD:
-                conclusion = 'No Significance'
-
-            # check for 'Negligible Changes'
-            if not conclusion and abs(pctdiff) <= NEGLIGIBLE_THRESHOLD:
-                conclusion = 'Negligible Changes'
-
-            # check for 'Improvment' and 'Regression'
-            if not conclusion:
-                if abs(pctdiff) <= REGRESSION_THRESHOLD:
-                    conclusion = 'Moderate '
-                else:
-                    conclusion = 'Dramatic '
-
-                if (higher_is_better and pctdiff > 0) or (not higher_is_better
-                                                          and pctdiff < 0):
-                    conclusion += 'Improvement'
-                else:
-                    conclusion += 'Regression'
-
-            # return conclusion or its abbreviation if asked
-            return conclusion if not use_abbr else abbrs.get(
-                conclusion, conclusion)
-
-        def _get_case_conclusion(row, use_abbr=False):
+            codes[np.isnan(pctdiff)] = np.nan
+
+            return codes
+
+        def _get_case_conclusion(codes):
             """Get the case result by anaylse each kpi's conclusion.
 
             Input:
-                - row: the case data with conclusions in dictionary
+                - codes: the codes of the KPI conclusions, one row for each
+                  case.
 
             Returns:
-                - conclusion: the conclusion of this case
+                - conclusions: the conclusions of the cases
             """
             prioritized_conclusions = [
                 'Dramatic Regression',
@@ -359,69 +457,85 @@ class BenchmarkResultsGenerator():
                 'No Significance'
             ]
 
-            conclusion = None
-
-            # collect conclusion for kpis
-            kpi_conclusions = [row[x]
-                               for x in row.keys() if x.endswith('-CON')]
-            for c in prioritized_conclusions:
-                if c in kpi_conclusions or abbrs[c] in kpi_conclusions:
-                    conclusion = c
-                    break
-
-            # return conclusion or its abbreviation if asked
-            return conclusion if not use_abbr else abbrs.get(
-                conclusion, conclusion)
-
-        # walk each row of the report dataframe, get related data from the
-        # test and base dataframes, calculate the KPIs and fill the results
-        # back to the report dataframe.
-        for (index, row) in self.df_report.iterrows():
-            # spotlight to the related data in test and base dataframes
-            df_test = self.df_test
-            df_base = self.df_base
-
-            for key_cfg in self.keys_cfg:
-                # filter by each KEY
-                key_name = key_cfg['name']
-                key_from = key_cfg['from']
-                df_test = df_test[df_test[key_from] == row[key_name]]
-                df_base = df_base[df_base[key_from] == row[key_name]]
-
-            for kpi_cfg in self.kpis_cfg:
-                # calculate each KPI
-                kpi_name = kpi_cfg['name']
-
-                # calculate the "mean", "%SD" and "%DF"
-                (base_mean, base_pctsd, test_mean, test_pctsd,
-                 pctdiff) = _get_statistics(df_base, df_test, kpi_cfg)
-
-                # calculate the significance
-                significance = _get_significance(df_base, df_test, kpi_cfg)
-
-                # calculate the conclusion
-                use_abbr = self.config.get('defaults',
-                                           {}).get('use_abbr', False)
-                conclusion = _get_conclusion(base_pctsd, test_pctsd, pctdiff,
-                                             significance, kpi_cfg, use_abbr)
-
-                # update the current KPI
-                row[kpi_name + '-BASE-AVG'] = base_mean
-                row[kpi_name + '-BASE-%SD'] = base_pctsd
-                row[kpi_name + '-TEST-AVG'] = test_mean
-                row[kpi_name + '-TEST-%SD'] = test_pctsd
-                row[kpi_name + '-%DF'] = pctdiff
-                row[kpi_name + '-SGN'] = significance
-                row[kpi_name + '-CON'] = conclusion
-
-            # get case conclusion if asked
-            if self.config.get('functions', {}).get('case_conclusion', True):
-                use_abbr = self.config.get('functions', {}).get(
-                    'case_conclusion_abbr', False)
-                row['Conclusion'] = _get_case_conclusion(row, use_abbr)
-
-            # write the row back
-            self.df_report.iloc[index] = row
+            conclusions = np.full(len(codes), None, dtype=object)
+
+            # the conclusion with higher priority overwrites the lower ones
+            for c in reversed(prioritized_conclusions):
+                conclusions[(codes == abbrs[c]).any(axis=1)] = c
+
+            return conclusions
+
+        # calculate the statistics of test and base dataframes for all the
+        # KEYs in one pass, align them with the rows of the report dataframe,
+        # calculate all the KPIs at once and fill the results back to the
+        # report dataframe column by column.
+        keys_name = [x['name'] for x in self.keys_cfg]
+        keys_from = [x['from'] for x in self.keys_cfg]
+        kpis_from = list(dict.fromkeys(x['from'] for x in self.kpis_cfg))
+
+        df_keys = self.df_report[keys_name]
+        stats = []
+        for df in (self.df_base, self.df_test):
+            df_stats = _get_grouped_statistics(df, keys_from, kpis_from)
+            df_stats.rename(columns=dict(zip(keys_from, keys_name)),
+                            inplace=True)
+            df_stats = df_keys.merge(df_stats, how='left', on=keys_name)
+            stats.append(_get_stacked_statistics(df_stats, self.kpis_cfg))
+        (base, test) = stats
+
+        # calculate the "mean", "%SD" and "%DF"
+        (base_mean, base_pctsd, test_mean, test_pctsd,
+         pctdiff) = _get_statistics(base, test)
+
+        # calculate the significance
+        significance = _get_significance(base, test, self.kpis_cfg)
+
+        # calculate the conclusion
+        codes = _get_conclusion(base_pctsd, test_pctsd, pctdiff, significance,
+                                self.kpis_cfg)
+
+        if self.config.get('defaults', {}).get('use_abbr', False):
+            conclusion = codes
+        else:
+            conclusion = np.vectorize(lambda x: de_abbrs.get(x, x),
+                                      otypes=[object])(codes)
+
+        def _as_column(values):
+            """Keep the integer dtype of the report column.
+
+            The report columns are initialized with 0 and they remain
+            integers unless a value can't be held (such as 0.5 or nan), so
+            that the output (such as "0" rather than "0.0") is kept.
+            """
+            with np.errstate(invalid='ignore'):
+                integral = (np.isfinite(values) & (np.abs(values) < 2**63) &
+                            (values == np.round(values))).all()
+            return values.astype(np.int64) if integral else values
+
+        # update each KPI
+        for (index, kpi_cfg) in enumerate(self.kpis_cfg):
+            kpi_name = kpi_cfg['name']
+            self.df_report[kpi_name + '-BASE-AVG'] = _as_column(
+                base_mean[:, index])
+            self.df_report[kpi_name + '-BASE-%SD'] = _as_column(
+                base_pctsd[:, index])
+            self.df_report[kpi_name + '-TEST-AVG'] = _as_column(
+                test_mean[:, index])
+            self.df_report[kpi_name + '-TEST-%SD'] = _as_column(
+                test_pctsd[:, index])
+            self.df_report[kpi_name + '-%DF'] = _as_column(pctdiff[:, index])
+            self.df_report[kpi_name + '-SGN'] = _as_column(
+                significance[:, index])
+            self.df_report[kpi_name + '-CON'] = conclusion[:, index]
+
+        # get case conclusion if asked
+        if self.config.get('functions', {}).get('case_conclusion', True):
+            conclusions = _get_case_conclusion(codes)
+            if self.config.get('functions', {}).get(
+                    'case_conclusion_abbr', False):
+                conclusions = np.array([abbrs.get(x, x) for x in conclusions],
+                                       dtype=object)
+            self.df_report['Conclusion'] = conclusions
 
     def _format_df_report(self):
         """Format the report dataframe.
@@ -519,8 +633,9 @@ class BenchmarkResultsGenerator():
 
 
 if __name__ == '__main__':
+    ARGS = ARG_PARSER.parse_args()
     gen = BenchmarkResultsGenerator(ARGS)
     # gen.show_vars()
     gen.dump_to_file()
 
-exit(0)
+    exit(0)
@@ -44,8 +44,6 @@ ARG_PARSER.add_argument('--output',
                         default='benchmark_statistics.json',
                         required=False)
 
-ARGS = ARG_PARSER.parse_args()
-
 
 class BenchmarkStatisticsGenerator():
     """Generate benchmark statistics."""
@@ -55,7 +53,7 @@ class BenchmarkStatisticsGenerator():
         self.output = ARGS.output
 
         # Load the benchmark results
-        benchmark_dataframe = pd.read_csv(ARGS.benchmark_csv, index_col=0)
+        benchmark_dataframe = self._load_dataframe(ARGS.benchmark_csv)
         self.benchmark_json = json.loads(
             benchmark_dataframe.to_json(orient="records"))
 
@@ -63,12 +61,12 @@ class BenchmarkStatisticsGenerator():
         self.base_json = self.test_json = None
 
         if ARGS.base_csv:
-            base_dataframe = pd.read_csv(ARGS.base_csv, index_col=0)
+            base_dataframe = self._load_dataframe(ARGS.base_csv)
             self.base_json = json.loads(
                 base_dataframe.to_json(orient="records"))
 
         if ARGS.test_csv:
-            test_dataframe = pd.read_csv(ARGS.test_csv, index_col=0)
+            test_dataframe = self._load_dataframe(ARGS.test_csv)
             self.test_json = json.loads(
                 test_dataframe.to_json(orient="records"))
 
@@ -82,6 +80,18 @@ class BenchmarkStatisticsGenerator():
         # Calculate
         self._parse_data()
 
+    def _load_dataframe(self, source):
+        """Load a dataframe from a CSV file.
+
+        Input:
+            source - the CSV file, or the dataframe (in-process pipeline)
+        Return:
+            The dataframe.
+        """
+        if isinstance(source, pd.DataFrame):
+            return source
+        return pd.read_csv(source, index_col=0)
+
     def _parse_data(self):
         """Parse the statistic data from the results.
 
@@ -230,7 +240,8 @@ class BenchmarkStatisticsGenerator():
 
 
 if __name__ == '__main__':
+    ARGS = ARG_PARSER.parse_args()
     gen = BenchmarkStatisticsGenerator(ARGS)
     gen.dump_to_file()
 
-exit(0)
+    exit(0)
@@ -33,16 +33,17 @@ ARG_PARSER.add_argument('--output',
                         default='benchmark_summary.csv',
                         required=False)
 
-ARGS = ARG_PARSER.parse_args()
-
 
 class BenchmarkSummaryGenerator():
     """Generate benchmark report summary."""
 
     def __init__(self, ARGS):
-        # load the benchmark statistics
-        with open(ARGS.statistics_json, 'r') as f:
-            self.statistics = json.load(f)
+        # load the benchmark statistics (a JSON file or a dict)
+        if isinstance(ARGS.statistics_json, dict):
+            self.statistics = ARGS.statistics_json
+        else:
+            with open(ARGS.statistics_json, 'r') as f:
+                self.statistics = json.load(f)
 
         # parse parameters
         self.output = ARGS.output
@@ -104,7 +105,8 @@ class BenchmarkSummaryGenerator():
 
 
 if __name__ == '__main__':
+    ARGS = ARG_PARSER.parse_args()
     gen = BenchmarkSummaryGenerator(ARGS)
     gen.dump_to_file()
 
-exit(0)
+    exit(0)
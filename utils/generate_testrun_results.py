@@ -8,10 +8,18 @@ import logging
 import json
 import yaml
 import os
+import re
 import pandas as pd
-from jq import jq
+import jq
 import numpy as np
 
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
 LOG = logging.getLogger(__name__)
 logging.basicConfig(level=logging.DEBUG, format='%(levelname)s:%(message)s')
 
@@ -25,7 +33,10 @@ ARG_PARSER.add_argument('--config',
 ARG_PARSER.add_argument('--datastore',
                         dest='datastore',
                         action='store',
-                        help='The json file which contains the datastore.',
+                        help='The json file which contains the datastore, it will be \
+read as JSON Lines if the file name ends with ".jsonl". The columnar sidecar \
+named after it (such as "datastore.parquet") will be read instead if it is \
+available and up to date.',
                         default='datastore.json',
                         required=False)
 ARG_PARSER.add_argument('--metadata',
@@ -47,8 +58,6 @@ ARG_PARSER.add_argument('--output',
                         help='The file to store TestRun results.',
                         default=None,
                         required=False)
-ARGS = ARG_PARSER.parse_args()
-
 
 class TestrunResultsGenerator():
     """Generate TestRun Results according to the customized configuration."""
@@ -59,9 +68,12 @@ class TestrunResultsGenerator():
             c = yaml.safe_load(f)
             self.config = c['testrun_results_generator']
 
-        # load datastore
-        with open(ARGS.datastore, 'r') as f:
-            self.datastore = json.load(f)
+        # load datastore, prefer the columnar sidecar if available
+        self.datastore_file = ARGS.datastore
+        self.datastore = None
+        self.sidecar = self._load_sidecar()
+        if self.sidecar is None:
+            self._load_datastore()
 
         # load metadata
         try:
@@ -82,40 +94,512 @@ class TestrunResultsGenerator():
         self.dataframe = None
         self._parse_data()
 
+    def _load_datastore(self):
+        """Load the datastore (a JSON array, or JSON Lines if named "*.jsonl").
+
+        Input:
+        - self.datastore_file: the datastore file.
+        Output:
+        - self.datastore: datastore.
+        """
+        with open(self.datastore_file, 'r') as f:
+            if self.datastore_file.endswith('.jsonl'):
+                self.datastore = [json.loads(x) for x in f if x.strip()]
+            else:
+                self.datastore = json.load(f)
+
+    def _load_sidecar(self):
+        """Load the columnar sidecar of the datastore.
+
+        The sidecar is the Parquet file named after the datastore file, which
+        is written by gather_testrun_datastore.py. It is used only if it's
+        newer than the datastore file.
+
+        Input:
+        - self.datastore_file: the datastore file.
+        Returns:
+            A pyarrow Table, or None if the sidecar is not available.
+        """
+        sidecar = os.path.splitext(self.datastore_file)[0] + '.parquet'
+
+        if pyarrow is None or not os.path.isfile(sidecar):
+            return None
+
+        if (os.path.isfile(self.datastore_file) and os.path.getmtime(sidecar)
+                < os.path.getmtime(self.datastore_file)):
+            LOG.info('Sidecar "{}" is out of date, ignored.'.format(sidecar))
+            return None
+
+        try:
+            table = pyarrow.parquet.read_table(sidecar, memory_map=True)
+        except Exception as e:
+            LOG.warning('Failed to read sidecar "{}": {}'.format(sidecar, e))
+            return None
+
+        if table.num_rows == 0:
+            return None
+
+        LOG.info('Load datastore from sidecar "{}".'.format(sidecar))
+        return table
+
     def _parse_data(self):
+        self._compile_query_plan()
         self._parse_datastore()
         self._create_dataframe()
         self._format_dataframe()
 
-    def _parse_datastore(self):
-        """Parse data from the datastore into datatable.
+    def _compile_query_plan(self):
+        """Compile the jq expressions into a query plan.
+
+        The simple selectors (see _parse_selector) are merged into a tree
+        by their common prefixes, so that they can be evaluated natively in
+        one walk of each iteration. The other jq expressions are compiled
+        into one jq program, which evaluates them against the same document
+        and outputs an array with an item for each of them. The item is
+        either {"v": [outputs]} or {"e": "error message"}.
 
         Input:
-        - self.datastore: datastore.
         - self.config: customized configuration.
         Output:
-        - self.datatable: datatable to be generated.
+        - self.query_plan: the query plan.
         """
+        selectors = {'children': {}, 'jqexprs': []}
+        native_jqexprs = []
+        jqexprs = []
+
+        for cfg in self.config.get('columns'):
+            if cfg.get('method') == 'query_datastore':
+                exprs = [cfg['jqexpr']]
+            elif cfg.get('method') == 'batch_query_datastore':
+                exprs = cfg['jqexpr']
+            else:
+                continue
 
-        def _query_datastore(jqexpr, iterdata):
-            """Query datastore and return a list."""
-            try:
-                res = jq(jqexpr).transform(iterdata, multiple_output=True)
-                # jq().transform() returns a list of string(s)
-            except Exception as e:
-                if 'Cannot iterate over null' in str(e):
-                    res = [np.nan]
-                else:
-                    LOG.debug('jqexpr: {}; data: {}'.format(jqexpr, iterdata))
-                    LOG.error('Query datastore failed: {}'.format(e))
+            for jqexpr in exprs:
+                if jqexpr in native_jqexprs or jqexpr in jqexprs:
+                    continue
+                try:
+                    jq.compile(jqexpr)
+                except Exception as e:
+                    LOG.error('Failed to compile jqexpr "{}": {}'.format(
+                        jqexpr, e))
                     exit(1)
 
-            return res
+                steps = self._parse_selector(jqexpr)
+                if steps is None:
+                    LOG.debug('Query "{}" with jq.'.format(jqexpr))
+                    jqexprs.append(jqexpr)
+                    continue
+
+                # Add the selector into the tree
+                node = selectors
+                for step in steps:
+                    if step not in node['children']:
+                        node['children'][step] = {
+                            'step': step,
+                            'children': {},
+                            'jqexprs': [],
+                            'subtree': []
+                        }
+                        if step[0] == 'select':
+                            node['children'][step]['literal'] = json.loads(
+                                step[2])
+                    node = node['children'][step]
+                    node['subtree'].append(jqexpr)
+                node['jqexprs'].append(jqexpr)
+                native_jqexprs.append(jqexpr)
+
+        self.query_plan = {
+            'selectors': selectors,
+            'native_jqexprs': native_jqexprs,
+            'jqexprs': jqexprs,
+            'programs': {}
+        }
+
+    def _parse_selector(self, jqexpr):
+        """Parse a jq expression into the steps of a simple selector.
+
+        A simple selector is a pipeline of the following filters:
+        - Object Identifier-Index: ".foo", ".foo.bar"
+        - Array/Object Value Iterator: ".[]", ".foo[]"
+        - Select by equality: 'select(.foo.bar == "value")'
+
+        Returns:
+            A tuple of the steps, or None if it's not a simple selector.
+        """
+        # A bare "[]" is an empty array rather than an iterator
+        re_path = re.compile(r'^\.$|^(?:\.[A-Za-z_]\w*|\.\[\])'
+                             r'(?:\.[A-Za-z_]\w*|\.?\[\])*$')
+        re_select = re.compile(
+            r'^select\(\s*((?:\.[A-Za-z_]\w*)+)\s*==\s*(.+?)\s*\)$')
+        re_step = re.compile(r'\.([A-Za-z_]\w*)|(\[\])')
+
+        steps = []
+        for term in jqexpr.split('|'):
+            term = term.strip()
+
+            m = re_select.match(term)
+            if m:
+                try:
+                    literal = json.loads(m[2])
+                except ValueError:
+                    return None
+                if isinstance(literal, (list, dict, float)):
+                    return None
+                path = tuple(x[0] for x in re_step.findall(m[1]))
+                steps.append(('select', path, json.dumps(literal)))
+                continue
+
+            if not re_path.match(term):
+                return None
+            for key, iterator in re_step.findall(term):
+                steps.append(('iter', ) if iterator else ('key', key))
+
+        return tuple(steps)
+
+    def _walk_selectors(self, node, data, outputs, errors):
+        """Walk the data with the tree of selectors.
+
+        The jq semantics are followed: indexing a null gives null, while
+        indexing or iterating other types is an error. The first error of
+        each selector is recorded as "null" (Cannot iterate over null) or
+        "other", and its outputs are not collected anymore.
+        """
+        for jqexpr in node['jqexprs']:
+            if jqexpr not in errors:
+                outputs[jqexpr].append(data)
+
+        for child in node['children'].values():
+            step = child['step']
+            error = None
+
+            if step[0] == 'iter':
+                if isinstance(data, list):
+                    items = data
+                elif isinstance(data, dict):
+                    items = list(data.values())
+                else:
+                    error = 'null' if data is None else 'other'
+            else:
+                value = data
+                for key in ((step[1], ) if step[0] == 'key' else step[1]):
+                    if isinstance(value, dict):
+                        value = value.get(key)
+                    elif value is not None:
+                        error = 'other'
+                        break
+                if step[0] == 'key':
+                    items = [value]
+                else:
+                    literal = child['literal']
+                    if literal is None or isinstance(literal, (bool, str)):
+                        matched = type(value) is type(literal)
+                    else:
+                        matched = (isinstance(value, (int, float))
+                                   and not isinstance(value, bool))
+                    items = [data] if matched and value == literal else []
+
+            if error:
+                for jqexpr in child['subtree']:
+                    errors.setdefault(jqexpr, error)
+                continue
+
+            for item in items:
+                self._walk_selectors(child, item, outputs, errors)
+
+    def _get_column_field(self, array, key):
+        """Get a field from the column of objects as jq does.
+
+        Returns:
+            The column of the field, or None if it's an error in jq.
+        """
+        if pyarrow.types.is_struct(array.type):
+            index = array.type.get_field_index(key)
+            if index >= 0:
+                # flatten() takes the nulls of the objects into account
+                return array.flatten()[index]
+        elif array.null_count < len(array):
+            return None
+
+        return pyarrow.nulls(len(array))
+
+    def _has_nested_nulls(self, array):
+        """Check if there are nulls inside the objects or arrays in a column.
+
+        Returns:
+            True if any nested value is null, False otherwise.
+        """
+        array = array.filter(array.is_valid())
+
+        if pyarrow.types.is_struct(array.type):
+            children = array.flatten()
+        elif (pyarrow.types.is_list(array.type)
+              or pyarrow.types.is_large_list(array.type)):
+            children = [array.flatten()]
+        else:
+            return pyarrow.types.is_nested(array.type)
+
+        return any(x.null_count or self._has_nested_nulls(x)
+                   for x in children)
+
+    def _walk_columns(self, node, array, owners, outputs, errors):
+        """Walk the columns with the tree of selectors.
+
+        This is the columnar version of _walk_selectors, which walks all
+        the iterations at once. The array holds the values of the current
+        step and the owners are the indices of their iterations. The owners
+        of "Cannot iterate over null" are marked in the errors, and the
+        other errors stop the walk since they can't be handled here.
+
+        Returns:
+            True if the walk is done, or False if it is stopped.
+        """
+        for jqexpr in node['jqexprs']:
+            if self._has_nested_nulls(array):
+                # the missing fields of objects are nulls in columns
+                return False
+            outputs[jqexpr] = (owners, array)
+
+        for child in node['children'].values():
+            step = child['step']
+
+            if step[0] == 'iter':
+                nulls = np.asarray(
+                    array.is_null().to_numpy(zero_copy_only=False))
+                if (pyarrow.types.is_list(array.type)
+                        or pyarrow.types.is_large_list(array.type)):
+                    lengths = pyarrow.compute.list_value_length(array)
+                    lengths = lengths.fill_null(0).to_numpy()
+                    items = array.flatten()
+                    item_owners = np.repeat(owners, lengths)
+                elif nulls.all():
+                    items = pyarrow.nulls(0)
+                    item_owners = owners[:0]
+                else:
+                    return False
+
+                for jqexpr in child['subtree']:
+                    errors[jqexpr][owners[nulls]] = True
+
+            elif step[0] == 'key':
+                items = self._get_column_field(array, step[1])
+                if items is None:
+                    return False
+                item_owners = owners
+
+            else:
+                value = array
+                for key in step[1]:
+                    value = self._get_column_field(value, key)
+                    if value is None:
+                        return False
+
+                # jq compares the values of different types as unequal
+                literal = child['literal']
+                if isinstance(literal, bool):
+                    comparable = pyarrow.types.is_boolean(value.type)
+                elif isinstance(literal, str):
+                    comparable = (pyarrow.types.is_string(value.type)
+                                  or pyarrow.types.is_large_string(value.type))
+                else:
+                    comparable = (pyarrow.types.is_integer(value.type)
+                                  or pyarrow.types.is_floating(value.type))
+
+                if literal is None:
+                    mask = value.is_null()
+                elif comparable:
+                    mask = pyarrow.compute.equal(value, literal).fill_null(
+                        False)
+                else:
+                    mask = pyarrow.array(np.zeros(len(array), dtype=bool))
+
+                items = array.filter(mask)
+                item_owners = owners[mask.to_numpy(zero_copy_only=False)]
+
+            if not self._walk_columns(child, items, item_owners, outputs,
+                                      errors):
+                return False
+
+        return True
+
+    def _query_sidecar(self):
+        """Query the columnar sidecar with the query plan.
+
+        The simple selectors are evaluated on the columns for all the
+        iterations at once. The datastore file will be used instead if
+        there are other jq expressions or any iteration can't give the same
+        output as jq.
+
+        Input:
+        - self.sidecar: the columnar sidecar of the datastore.
+        Returns:
+            A list of (iterdata, queries) for each iteration, or None.
+        """
+        if self.query_plan['jqexprs']:
+            LOG.info('Not all the jq expressions can be evaluated on '
+                     'columns, ignore the sidecar.')
+            return None
+
+        table = self.sidecar
+        num = table.num_rows
+        array = pyarrow.StructArray.from_arrays(
+            [x.combine_chunks() for x in table.columns], table.column_names)
+
+        outputs = {}
+        errors = {x: np.zeros(num, dtype=bool)
+                  for x in self.query_plan['native_jqexprs']}
+        if not self._walk_columns(self.query_plan['selectors'], array,
+                                  np.arange(num), outputs, errors):
+            LOG.info('The sidecar can not be queried as jq does, '
+                     'ignore the sidecar.')
+            return None
+
+        # Split the outputs for each iteration
+        queries_list = [{} for x in range(num)]
+        for jqexpr, (owners, values) in outputs.items():
+            values = values.to_pylist()
+            bounds = np.searchsorted(owners, np.arange(num + 1))
+            for index, queries in enumerate(queries_list):
+                if errors[jqexpr][index]:
+                    queries[jqexpr] = [np.nan]
+                    continue
+                try:
+                    queries[jqexpr] = self._normalize_jq_output(
+                        values[bounds[index]:bounds[index + 1]])
+                except ValueError:
+                    LOG.info('The sidecar can not be queried as jq does, '
+                             'ignore the sidecar.')
+                    return None
+
+        # Get the fields for the source url
+        names = [x for x in ('external_url', 'path_lv_1', 'path_lv_2')
+                 if x in table.column_names]
+        columns = [table.column(x).to_pylist() for x in names]
+        iterdata_list = [dict(zip(names, x)) for x in zip(*columns)]
+        if not names:
+            iterdata_list = [{} for x in range(num)]
+
+        return list(zip(iterdata_list, queries_list))
+
+    def _iter_queries(self):
+        """Iterate the queries of the iterations in the datastore.
+
+        Yields:
+            A tuple of (iterdata, queries) for each iteration, the iterdata
+            may contain only the top level fields if the sidecar is used.
+        """
+        if self.sidecar is not None:
+            queries_list = self._query_sidecar()
+            if queries_list is not None:
+                yield from queries_list
+                return
+
+            if self.datastore is None:
+                self._load_datastore()
+
+        for iterdata in self.datastore:
+            yield iterdata, self._query_datastore(iterdata)
+
+    def _normalize_jq_output(self, value):
+        """Normalize a native value as the output of jq.
+
+        jq outputs the integral numbers as integers. The numbers which jq
+        may not present exactly are not supported.
+
+        Raises:
+            ValueError if the value is not supported.
+        """
+        if isinstance(value, float):
+            if value.is_integer() and abs(value) < 1e15:
+                return int(value)
+            if value.is_integer() or value != value:
+                raise ValueError('Unsupported number: {}'.format(value))
+        elif isinstance(value, bool):
+            pass
+        elif isinstance(value, int):
+            if abs(value) > 2**53:
+                raise ValueError('Unsupported number: {}'.format(value))
+        elif isinstance(value, list):
+            return [self._normalize_jq_output(x) for x in value]
+        elif isinstance(value, dict):
+            return {k: self._normalize_jq_output(v) for k, v in value.items()}
+
+        return value
+
+    def _query_datastore(self, iterdata):
+        """Query datastore with the query plan.
+
+        The simple selectors are evaluated natively, and jq will be used
+        for the other expressions or if a selector can't give the same
+        output as jq.
+
+        Returns:
+            A dict which maps each jq expression to a list.
+        """
+        queries = {}
+        jqexprs = list(self.query_plan['jqexprs'])
+
+        # Walk the iteration with the selectors
+        outputs = {x: [] for x in self.query_plan['native_jqexprs']}
+        errors = {}
+        self._walk_selectors(self.query_plan['selectors'], iterdata, outputs,
+                             errors)
+
+        for jqexpr, res in outputs.items():
+            if errors.get(jqexpr) == 'null':
+                queries[jqexpr] = [np.nan]
+                continue
+            try:
+                if jqexpr not in errors:
+                    queries[jqexpr] = self._normalize_jq_output(res)
+                    continue
+            except ValueError:
+                pass
+            jqexprs.append(jqexpr)
+
+        if not jqexprs:
+            return queries
+
+        # Evaluate the rest of the jq expressions against one document
+        programs = self.query_plan['programs']
+        if tuple(jqexprs) not in programs:
+            program = ', '.join(
+                '(try {{"v": [({})]}} catch {{"e": .}})'.format(x)
+                for x in jqexprs)
+            programs[tuple(jqexprs)] = jq.compile('[{}]'.format(program))
+
+        results = programs[tuple(jqexprs)].input(
+            text=json.dumps(iterdata)).first()
+
+        for jqexpr, result in zip(jqexprs, results):
+            if 'v' in result:
+                queries[jqexpr] = result['v']
+            elif 'Cannot iterate over null' in str(result['e']):
+                queries[jqexpr] = [np.nan]
+            else:
+                LOG.debug('jqexpr: {}; data: {}'.format(jqexpr, iterdata))
+                LOG.error('Query datastore failed: {}'.format(result['e']))
+                exit(1)
+
+        return queries
+
+    def _parse_datastore(self):
+        """Parse data from the datastore into datatable.
+
+        Input:
+        - self.datastore: datastore, or
+        - self.sidecar: the columnar sidecar of the datastore.
+        - self.config: customized configuration.
+        Output:
+        - self.datatable: datatable to be generated.
+        """
 
         # Build the datatable
         self.datatable = []
 
-        for iterdata in self.datastore:
+        # Query datastore for all the columns
+        for iterdata, queries in self._iter_queries():
+
             # Build the row
             row = {}
             split_info = {}
@@ -131,7 +615,7 @@ class TestrunResultsGenerator():
 
                 elif method == 'query_datastore':
                     # Query datastore
-                    res = _query_datastore(cfg['jqexpr'], iterdata)
+                    res = queries[cfg['jqexpr']]
 
                     # Process data
                     if 'factor' in cfg:
@@ -151,7 +635,7 @@ class TestrunResultsGenerator():
                     # Batch query datastore
                     array = []
                     for jqexpr in cfg['jqexpr']:
-                        res = _query_datastore(jqexpr, iterdata)
+                        res = queries[jqexpr]
                         data = res if len(res) > 1 else res[0]
                         array.append(data)
 
@@ -295,7 +779,8 @@ class TestrunResultsGenerator():
 
 
 if __name__ == '__main__':
+    ARGS = ARG_PARSER.parse_args()
     gen = TestrunResultsGenerator(ARGS)
     gen.dump_to_file()
 
-exit(0)
+    exit(0)
@@ -0,0 +1,517 @@
+#!/usr/bin/env python3
+"""
+Generate the benchmark report in a single process.
+
+The report is generated by a DAG of stages, a stage depends on its input
+files and on the outputs of its upstream stages:
+    testrun results (BASE and TEST) -> benchmark results -> statistics ->
+    summary, metadata, parameters -> HTML (optional)
+
+The results are passed to the next stage in memory instead of being read
+back from the disk, and the output files are the same as running the
+scripts one by one.
+
+The fingerprint of the inputs of each stage is recorded in the manifest of
+the workspace, a stage is executed only if its fingerprint changed (or its
+outputs are missing or modified), so that regenerating a report after
+editing "generate_benchmark_results.yaml" doesn't parse the testruns again.
+A stage which produces the same outputs doesn't trigger the downstream.
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import subprocess
+import pandas as pd
+
+import generate_testrun_results
+import generate_benchmark_results
+import generate_benchmark_metadata
+import generate_benchmark_parameters
+import generate_benchmark_statistics
+import generate_benchmark_summary
+
+LOG = logging.getLogger(__name__)
+logging.basicConfig(level=logging.DEBUG, format='%(levelname)s:%(message)s')
+
+ARG_PARSER = argparse.ArgumentParser(
+    description='Generate the benchmark report in a single process.')
+ARG_PARSER.add_argument('--workspace',
+                        dest='workspace',
+                        action='store',
+                        help='The workspace of the benchmark report.',
+                        default='.',
+                        required=False)
+ARG_PARSER.add_argument('--force',
+                        dest='force',
+                        action='store_true',
+                        help='Execute all the stages even if they are up to \
+date.',
+                        required=False)
+ARG_PARSER.add_argument('--html',
+                        dest='html',
+                        action='store_true',
+                        help='Generate the HTML report as well.',
+                        required=False)
+
+# The files in the workspace
+BASE_TESTRUN_YAML = 'base.generate_testrun_results.yaml'
+TEST_TESTRUN_YAML = 'test.generate_testrun_results.yaml'
+METADATA_YAML = 'generate_benchmark_metadata.yaml'
+BENCHMARK_YAML = 'generate_benchmark_results.yaml'
+
+BASE_DATASTORE = 'base.datastore.json'
+TEST_DATASTORE = 'test.datastore.json'
+BASE_METADATA = 'base.metadata.json'
+TEST_METADATA = 'test.metadata.json'
+
+BASE_TESTRUN_RESULT = 'base.testrun_result.csv'
+TEST_TESTRUN_RESULT = 'test.testrun_result.csv'
+METADATA = 'benchmark_metadata.csv'
+BENCHMARK = 'benchmark_results.csv'
+PARAMETERS = 'benchmark_parameters.csv'
+STATISTICS = 'benchmark_statistics.json'
+SUMMARY = 'benchmark_summary.csv'
+
+PORTAL = 'report_portal.ipynb'
+DESCRIPTION = 'benchmark_description.md'
+INTRODUCTION = 'testrun_introduction.md'
+HTML_SCRIPT = os.path.join('utils', 'html_report.sh')
+REPORT_NOTEBOOK = 'report.ipynb'
+REPORT_HTML = 'report.html'
+
+# The manifest of the fingerprints
+MANIFEST = '.report_pipeline.json'
+
+
+def get_stage_args(module, **kwargs):
+    """Get the arguments of a stage.
+
+    Input:
+        module - the module of the stage
+        kwargs - the arguments to be set, keyed by the dest names
+    Return:
+        The arguments, with the defaults of the command line.
+    """
+    args = module.ARG_PARSER.parse_args([])
+    for key, value in kwargs.items():
+        setattr(args, key, value)
+    return args
+
+
+def load_csv(text):
+    """Load a dataframe from the CSV text.
+
+    The stages exchange the dataframes in the way they are loaded from the
+    CSV files (such as the NaN values and the dtypes), so that the results
+    are the same as running the scripts one by one.
+
+    Input:
+        text - the CSV text
+    Return:
+        The dataframe.
+    """
+    return pd.read_csv(io.StringIO(text), index_col=0)
+
+
+def is_up_to_date(target, sources):
+    """Check if the target exists and is newer than all the sources."""
+    if not os.path.exists(target):
+        return False
+    return all(os.path.getmtime(target) >= os.path.getmtime(x)
+               for x in sources)
+
+
+def run_testrun_results(config, datastore, metadata, output=None):
+    """Generate the testrun results.
+
+    Input:
+        config    - the config file
+        datastore - the datastore file
+        metadata  - the metadata file
+        output    - the CSV file to write, or None
+    Return:
+        The testrun results dataframe.
+    """
+    gen = generate_testrun_results.TestrunResultsGenerator(
+        get_stage_args(generate_testrun_results,
+                       config=config,
+                       datastore=datastore,
+                       metadata=metadata,
+                       output=output,
+                       output_format='csv'))
+
+    text = gen.dataframe.to_csv()
+    if output:
+        with open(output, 'w') as f:
+            f.write(text)
+
+    return load_csv(text)
+
+
+def run_benchmark_results(config, test, base, output=None):
+    """Generate the benchmark results.
+
+    Input:
+        config - the config file
+        test   - the testrun results dataframe for TEST
+        base   - the testrun results dataframe for BASE
+        output - the CSV file to write, or None
+    Return:
+        The benchmark results dataframe.
+    """
+    gen = generate_benchmark_results.BenchmarkResultsGenerator(
+        get_stage_args(generate_benchmark_results,
+                       config=config,
+                       test=test,
+                       base=base,
+                       output=output,
+                       output_format='csv'))
+
+    text = gen.df_report.to_csv()
+    if output:
+        with open(output, 'w') as f:
+            f.write(text)
+
+    return load_csv(text)
+
+
+def run_benchmark_metadata(config, test, base, output):
+    """Generate the metadata comparison.
+
+    Input:
+        config - the config file
+        test   - the metadata file for TEST
+        base   - the metadata file for BASE
+        output - the CSV file to write
+    Return:
+        The metadata comparison dataframe.
+    """
+    gen = generate_benchmark_metadata.MetadataComparisonGenerator(
+        get_stage_args(generate_benchmark_metadata,
+                       config=config,
+                       test=test,
+                       base=base,
+                       output=output,
+                       output_format='csv'))
+    gen.dump_to_file()
+
+    return gen.dataframe
+
+
+def run_benchmark_parameters(config, output):
+    """Generate the benchmark parameters.
+
+    Input:
+        config - the benchmark config file
+        output - the CSV file to write
+    Return:
+        The benchmark parameters dataframe.
+    """
+    gen = generate_benchmark_parameters.BenchmarkParametersGenerator(
+        get_stage_args(generate_benchmark_parameters,
+                       config=config,
+                       output=output,
+                       output_format='csv'))
+    gen.dump_to_file()
+
+    return gen.dataframe
+
+
+def run_benchmark_statistics(benchmark, output):
+    """Generate the benchmark statistics.
+
+    Input:
+        benchmark - the benchmark results dataframe
+        output    - the JSON file to write
+    Return:
+        The benchmark statistics.
+    """
+    gen = generate_benchmark_statistics.BenchmarkStatisticsGenerator(
+        get_stage_args(generate_benchmark_statistics,
+                       benchmark_csv=benchmark,
+                       output=output))
+    gen.dump_to_file()
+
+    return gen.statistics
+
+
+def run_benchmark_summary(statistics, output):
+    """Generate the benchmark summary.
+
+    Input:
+        statistics - the benchmark statistics
+        output     - the CSV file to write
+    Return:
+        The benchmark summary dataframe.
+    """
+    gen = generate_benchmark_summary.BenchmarkSummaryGenerator(
+        get_stage_args(generate_benchmark_summary,
+                       statistics_json=statistics,
+                       output=output,
+                       output_format='csv'))
+    gen.dump_to_file()
+
+    return gen.dataframe
+
+
+def run_html_report(workspace):
+    """Generate the HTML report by executing the report portal.
+
+    Input:
+        workspace - the workspace of the benchmark report
+    """
+    subprocess.run(['/bin/bash', '-x', os.path.join(workspace, HTML_SCRIPT),
+                    workspace], check=True)
+
+
+def load_json(path):
+    """Load the JSON file."""
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+class Stage():
+    """A stage of the pipeline.
+
+    Input:
+        name    - the name of the stage
+        inputs  - the input files (including the code of the stage)
+        outputs - the output files
+        run     - the function to execute the stage, it takes a function
+                  to get the results of the upstream stages by names and
+                  returns the result of the stage
+        load    - the function to load the result from the outputs
+        deps    - the names of the upstream stages
+    """
+
+    def __init__(self, name, inputs, outputs, run, load=None, deps=()):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.run = run
+        self.load = load
+        self.deps = deps
+
+
+class Manifest():
+    """The manifest of the fingerprints in the workspace.
+
+    The hashes of the files are cached with their sizes and mtimes, so that
+    the files (such as the datastores) are read only if they changed.
+    """
+
+    def __init__(self, workspace):
+        self.workspace = workspace
+        self.file = os.path.join(workspace, MANIFEST)
+        try:
+            with open(self.file, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {}
+        except Exception as err:
+            LOG.warning('Failed to load "{}", ignored. error: {}'.format(
+                self.file, err))
+            data = {}
+        self.files = data.get('files', {})
+        self.stages = data.get('stages', {})
+
+    def get_hash(self, path):
+        """Get the SHA256 of the file, or None if it does not exist."""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+
+        # The code files may be out of the workspace
+        name = os.path.relpath(path, self.workspace)
+        cached = self.files.get(name)
+        if cached and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return cached[2]
+
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(chunk)
+        self.files[name] = [stat.st_size, stat.st_mtime_ns, sha.hexdigest()]
+        return sha.hexdigest()
+
+    def get_hashes(self, paths):
+        """Get the hashes of the files keyed by the relative paths (or the
+        basenames of the files out of the workspace)."""
+        hashes = {}
+        for path in paths:
+            name = os.path.relpath(path, self.workspace)
+            if name.startswith(os.pardir):
+                name = os.path.basename(path)
+            hashes[name] = self.get_hash(path)
+        return hashes
+
+    def save(self):
+        temp_file = '{}.{}.tmp'.format(self.file, os.getpid())
+        with open(temp_file, 'w') as f:
+            json.dump({'files': self.files, 'stages': self.stages}, f,
+                      indent=3)
+        os.replace(temp_file, self.file)
+
+
+def get_stages(workspace='.'):
+    """Get the stages of the pipeline in the order of execution.
+
+    Input:
+        workspace - the workspace of the benchmark report
+    Return:
+        A list of the stages, the upstream stages come first.
+    """
+    def _path(filename):
+        return os.path.join(workspace, filename)
+
+    def _read_csv(filename):
+        return lambda: pd.read_csv(_path(filename), index_col=0)
+
+    stages = []
+
+    for prefix, yaml_file, datastore, metadata, output in (
+        ('base', BASE_TESTRUN_YAML, BASE_DATASTORE, BASE_METADATA,
+         BASE_TESTRUN_RESULT),
+        ('test', TEST_TESTRUN_YAML, TEST_DATASTORE, TEST_METADATA,
+         TEST_TESTRUN_RESULT)):
+        stages.append(Stage(
+            prefix,
+            inputs=(_path(datastore), _path(metadata), _path(yaml_file),
+                    generate_testrun_results.__file__),
+            outputs=(_path(output),),
+            run=lambda get, args=(_path(yaml_file), _path(datastore),
+                                  _path(metadata), _path(output)):
+                run_testrun_results(*args),
+            load=_read_csv(output)))
+
+    stages.append(Stage(
+        'benchmark',
+        inputs=(_path(BENCHMARK_YAML), generate_benchmark_results.__file__),
+        outputs=(_path(BENCHMARK),),
+        run=lambda get: run_benchmark_results(
+            _path(BENCHMARK_YAML), get('test'), get('base'),
+            _path(BENCHMARK)),
+        load=_read_csv(BENCHMARK),
+        deps=('test', 'base')))
+    stages.append(Stage(
+        'metadata',
+        inputs=(_path(METADATA_YAML), _path(TEST_METADATA),
+                _path(BASE_METADATA), generate_benchmark_metadata.__file__),
+        outputs=(_path(METADATA),),
+        run=lambda get: run_benchmark_metadata(
+            _path(METADATA_YAML), _path(TEST_METADATA),
+            _path(BASE_METADATA), _path(METADATA)),
+        load=_read_csv(METADATA)))
+    stages.append(Stage(
+        'parameters',
+        inputs=(_path(BENCHMARK_YAML),
+                generate_benchmark_parameters.__file__),
+        outputs=(_path(PARAMETERS),),
+        run=lambda get: run_benchmark_parameters(
+            _path(BENCHMARK_YAML), _path(PARAMETERS)),
+        load=_read_csv(PARAMETERS)))
+    stages.append(Stage(
+        'statistics',
+        inputs=(generate_benchmark_statistics.__file__,),
+        outputs=(_path(STATISTICS),),
+        run=lambda get: run_benchmark_statistics(
+            get('benchmark'), _path(STATISTICS)),
+        load=lambda: load_json(_path(STATISTICS)),
+        deps=('benchmark',)))
+    stages.append(Stage(
+        'summary',
+        inputs=(generate_benchmark_summary.__file__,),
+        outputs=(_path(SUMMARY),),
+        run=lambda get: run_benchmark_summary(
+            get('statistics'), _path(SUMMARY)),
+        load=_read_csv(SUMMARY),
+        deps=('statistics',)))
+
+    # The report portal reads the outputs of the stages from the disk
+    stages.append(Stage(
+        'html',
+        inputs=(_path(PORTAL), _path(DESCRIPTION), _path(INTRODUCTION),
+                _path(HTML_SCRIPT), _path(BENCHMARK_YAML),
+                _path(TEST_METADATA), _path(BASE_METADATA)),
+        outputs=(_path(REPORT_NOTEBOOK), _path(REPORT_HTML)),
+        run=lambda get: run_html_report(workspace),
+        deps=('base', 'test', 'benchmark', 'metadata', 'parameters',
+              'statistics', 'summary')))
+
+    return stages
+
+
+def run_pipeline(workspace='.', force=False, html=False):
+    """Generate the benchmark report in the workspace.
+
+    The stages which are up to date are skipped. A stage without a record
+    in the manifest (such as the testrun results delivered from the cache)
+    is considered up to date if its outputs are newer than its inputs.
+
+    Input:
+        workspace - the workspace of the benchmark report
+        force     - execute all the stages even if they are up to date
+        html      - generate the HTML report as well
+    Return:
+        A list of the names of the executed stages.
+    """
+    manifest = Manifest(workspace)
+    stages = {x.name: x for x in get_stages(workspace)
+              if html or x.name != 'html'}
+
+    results = {}
+
+    def _get(name):
+        if name not in results:
+            results[name] = stages[name].load()
+        return results[name]
+
+    executed = []
+    for stage in stages.values():
+        dep_outputs = [x for dep in stage.deps for x in stages[dep].outputs]
+        outputs = manifest.get_hashes(stage.outputs)
+        fingerprint = hashlib.sha256(json.dumps([
+            stage.name,
+            manifest.get_hashes(stage.inputs),
+            manifest.get_hashes(dep_outputs)], sort_keys=True).encode()
+        ).hexdigest()
+        record = manifest.stages.get(stage.name)
+
+        if not force and None not in outputs.values():
+            if record == {'fingerprint': fingerprint, 'outputs': outputs}:
+                LOG.info('Stage "{}" is up to date.'.format(stage.name))
+                continue
+            if record is None and \
+                    not any(x in executed for x in stage.deps) and \
+                    all(is_up_to_date(x, [
+                        y for y in stage.inputs + tuple(dep_outputs)
+                        if os.path.exists(y)]) for x in stage.outputs):
+                LOG.info('Stage "{}" is up to date (by mtimes).'.format(
+                    stage.name))
+                manifest.stages[stage.name] = {'fingerprint': fingerprint,
+                                               'outputs': outputs}
+                manifest.save()
+                continue
+
+        LOG.info('Execute stage "{}".'.format(stage.name))
+        results[stage.name] = stage.run(_get)
+        executed.append(stage.name)
+
+        manifest.stages[stage.name] = {
+            'fingerprint': fingerprint,
+            'outputs': manifest.get_hashes(stage.outputs)}
+        manifest.save()
+
+    return executed
+
+
+if __name__ == '__main__':
+    ARGS = ARG_PARSER.parse_args()
+    run_pipeline(ARGS.workspace, ARGS.force, ARGS.html)
+
+    exit(0)